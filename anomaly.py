@@ -0,0 +1,147 @@
+# Online HRV / resting heart rate anomaly detection, run by transfer.py during import
+import math
+import os
+from typing import Dict, List, Optional, Tuple
+
+# Record type -> metric name
+METRIC_TYPES = {
+    "HKQuantityTypeIdentifierHeartRateVariabilitySDNN": "hrv",
+    "HKQuantityTypeIdentifierRestingHeartRate": "resting_hr",
+}
+
+# EWMA span in readings (alpha = 2 / (span + 1)): HRV is sampled several
+# times a day, resting HR once, so both cover roughly the last month
+SPANS = {"hrv": 90, "resting_hr": 30}
+# |z| at or above which a reading is an anomaly, and readings needed before flagging
+Z_THRESHOLD = float(os.getenv("ANOMALY_Z_THRESHOLD", "3.5"))
+MIN_READINGS = int(os.getenv("ANOMALY_MIN_READINGS", "20"))
+
+TS_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+_LOAD_SQL = "SELECT metric, n, mean, var, last_ts FROM anomaly_state WHERE user_id = %s"
+
+_SAVE_SQL = """
+    INSERT INTO anomaly_state (user_id, metric, n, mean, var, last_ts)
+    VALUES (%s, %s, %s, %s, %s, %s)
+    ON DUPLICATE KEY UPDATE n = VALUES(n), mean = VALUES(mean), var = VALUES(var), last_ts = VALUES(last_ts)
+"""
+
+# One event per user, metric, day and direction; further readings that day
+# raise the count and keep the most extreme one
+_EVENT_SQL = """
+    INSERT INTO anomaly_event (user_id, metric, day, direction, first_at, value, baseline, stddev, z_score, readings)
+    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, 1)
+    ON DUPLICATE KEY UPDATE
+      readings = readings + 1,
+      value = IF(ABS(VALUES(z_score)) > ABS(z_score), VALUES(value), value),
+      baseline = IF(ABS(VALUES(z_score)) > ABS(z_score), VALUES(baseline), baseline),
+      stddev = IF(ABS(VALUES(z_score)) > ABS(z_score), VALUES(stddev), stddev),
+      z_score = IF(ABS(VALUES(z_score)) > ABS(z_score), VALUES(z_score), z_score)
+"""
+
+
+class EwmaState:
+    """Exponentially weighted mean and variance of one metric, updated in O(1)"""
+
+    __slots__ = ("n", "mean", "var", "last_ts", "dirty")
+
+    def __init__(self, n: int = 0, mean: float = 0.0, var: float = 0.0, last_ts: Optional[str] = None):
+        self.n = n
+        self.mean = mean
+        self.var = var
+        self.last_ts = last_ts
+        self.dirty = False
+
+    def update(self, x: float, alpha: float) -> Optional[float]:
+        """Fold in x; returns its z-score against the state before the update (None while warming up)"""
+        self.dirty = True
+        if self.n == 0:
+            self.n, self.mean, self.var = 1, x, 0.0
+            return None
+        sd = math.sqrt(self.var)
+        z = (x - self.mean) / sd if sd > 0 else None
+        if self.n < MIN_READINGS:
+            z = None
+        # Anomalies are winsorized before updating so one spike cannot drag the baseline
+        if z is not None and abs(z) >= Z_THRESHOLD:
+            x = self.mean + math.copysign(Z_THRESHOLD * sd, z)
+        # During warm-up a plain running average gives a stable starting point
+        a = max(alpha, 1.0 / (self.n + 1))
+        diff = x - self.mean
+        incr = a * diff
+        self.mean += incr
+        self.var = (1 - a) * (self.var + diff * incr)
+        self.n += 1
+        return z
+
+
+class AnomalyDetector:
+    """Per-user detector state for one import
+
+    State is loaded once. Records at or before a metric's last timestamp as
+    loaded were seen by an earlier import (exports always contain the full
+    history) and are skipped, so re-importing never rescans or double-counts.
+    export.xml groups records by type and source rather than by time, so the
+    newer readings are buffered per metric and only folded into the EWMA, in
+    timestamp order, by `flush`. That runs once in the import's final
+    transaction, so the saved watermark only moves when the import commits
+    and a failed import is retried from the same point. The buffer holds a
+    timestamp and value per reading, a few per day of new history.
+
+    Timestamps are transfer.parse_dt's 'YYYY-MM-DD HH:MM:SS' UTC strings,
+    which order correctly as strings.
+    """
+
+    def __init__(self, cur, user_id: int):
+        self.user_id = user_id
+        self.states: Dict[str, EwmaState] = {}
+        self.pending: Dict[str, List[Tuple[str, float, object]]] = {}
+        self.events: List[Tuple] = []
+        self.detected = 0
+        # Newest timestamp per metric processed by earlier imports
+        self.watermarks: Dict[str, str] = {}
+        cur.execute(_LOAD_SQL, (user_id,))
+        for metric, n, mean, var, last_ts in cur.fetchall():
+            self.states[metric] = EwmaState(n, float(mean), float(var), last_ts.strftime(TS_FORMAT))
+            self.watermarks[metric] = self.states[metric].last_ts
+
+    def observe(self, record_type: Optional[str], ts: Optional[str], value):
+        """Buffer a reading newer than its metric's watermark"""
+        metric = METRIC_TYPES.get(record_type)
+        if metric is None or ts is None or value is None:
+            return
+        watermark = self.watermarks.get(metric)
+        if watermark is not None and ts <= watermark:
+            return
+        self.pending.setdefault(metric, []).append((ts, float(value), value))
+
+    def _process(self):
+        """Fold the buffered readings into each metric's EWMA in timestamp order"""
+        for metric, readings in self.pending.items():
+            state = self.states.get(metric)
+            if state is None:
+                state = self.states[metric] = EwmaState()
+            alpha = 2.0 / (SPANS[metric] + 1)
+            readings.sort(key=lambda r: r[0])
+            for ts, x, value in readings:
+                baseline, sd = state.mean, math.sqrt(state.var)
+                z = state.update(x, alpha)
+                state.last_ts = ts
+                if z is not None and abs(z) >= Z_THRESHOLD:
+                    direction = "high" if z > 0 else "low"
+                    self.events.append((self.user_id, metric, ts[:10], direction, ts, value, baseline, sd, z))
+                    self.detected += 1
+        self.pending = {}
+
+    def flush(self, cur):
+        """Process the buffered readings and write events and state in the caller's (final) transaction"""
+        self._process()
+        if self.events:
+            cur.executemany(_EVENT_SQL, self.events)
+            self.events = []
+        rows = [(self.user_id, metric, s.n, s.mean, s.var, s.last_ts)
+                for metric, s in self.states.items() if s.dirty]
+        if rows:
+            cur.executemany(_SAVE_SQL, rows)
+        for s in self.states.values():
+            s.dirty = False
@@ -0,0 +1 @@
+# End-to-end API benchmarks: seeded datasets, dashboard/chat traffic mixes and committed baselines
@@ -0,0 +1,103 @@
+# Seeded benchmark datasets: synthetic users with a fixed history length each
+import random
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Tuple
+
+from database import get_connection
+from chat_loadtest import PASSWORD_HASH
+
+BENCH_PREFIX = "bench_"
+# Password of every seeded user (PASSWORD_HASH is its SHA-256)
+BENCH_PASSWORD = "abcd"
+
+# name -> (users, days of history)
+DATASETS: Dict[str, Tuple[int, int]] = {
+    "small": (4, 90),
+    "medium": (16, 365),
+    "large": (32, 3 * 365),
+}
+
+_HRV_SQL = ("INSERT INTO hrv (user_id, value, unit, creation_date, start_date, end_date) "
+            "VALUES (%s, %s, %s, %s, %s, %s)")
+_HR_SQL = ("INSERT IGNORE INTO health_sample (user_id, sample_type, avg_value, min_value, max_value, unit, "
+           "start_time, end_time) VALUES (%s, %s, %s, %s, %s, %s, %s, %s)")
+_ACTIVITY_SQL = ("INSERT INTO activity_summary (user_id, date, active_energy_burned, move_time, exercise_time, "
+                 "stand_hours) VALUES (%s, %s, %s, %s, %s, %s)")
+_WORKOUT_SQL = ("INSERT INTO workout (user_id, activity_type, duration, duration_unit, total_distance, "
+                "total_distance_unit, total_energy_burned, total_energy_burned_unit, start_date, end_date, "
+                "source_name) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)")
+_SLEEP_SQL = ("INSERT IGNORE INTO sleep_session (user_id, night, in_bed_start, in_bed_end, onset, wake, asleep_min, "
+              "awake_min, in_bed_min, core_min, deep_min, rem_min, unspecified_min, efficiency) "
+              "VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)")
+
+
+def username(dataset: str, index: int) -> str:
+    return f"{BENCH_PREFIX}{dataset}_{index}"
+
+
+def _history(user_id: int, days: int, rng: random.Random) -> Dict[str, List[tuple]]:
+    """Rows of `days` days ending today, shaped like an imported export"""
+    today = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
+    rows: Dict[str, List[tuple]] = {"hrv": [], "hr": [], "activity": [], "workout": [], "sleep": []}
+    for d in range(days):
+        day = today - timedelta(days=d)
+        for h in (2, 8, 14, 20):
+            ts = day + timedelta(hours=h)
+            rows["hrv"].append((user_id, round(rng.gauss(48, 9), 2), "ms", ts, ts, ts + timedelta(minutes=1)))
+        # One row per day, keyed by DATE(start) as the health_record trigger aggregates them
+        readings = [rng.gauss(68 if 8 <= h < 22 else 56, 5) for h in range(0, 24, 2)]
+        rows["hr"].append((user_id, "heart_rate", round(sum(readings) / len(readings), 2),
+                           round(min(readings) - 12, 2), round(max(readings) + 40, 2), "count/min", day, day))
+        rows["activity"].append((user_id, day.date(), round(rng.uniform(250, 750), 2),
+                                 rng.randint(20, 90), rng.randint(5, 70), rng.randint(6, 14)))
+        if rng.random() < 0.5:
+            start = day + timedelta(hours=7)
+            rows["workout"].append((user_id, "HKWorkoutActivityTypeRunning", round(rng.uniform(20, 60), 2), "min",
+                                    round(rng.uniform(3, 12), 2), "km", round(rng.uniform(200, 700), 2), "kcal",
+                                    start, start + timedelta(minutes=40), "Benchmark"))
+        in_bed = day - timedelta(hours=rng.uniform(1, 2.5))
+        in_bed_min = rng.uniform(390, 540)
+        awake = rng.uniform(10, 40)
+        asleep = in_bed_min - awake
+        deep, rem = asleep * rng.uniform(0.1, 0.2), asleep * rng.uniform(0.18, 0.25)
+        onset = in_bed + timedelta(minutes=rng.uniform(5, 25))
+        wake = in_bed + timedelta(minutes=in_bed_min)
+        rows["sleep"].append((user_id, wake.date(), in_bed, wake, onset, wake, round(asleep, 1), round(awake, 1),
+                              round(in_bed_min, 1), round(asleep - deep - rem, 1), round(deep, 1), round(rem, 1),
+                              0, round(asleep / in_bed_min, 3)))
+    return rows
+
+
+def seed(dataset: str, users: int, days: int, seed: int = 0) -> List[Dict[str, Any]]:
+    """Create (or reuse) the dataset's users; returns [{user_id, username, password}]
+
+    Users are keyed by dataset name, so re-running with the same name reuses
+    the rows already there instead of adding more history to them.
+    """
+    rng = random.Random(seed)
+    seeded = []
+    cnx = get_connection()
+    try:
+        cur = cnx.cursor()
+        for i in range(users):
+            name = username(dataset, i)
+            cur.execute("SELECT user_id FROM user WHERE username=%s", (name,))
+            row = cur.fetchone()
+            if row:
+                seeded.append({"user_id": row[0], "username": name, "password": BENCH_PASSWORD})
+                continue
+            cur.execute("INSERT INTO user (username, name, password) VALUES (%s, %s, %s)",
+                        (name, f"Benchmark {dataset} {i}", PASSWORD_HASH))
+            user_id = cur.lastrowid
+            rows = _history(user_id, days, rng)
+            for sql, key in ((_HRV_SQL, "hrv"), (_HR_SQL, "hr"), (_ACTIVITY_SQL, "activity"),
+                             (_WORKOUT_SQL, "workout"), (_SLEEP_SQL, "sleep")):
+                if rows[key]:
+                    cur.executemany(sql, rows[key])
+            cnx.commit()
+            print(f"Seeded {name}: {days} days")
+            seeded.append({"user_id": user_id, "username": name, "password": BENCH_PASSWORD})
+        cur.close()
+    finally:
+        cnx.close()
+    return seeded
@@ -0,0 +1,232 @@
+#!/usr/bin/env python3
+"""
+End-to-end API benchmark: seeded users driving dashboard and chat traffic.
+
+Seeds a dataset into the configured database, then replays a weighted traffic
+mix against the app at each concurrency level. By default the app runs in
+this process (its lifespan included) with LLM_BACKEND=stub; --url targets a
+running server instead (start it with LLM_BACKEND=stub). Reports throughput
+and p50/p95/p99 per endpoint plus DB queries per request, taken from the
+Server-Timing header, and compares them with benchmarks/baselines/.
+
+Example:
+    python3 -m benchmarks.run --dataset small --mix dashboard --concurrency 1,4,16 --requests 400
+    python3 -m benchmarks.run --dataset medium --mix mixed --save-baseline
+    python3 -m benchmarks.run --dataset medium --mix mixed --compare --tolerance 0.25
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import random
+import re
+import sys
+import time
+from collections import defaultdict
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+os.environ.setdefault("LLM_BACKEND", "stub")
+
+import httpx
+
+from benchmarks.datasets import DATASETS, seed
+from benchmarks.traffic import CHAT, Client, Step, draw
+from chat_loadtest import percentile
+
+BASELINE_DIR = Path(__file__).resolve().parent / "baselines"
+# p95 increases smaller than this are noise, whatever the tolerance says
+MIN_REGRESSION_MS = 2.0
+# Allowed increase in mean DB queries per request before it counts as a regression
+QUERY_SLACK = 0.5
+
+_QUERIES_RE = re.compile(r'desc="(\d+) queries"')
+
+Sample = Tuple[float, int, Optional[int]]
+
+
+async def send(http: httpx.AsyncClient, client: Client, name: str, step: Step,
+               samples: Dict[str, List[Sample]]):
+    """Send one step and record (ms, status, db queries); opens a chat first when the step needs one"""
+    if name.startswith("chat_") and name not in ("chat_new", "chat_list") and client.chat_id is None:
+        await send(http, client, "chat_new", CHAT["chat_new"][1], samples)
+        if client.chat_id is None:
+            return
+    request = step(client)
+    start = time.perf_counter()
+    queries = None
+    try:
+        response = await http.request(request.method, request.path, params=request.params, json=request.json,
+                                      auth=(client.user["username"], client.user["password"]))
+        status = response.status_code
+        match = _QUERIES_RE.search(response.headers.get("server-timing", ""))
+        queries = int(match.group(1)) if match else None
+        if name == "chat_new" and status == 200:
+            client.chat_id = response.json()["chat_id"]
+    except httpx.HTTPError as e:
+        print(f"{name}: {e}")
+        status = 0
+    samples[name].append(((time.perf_counter() - start) * 1000, status, queries))
+
+
+async def run_level(http: httpx.AsyncClient, users: List[Dict[str, Any]], days: int, mix: str,
+                    concurrency: int, requests: int, seed_value: int) -> Dict[str, Any]:
+    """`requests` requests shared by `concurrency` clients, each waiting for its last response"""
+    samples: Dict[str, List[Sample]] = defaultdict(list)
+    clients = [Client(users[i % len(users)], days, random.Random(seed_value * 10007 + i))
+               for i in range(concurrency)]
+    taken = itertools.count()
+
+    async def session(client: Client):
+        while next(taken) < requests:
+            name, step = draw(mix, client.rng)
+            await send(http, client, name, step, samples)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(session(c) for c in clients))
+    elapsed = time.perf_counter() - start
+    return summarize(samples, elapsed, concurrency)
+
+
+def summarize(samples: Dict[str, List[Sample]], elapsed: float, concurrency: int) -> Dict[str, Any]:
+    endpoints = {}
+    ok_total = errors_total = 0
+    for name, rows in sorted(samples.items()):
+        ok = [ms for ms, status, _ in rows if 0 < status < 400]
+        queries = [q for _, _, q in rows if q is not None]
+        errors = len(rows) - len(ok)
+        ok_total += len(ok)
+        errors_total += errors
+        endpoints[name] = {
+            "count": len(rows),
+            "errors": errors,
+            "p50_ms": round(percentile(ok, 50), 2),
+            "p95_ms": round(percentile(ok, 95), 2),
+            "p99_ms": round(percentile(ok, 99), 2),
+            "db_queries": round(sum(queries) / len(queries), 2) if queries else None,
+        }
+    return {
+        "concurrency": concurrency,
+        "elapsed_s": round(elapsed, 3),
+        "throughput_rps": round(ok_total / elapsed, 2) if elapsed else 0.0,
+        "errors": errors_total,
+        "endpoints": endpoints,
+    }
+
+
+async def bench(args, users: List[Dict[str, Any]], days: int) -> List[Dict[str, Any]]:
+    levels = [int(c) for c in args.concurrency.split(",")]
+
+    async def drive(http: httpx.AsyncClient) -> List[Dict[str, Any]]:
+        if args.warmup:
+            await run_level(http, users, days, args.mix, 1, args.warmup, args.seed + 1)
+        results = []
+        for concurrency in levels:
+            result = await run_level(http, users, days, args.mix, concurrency, args.requests, args.seed)
+            report(result)
+            results.append(result)
+        return results
+
+    timeout = httpx.Timeout(args.timeout)
+    if args.url:
+        async with httpx.AsyncClient(base_url=args.url, timeout=timeout) as http:
+            return await drive(http)
+    import main
+    async with main.lifespan(main.app):
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://benchmark", timeout=timeout) as http:
+            return await drive(http)
+
+
+def report(level: Dict[str, Any]):
+    print(f"\nconcurrency {level['concurrency']}: {level['throughput_rps']:.1f} req/s  "
+          f"elapsed {level['elapsed_s']:.2f}s  errors {level['errors']}")
+    print(f"  {'endpoint':<18} {'count':>6} {'err':>4} {'p50':>8} {'p95':>8} {'p99':>8} {'queries':>8}")
+    for name, e in level["endpoints"].items():
+        queries = "-" if e["db_queries"] is None else f"{e['db_queries']:.1f}"
+        print(f"  {name:<18} {e['count']:>6} {e['errors']:>4} {e['p50_ms']:>8.1f} {e['p95_ms']:>8.1f} "
+              f"{e['p99_ms']:>8.1f} {queries:>8}")
+
+
+def compare(results: Dict[str, Any], baseline: Dict[str, Any], tolerance: float) -> List[str]:
+    """Regressions of `results` against `baseline`, as printable lines"""
+    regressions = []
+    base_levels = {level["concurrency"]: level for level in baseline["levels"]}
+    for level in results["levels"]:
+        c = level["concurrency"]
+        base = base_levels.get(c)
+        if base is None:
+            continue
+        if level["errors"]:
+            regressions.append(f"c={c}: {level['errors']} failed request(s)")
+        if level["throughput_rps"] < base["throughput_rps"] * (1 - tolerance):
+            regressions.append(f"c={c}: throughput {level['throughput_rps']:.1f} req/s "
+                               f"(baseline {base['throughput_rps']:.1f})")
+        for name, e in level["endpoints"].items():
+            b = base["endpoints"].get(name)
+            if b is None:
+                continue
+            if e["p95_ms"] > b["p95_ms"] * (1 + tolerance) and e["p95_ms"] - b["p95_ms"] > MIN_REGRESSION_MS:
+                regressions.append(f"c={c} {name}: p95 {e['p95_ms']:.1f} ms (baseline {b['p95_ms']:.1f})")
+            if e["db_queries"] is not None and b["db_queries"] is not None \
+                    and e["db_queries"] > b["db_queries"] + QUERY_SLACK:
+                regressions.append(f"c={c} {name}: {e['db_queries']:.1f} queries/request "
+                                   f"(baseline {b['db_queries']:.1f})")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end API benchmark with seeded data and a stub LLM")
+    parser.add_argument("--dataset", default="small", choices=sorted(DATASETS))
+    parser.add_argument("--users", type=int, help="Override the dataset's user count")
+    parser.add_argument("--days", type=int, help="Override the dataset's history length")
+    parser.add_argument("--mix", default="mixed", choices=["dashboard", "chat", "mixed"])
+    parser.add_argument("--concurrency", default="1,4,16", help="Comma-separated concurrency levels")
+    parser.add_argument("--requests", type=int, default=400, help="Requests per concurrency level")
+    parser.add_argument("--warmup", type=int, default=20, help="Unrecorded requests before the first level")
+    parser.add_argument("--url", help="Benchmark a running server instead of the in-process app")
+    parser.add_argument("--timeout", type=float, default=60.0, help="Per-request timeout in seconds")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Also write the results JSON here")
+    parser.add_argument("--save-baseline", action="store_true", help="Write the results as the committed baseline")
+    parser.add_argument("--compare", action="store_true", help="Fail on regressions against the baseline")
+    parser.add_argument("--tolerance", type=float, default=0.25,
+                        help="Allowed relative p95 increase / throughput drop")
+    args = parser.parse_args()
+
+    users_count, days = DATASETS[args.dataset]
+    users_count, days = args.users or users_count, args.days or days
+    users = seed(args.dataset, users_count, days, args.seed)
+
+    levels = asyncio.run(bench(args, users, days))
+    results = {
+        "dataset": args.dataset,
+        "mix": args.mix,
+        "users": users_count,
+        "days": days,
+        "requests": args.requests,
+        "target": "url" if args.url else "in-process",
+        "levels": levels,
+    }
+    baseline_path = BASELINE_DIR / f"{args.dataset}-{args.mix}.json"
+    if args.output:
+        Path(args.output).write_text(json.dumps(results, indent=2) + "\n")
+    if args.save_baseline:
+        BASELINE_DIR.mkdir(exist_ok=True)
+        baseline_path.write_text(json.dumps(results, indent=2) + "\n")
+        print(f"\nBaseline written to {baseline_path}")
+    if args.compare:
+        if baseline_path.exists():
+            regressions = compare(results, json.loads(baseline_path.read_text()), args.tolerance)
+            print(f"\n{len(regressions)} regression(s) against {baseline_path.name}")
+            for line in regressions:
+                print(f"  {line}")
+            return 1 if regressions else 0
+        # Nothing recorded on this machine yet: only failed requests fail the run
+        print(f"\nNo baseline at {baseline_path}; skipping the comparison (record one with --save-baseline)")
+    return 0 if all(level["errors"] == 0 for level in levels) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,104 @@
+# Weighted request mixes modelled on what the dashboard and chat pages send
+import random
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, NamedTuple, Optional, Tuple
+
+QUESTIONS = [
+    "How is my HRV trending this week?",
+    "Did my workouts affect my resting heart rate?",
+    "How did I sleep compared with last month?",
+    "Summarize my activity for the last few days.",
+    "Am I consistent with my exercise?",
+]
+INSIGHT_TYPES = ["raw_data", "trend_summary", "consistency_score", "sleep"]
+# Dashboard date-range picker choices, in days, and how often each is used
+RANGE_DAYS = [(7, 3), (30, 6), (90, 2), (365, 1)]
+
+
+class Request(NamedTuple):
+    method: str
+    path: str
+    params: Optional[Dict[str, Any]] = None
+    json: Optional[Dict[str, Any]] = None
+
+
+class Client:
+    """State of one simulated browser session: its user, RNG and open chat"""
+
+    def __init__(self, user: Dict[str, Any], days: int, rng: random.Random):
+        self.user = user
+        self.days = days
+        self.rng = rng
+        self.chat_id: Optional[str] = None
+        self.turn = 0
+
+    @property
+    def base(self) -> str:
+        return f"/api/users/{self.user['user_id']}"
+
+    def date_range(self) -> Tuple[datetime, datetime]:
+        choices = [d for d, _ in RANGE_DAYS]
+        days = min(self.days, self.rng.choices(choices, weights=[w for _, w in RANGE_DAYS])[0])
+        end = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0) + timedelta(days=1)
+        return end - timedelta(days=days), end
+
+    def range_params(self) -> Dict[str, str]:
+        start, end = self.date_range()
+        return {"start": start.isoformat(), "end": end.isoformat()}
+
+
+Step = Callable[[Client], Request]
+
+
+def _series(path: str) -> Step:
+    return lambda c: Request("GET", f"{c.base}/{path}", c.range_params())
+
+
+def _sync(c: Client) -> Request:
+    start, end = c.date_range()
+    return Request("GET", f"{c.base}/sync", {"start": start.date().isoformat(), "end": end.date().isoformat()})
+
+
+def _chat_message(c: Client) -> Request:
+    c.turn += 1
+    return Request("POST", f"/api/chat/{c.chat_id}/message", json={
+        "message": f"{QUESTIONS[c.turn % len(QUESTIONS)]} (turn {c.turn})",
+        "use_health_data": c.rng.random() < 0.7,
+        "insight_type": c.rng.choice(INSIGHT_TYPES),
+    })
+
+
+# name -> (weight, step). Chat steps other than chat_new need the client's chat_id,
+# which the runner gets by sending chat_new first.
+DASHBOARD: Dict[str, Tuple[float, Step]] = {
+    "overview": (10, _series("overview")),
+    "hrv_daily": (10, _series("hrv/daily")),
+    "heart_rate_daily": (10, _series("heart-rate/daily")),
+    "activity_summary": (10, _series("activity/summary")),
+    "workouts": (8, _series("workouts")),
+    "sleep": (8, _series("sleep")),
+    "daily_snapshot": (6, _series("daily-snapshot")),
+    "sync": (4, _sync),
+    "percentiles": (2, lambda c: Request("GET", f"{c.base}/percentiles")),
+}
+
+CHAT: Dict[str, Tuple[float, Step]] = {
+    "chat_message": (6, _chat_message),
+    "chat_list": (2, lambda c: Request("GET", "/api/chat/list")),
+    "chat_messages": (2, lambda c: Request("GET", f"/api/chat/{c.chat_id}/messages")),
+    "chat_new": (0.5, lambda c: Request("POST", "/api/chat/new")),
+}
+
+MIXES: Dict[str, Dict[str, Tuple[float, Step]]] = {
+    "dashboard": DASHBOARD,
+    "chat": CHAT,
+    # Roughly how the pages are used: mostly charts, some chat
+    "mixed": {**{k: (w * 4, s) for k, (w, s) in DASHBOARD.items()}, **CHAT},
+}
+
+
+def draw(mix: str, rng: random.Random) -> Tuple[str, Step]:
+    """One weighted step of a mix"""
+    steps = MIXES[mix]
+    name = rng.choices(list(steps), weights=[w for w, _ in steps.values()])[0]
+    return name, steps[name][1]
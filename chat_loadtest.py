@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+"""
+Concurrent chat load test against a local database with a stub LLM.
+
+Seeds N users with synthetic health data, then has every user run a chat
+session concurrently through ChatService. Reports turn latency percentiles,
+DB time vs LLM time and connection pool saturation.
+
+Example:
+    python3 chat_loadtest.py --users 16 --turns 5 --latency-ms 800 --health-data
+"""
+import argparse
+import math
+import random
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import List, Dict, Any
+
+from database import pool, get_connection
+from chat_service import ChatService
+from llm_backend import StubBackend
+
+LOADTEST_PREFIX = "loadtest_"
+PASSWORD_HASH = "88d4266fd4e6338d13b845fcf289579d209c897823b9217da3e161936f031589"  # 'abcd'
+
+QUESTIONS = [
+    "How is my HRV trending this week?",
+    "Did my workouts affect my resting heart rate?",
+    "What should I focus on to recover better?",
+    "Summarize my activity for the last few days.",
+    "Am I consistent with my exercise?",
+]
+
+
+def percentile(values: List[float], pct: float) -> float:
+    """Nearest-rank percentile of an unsorted list"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    k = max(0, min(len(ordered) - 1, math.ceil(pct / 100.0 * len(ordered)) - 1))
+    return ordered[k]
+
+
+def seed_users(count: int, days: int, seed: int = 0) -> List[int]:
+    """Create (or reuse) loadtest users and give each `days` of synthetic data"""
+    rng = random.Random(seed)
+    user_ids = []
+    cnx = get_connection()
+    try:
+        cur = cnx.cursor()
+        for i in range(count):
+            username = f"{LOADTEST_PREFIX}{i}"
+            cur.execute("SELECT user_id FROM user WHERE username=%s", (username,))
+            row = cur.fetchone()
+            if row:
+                user_ids.append(row[0])
+                continue
+            cur.execute(
+                "INSERT INTO user (username, name, password) VALUES (%s, %s, %s)",
+                (username, f"Load Test {i}", PASSWORD_HASH)
+            )
+            user_id = cur.lastrowid
+            user_ids.append(user_id)
+
+            today = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
+            hrv_rows, hr_rows, activity_rows, workout_rows = [], [], [], []
+            for d in range(days):
+                day = today - timedelta(days=d)
+                for h in (2, 8, 14, 20):
+                    ts = day + timedelta(hours=h)
+                    hrv_rows.append((user_id, round(rng.gauss(48, 9), 2), "ms", ts, ts, ts + timedelta(minutes=1)))
+                hr = rng.gauss(68, 5)
+                hr_rows.append((user_id, "heart_rate", round(hr, 2), round(hr - 15, 2), round(hr + 60, 2),
+                                "count/min", day, day))
+                activity_rows.append((user_id, day.date(), round(rng.uniform(250, 750), 2),
+                                      rng.randint(20, 90), rng.randint(5, 70), rng.randint(6, 14)))
+                if rng.random() < 0.5:
+                    start = day + timedelta(hours=7)
+                    workout_rows.append((user_id, "HKWorkoutActivityTypeRunning", round(rng.uniform(20, 60), 2), "min",
+                                         round(rng.uniform(3, 12), 2), "km", round(rng.uniform(200, 700), 2), "kcal",
+                                         start, start + timedelta(minutes=40), "Load Test"))
+
+            cur.executemany(
+                "INSERT INTO hrv (user_id, value, unit, creation_date, start_date, end_date) "
+                "VALUES (%s, %s, %s, %s, %s, %s)", hrv_rows)
+            cur.executemany(
+                "INSERT IGNORE INTO health_sample (user_id, sample_type, avg_value, min_value, max_value, unit, "
+                "start_time, end_time) VALUES (%s, %s, %s, %s, %s, %s, %s, %s)", hr_rows)
+            cur.executemany(
+                "INSERT INTO activity_summary (user_id, date, active_energy_burned, move_time, exercise_time, "
+                "stand_hours) VALUES (%s, %s, %s, %s, %s, %s)", activity_rows)
+            if workout_rows:
+                cur.executemany(
+                    "INSERT INTO workout (user_id, activity_type, duration, duration_unit, total_distance, "
+                    "total_distance_unit, total_energy_burned, total_energy_burned_unit, start_date, end_date, "
+                    "source_name) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)", workout_rows)
+            cnx.commit()
+        cur.close()
+    finally:
+        cnx.close()
+    return user_ids
+
+
+class PoolSampler(threading.Thread):
+    """Periodically sample how many pooled connections are checked out"""
+
+    def __init__(self, interval: float = 0.01):
+        super().__init__(daemon=True)
+        self.interval = interval
+        self.samples: List[int] = []
+        self.waiting: List[int] = []
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.is_set():
+            stats = pool.stats()
+            self.samples.append(stats["in_use"])
+            self.waiting.append(stats["waiting"])
+            time.sleep(self.interval)
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+
+def run_user(service: ChatService, user_id: int, turns: int, use_health_data: bool,
+             insight_type: str) -> List[Dict[str, Any]]:
+    """One simulated user: open a chat and send `turns` messages"""
+    results = []
+    try:
+        chat_id = service.create_chat(user_id)
+    except Exception as e:
+        return [{"success": False, "error": f"create_chat: {e}", "wall_ms": 0.0}]
+    for turn in range(turns):
+        message = f"{QUESTIONS[turn % len(QUESTIONS)]} (turn {turn})"
+        start = time.perf_counter()
+        try:
+            result = service.send_message(chat_id, user_id, message, use_health_data, insight_type)
+        except Exception as e:
+            result = {"success": False, "error": str(e)}
+        result["wall_ms"] = (time.perf_counter() - start) * 1000
+        results.append(result)
+    return results
+
+
+def report(results: List[Dict[str, Any]], elapsed: float, pool_samples: List[int]):
+    ok = [r for r in results if r.get("success")]
+    failed = [r for r in results if not r.get("success")]
+    wall = [r["wall_ms"] for r in ok]
+    llm = [r["timings"]["llm_ms"] for r in ok if "timings" in r]
+    db = [r["timings"]["db_ms"] for r in ok if "timings" in r]
+
+    print(f"turns: {len(results)}  ok: {len(ok)}  failed: {len(failed)}  "
+          f"elapsed: {elapsed:.2f}s  throughput: {len(ok) / elapsed:.1f} turns/s")
+    for name, values in (("turn", wall), ("llm", llm), ("db", db)):
+        print(f"{name:>5} ms  p50={percentile(values, 50):8.1f}  p95={percentile(values, 95):8.1f}  "
+              f"p99={percentile(values, 99):8.1f}  max={max(values or [0]):8.1f}")
+    if llm and db:
+        total = sum(llm) + sum(db)
+        print(f"time split: llm {100 * sum(llm) / total:.1f}%  db {100 * sum(db) / total:.1f}%")
+    if pool_samples:
+        stats = pool.stats()
+        size = stats["size"]
+        saturated = sum(1 for s in pool_samples if s >= size)
+        print(f"pool: size={size}+{stats['max_overflow']}  peak_in_use={max(pool_samples)}  "
+              f"avg_in_use={sum(pool_samples) / len(pool_samples):.2f}  "
+              f"saturated={100 * saturated / len(pool_samples):.1f}% of samples")
+        wait = stats["checkout_wait_ms"]
+        print(f"pool checkout wait ms: p50={wait['p50'] or 0:.1f}  p99={wait['p99'] or 0:.1f}  "
+              f"max={wait['max']:.1f}  timeouts={stats['checkout_timeouts']}")
+    errors: Dict[str, int] = {}
+    for r in failed:
+        key = str(r.get("error"))[:80]
+        errors[key] = errors.get(key, 0) + 1
+    for error, count in sorted(errors.items(), key=lambda kv: -kv[1]):
+        print(f"  {count}x {error}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Concurrent chat load test with a stub LLM")
+    parser.add_argument("--users", type=int, default=8, help="Concurrent simulated users")
+    parser.add_argument("--turns", type=int, default=5, help="Messages per user")
+    parser.add_argument("--days", type=int, default=30, help="Days of seeded history per user")
+    parser.add_argument("--latency-ms", type=float, default=500, help="Stub LLM latency")
+    parser.add_argument("--jitter-ms", type=float, default=100, help="Stub LLM latency jitter")
+    parser.add_argument("--health-data", action="store_true", help="Include health data in each turn")
+    parser.add_argument("--insight-type", default="raw_data")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    user_ids = seed_users(args.users, args.days, args.seed)
+    service = ChatService(backend=StubBackend(args.latency_ms, args.jitter_ms, seed=args.seed))
+
+    sampler = PoolSampler()
+    sampler.start()
+    start = time.perf_counter()
+    results: List[Dict[str, Any]] = []
+    with ThreadPoolExecutor(max_workers=args.users) as executor:
+        futures = [
+            executor.submit(run_user, service, uid, args.turns, args.health_data, args.insight_type)
+            for uid in user_ids
+        ]
+        for future in futures:
+            results.extend(future.result())
+    elapsed = time.perf_counter() - start
+    sampler.stop()
+
+    report(results, elapsed, sampler.samples)
+    return 0 if all(r.get("success") for r in results) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
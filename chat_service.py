@@ -1,78 +1,122 @@
 # Chat module for Gemini integration
+import hashlib
 import json
+import re
+import threading
+import time
+from concurrent.futures import Future
 from datetime import datetime, timedelta
 from typing import List, Dict, Any, Optional
-import google.generativeai as genai
-from database import fetch_all, fetch_one, get_connection
+from database import fetch_all, fetch_one, fetch_scalar, execute, call_proc, cursor
+from context_encoder import ContextEncoder, estimate_tokens
+import insights
+import sleep
+import cohorts
+from llm_backend import LLMBackend, create_backend
+from llm_scheduler import LLMScheduler, SchedulerBusy
+from metrics import LLM_LATENCY, LLM_CALLS, LLM_TOKENS
+
+# Characters with special meaning in MATCH ... AGAINST boolean mode
+_FT_OPERATORS = re.compile(r'[+\-<>()~*"@]+')
+# InnoDB ignores tokens shorter than innodb_ft_min_token_size (default 3)
+_FT_MIN_TOKEN = 3
+
+
+def _search_terms(query: str) -> List[str]:
+    """Split a search query into full-text-safe terms"""
+    terms = _FT_OPERATORS.sub(" ", query).split()
+    return [t for t in terms if len(t) >= _FT_MIN_TOKEN][:16]
+
+
+def _highlight(content: str, terms: List[str], context_chars: int = 80) -> Dict[str, Any]:
+    """Snippet around the first match plus [start, end) offsets of every term hit in it"""
+    pattern = re.compile("|".join(re.escape(t) for t in terms), re.IGNORECASE)
+    first = pattern.search(content)
+    if first:
+        lo = max(0, first.start() - context_chars)
+        hi = min(len(content), first.end() + context_chars)
+    else:
+        lo, hi = 0, min(len(content), 2 * context_chars)
+    snippet = content[lo:hi]
+    return {
+        "snippet": ("…" if lo > 0 else "") + snippet + ("…" if hi < len(content) else ""),
+        "highlights": [[m.start() + (1 if lo > 0 else 0), m.end() + (1 if lo > 0 else 0)]
+                       for m in pattern.finditer(snippet)],
+    }
+
+class SharedCalls:
+    """Concurrent calls with the same key run once and share the result (or exception)"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._inflight: Dict[Any, Future] = {}
+        self.shared = 0
+
+    def run(self, key, fn):
+        with self._lock:
+            future = self._inflight.get(key)
+            owner = future is None
+            if owner:
+                future = self._inflight[key] = Future()
+            else:
+                self.shared += 1
+        if not owner:
+            return future.result()
+        try:
+            future.set_result(fn())
+        except BaseException as e:
+            future.set_exception(e)
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+        return future.result()
+
 
 class HealthDataTool:
     """Tool to fetch health data for the AI assistant"""
     
     @staticmethod
     def get_health_trend_summary(user_id: int, days: int = 14) -> Dict[str, Any]:
-        """Get health trend summary using fn_health_trend_summary"""
-        cnx = get_connection()
-        try:
-            cur = cnx.cursor()
-            cur.execute("SELECT fn_health_trend_summary(%s, %s) AS summary", (user_id, days))
-            row = cur.fetchone()
-            cur.close()
-            return {
-                "type": "trend_summary",
-                "period_days": days,
-                "summary": row[0] if row and row[0] else "No trend data available"
-            }
-        finally:
-            cnx.close()
+        """Get health trend summary from the per-day insight matrix"""
+        return insights.trend_summary(insights.load_daily_matrix(user_id, days))
     
     @staticmethod
     def get_health_consistency_score(user_id: int, days: int = 30) -> Dict[str, Any]:
-        """Get health consistency score using fn_health_consistency_score"""
-        cnx = get_connection()
-        try:
-            cur = cnx.cursor()
-            cur.execute("SELECT fn_health_consistency_score(%s, %s) AS score", (user_id, days))
-            row = cur.fetchone()
-            cur.close()
-            score = float(row[0]) if row and row[0] else 0.0
-            return {
-                "type": "consistency_score",
-                "period_days": days,
-                "score": score,
-                "rating": "Excellent" if score >= 80 else "Good" if score >= 60 else "Fair" if score >= 40 else "Needs Improvement"
-            }
-        finally:
-            cnx.close()
+        """Get health consistency score from the per-day insight matrix"""
+        return insights.consistency_score(insights.load_daily_matrix(user_id, days))
     
     @staticmethod
     def get_date_range_suggestion(user_id: int, analysis_type: str = 'trend') -> Dict[str, Any]:
         """Get smart date range suggestion using fn_suggest_date_range"""
-        cnx = get_connection()
-        try:
-            cur = cnx.cursor()
-            cur.execute("SELECT fn_suggest_date_range(%s, %s) AS suggestion", (user_id, analysis_type))
-            row = cur.fetchone()
-            cur.close()
-            if row and row[0]:
-                return json.loads(row[0])
-            return {"type": "date_suggestion", "error": "No suggestion available"}
-        finally:
-            cnx.close()
+        suggestion = fetch_scalar("SELECT fn_suggest_date_range(%s, %s) AS suggestion", (user_id, analysis_type))
+        if suggestion:
+            return json.loads(suggestion)
+        return {"type": "date_suggestion", "error": "No suggestion available"}
     
     @staticmethod
     def get_correlation_insights(user_id: int, days: int = 30) -> Dict[str, Any]:
-        """Get correlation insights using fn_detect_correlations"""
-        cnx = get_connection()
-        try:
-            cur = cnx.cursor()
-            cur.execute("SELECT fn_detect_correlations(%s, %s) AS correlations", (user_id, days))
-            row = cur.fetchone()
-            cur.close()
-            if row and row[0]:
-                return json.loads(row[0])
-            return {"type": "correlations", "error": "No correlation data available"}
-        finally:
-            cnx.close()
+        """Get correlation insights (Pearson/Spearman, lagged effects) from the per-day insight matrix"""
+        return insights.correlations(insights.load_daily_matrix(user_id, days))
+    
+    @staticmethod
+    def get_comprehensive_insights(user_id: int) -> Dict[str, Any]:
+        """Trends (14 days), consistency and correlations (30 days) from a single matrix fetch"""
+        matrix = insights.load_daily_matrix(user_id, 30)
+        return {
+            "trends": insights.trend_summary(matrix.tail(14)),
+            "consistency": insights.consistency_score(matrix),
+            "correlations": insights.correlations(matrix),
+        }
+    
+    @staticmethod
+    def get_sleep_summary(user_id: int, days: int = 14) -> Dict[str, Any]:
+        """Average sleep duration, stages and efficiency plus the nights, from sleep_session"""
+        return sleep.summary(user_id, days)
+    
+    @staticmethod
+    def get_cohort_percentiles(user_id: int) -> Dict[str, Any]:
+        """HRV and resting HR percentiles within the user's age cohort"""
+        return cohorts.summary(user_id)
     
     @staticmethod
     def get_7_day_health_summary(user_id: int) -> Dict[str, Any]:
@@ -140,27 +184,24 @@ class HealthDataTool:
         }
 
 class ChatService:
-    """Service for managing chat sessions and Gemini integration"""
+    """Service for managing chat sessions and LLM integration"""
     
-    def __init__(self, api_key: str):
-        genai.configure(api_key=api_key)
-        self.model = genai.GenerativeModel('gemini-2.5-pro')
+    def __init__(self, api_key: Optional[str] = None, backend: Optional[LLMBackend] = None,
+                 scheduler: Optional[LLMScheduler] = None):
+        # Backend defaults to LLM_BACKEND from the environment (Gemini unless set to stub)
+        self.backend = backend or create_backend(api_key)
+        # All model calls go through the scheduler (concurrency limit, fairness, coalescing)
+        self.scheduler = scheduler or LLMScheduler.from_env()
         self.health_tool = HealthDataTool()
+        # Insight payloads being computed, keyed by (user_id, insight_type)
+        self.insight_calls = SharedCalls()
     
     def create_chat(self, user_id: int, chat_name: str = "Health Chat") -> str:
         """Create a new chat session using stored procedure"""
-        cnx = get_connection()
-        try:
-            cur = cnx.cursor()
-            # Call stored procedure with UUID output
-            args = [user_id, '']  # user_id IN, chat_id OUT (VARCHAR)
-            result = cur.callproc('sp_create_chat', args)
-            chat_id = result[1]  # Get the OUT parameter (UUID string)
-            cnx.commit()
-            cur.close()
-            return chat_id
-        finally:
-            cnx.close()
+        # Call stored procedure with UUID output
+        args = [user_id, '']  # user_id IN, chat_id OUT (VARCHAR)
+        result = call_proc('sp_create_chat', args)
+        return result[1]  # Get the OUT parameter (UUID string)
     
     def get_user_chats(self, user_id: int) -> List[Dict[str, Any]]:
         """Get all chats for a user"""
@@ -196,9 +237,7 @@ class ChatService:
     
     def delete_chat(self, chat_id: str, user_id: int) -> bool:
         """Delete a chat and all its messages"""
-        cnx = get_connection()
-        try:
-            cur = cnx.cursor()
+        with cursor(commit=True) as cur:
             # Verify ownership
             cur.execute(
                 "SELECT chat_id FROM chats WHERE chat_id=%s AND user_id=%s",
@@ -209,47 +248,56 @@ class ChatService:
             
             # Delete chat (messages cascade)
             cur.execute("DELETE FROM chats WHERE chat_id=%s", (chat_id,))
-            cnx.commit()
-            cur.close()
             return True
-        finally:
-            cnx.close()
     
     def rename_chat(self, chat_id: str, user_id: int, new_name: str) -> bool:
         """Rename a chat"""
-        cnx = get_connection()
-        try:
-            cur = cnx.cursor()
-            cur.execute(
-                "UPDATE chats SET chat_name=%s WHERE chat_id=%s AND user_id=%s",
-                (new_name, chat_id, user_id)
-            )
-            success = cur.rowcount > 0
-            cnx.commit()
-            cur.close()
-            return success
-        finally:
-            cnx.close()
+        result = execute(
+            "UPDATE chats SET chat_name=%s WHERE chat_id=%s AND user_id=%s",
+            (new_name, chat_id, user_id)
+        )
+        return result["rowcount"] > 0
     
     def add_message(self, chat_id: str, role: str, content: str, tool_calls: Optional[str] = None) -> bool:
         """Add a message to a chat using stored procedure (prevents duplicates)"""
-        cnx = get_connection()
         try:
-            cur = cnx.cursor()
             # Call stored procedure that checks for duplicates
-            cur.callproc('sp_add_message', [chat_id, role, content])
-            cnx.commit()
-            cur.close()
+            call_proc('sp_add_message', [chat_id, role, content])
             return True
         except Exception as e:
             print(f"Error adding message: {e}")
             return False
-        finally:
-            cnx.close()
+    
+    def search_messages(self, user_id: int, query: str, limit: int = 20) -> List[Dict[str, Any]]:
+        """Full-text search over the user's chat messages, best matches first"""
+        terms = _search_terms(query)
+        if not terms:
+            return []
+        # Boolean mode with prefix matching; relevance comes from the FULLTEXT index
+        against = " ".join(f"{t}*" for t in terms)
+        rows = fetch_all(
+            """
+            SELECT cm.message_id, cm.chat_id, c.chat_name, cm.role, cm.content, cm.created_at,
+                   MATCH(cm.content) AGAINST (%s IN BOOLEAN MODE) AS score
+            FROM chat_messages cm
+            JOIN chats c ON c.chat_id = cm.chat_id
+            WHERE c.user_id=%s
+              AND MATCH(cm.content) AGAINST (%s IN BOOLEAN MODE)
+            ORDER BY score DESC, cm.created_at DESC
+            LIMIT %s
+            """,
+            (against, user_id, against, limit)
+        )
+        for row in rows:
+            row.update(_highlight(row.pop("content"), terms))
+            row["score"] = round(float(row["score"]), 4)
+        return rows
     
     def send_message(self, chat_id: str, user_id: int, user_message: str, 
                     use_health_data: bool = False, insight_type: str = "raw_data") -> Dict[str, Any]:
         """Send a message and get AI response with optional health insights"""
+        turn_start = time.perf_counter()
+        
         # Verify chat ownership
         chat = fetch_one(
             "SELECT chat_id FROM chats WHERE chat_id=%s AND user_id=%s",
@@ -268,80 +316,120 @@ class ChatService:
         context = self._build_context(messages, user_id, use_health_data, insight_type)
         
         # Get AI response (non-streaming for now)
+        # A resubmitted turn (same history, same message) shares the in-flight model call;
+        # concurrent turns asking for the same insight share its computation in _build_context
+        coalesce_key = (user_id, hashlib.sha256(context["prompt"].encode()).hexdigest())
+        
         try:
-            response = self.model.generate_content(context)
-            ai_response = response.text
+            llm_start = time.perf_counter()
+            scheduled = self.scheduler.submit(
+                user_id, lambda: self.backend.generate(context["prompt"]), coalesce_key
+            )
+            ai_response = scheduled["result"]
+            llm_ms = (time.perf_counter() - llm_start) * 1000 - scheduled["queue_wait_ms"]
+            
+            backend = self.backend.name
+            if scheduled["coalesced"]:
+                LLM_CALLS.inc((backend, "coalesced"))
+            else:
+                LLM_CALLS.inc((backend, "ok"))
+                LLM_LATENCY.observe(llm_ms / 1000, (backend,))
+                LLM_TOKENS.inc((backend, "prompt"), context["metrics"]["est_tokens"])
+                LLM_TOKENS.inc((backend, "completion"), estimate_tokens(ai_response))
             
             # Save AI response
             self.add_message(chat_id, 'assistant', ai_response)
             
+            total_ms = (time.perf_counter() - turn_start) * 1000
             return {
                 "success": True,
                 "response": ai_response,
                 "used_health_data": use_health_data,
-                "insight_type": insight_type if use_health_data else None
+                "insight_type": insight_type if use_health_data else None,
+                "prompt_metrics": context["metrics"],
+                "timings": {
+                    "total_ms": round(total_ms, 1),
+                    "llm_ms": round(llm_ms, 1),
+                    "queue_ms": round(scheduled["queue_wait_ms"], 1),
+                    "db_ms": round(total_ms - llm_ms - scheduled["queue_wait_ms"], 1)
+                },
+                "coalesced": scheduled["coalesced"]
             }
             
+        except SchedulerBusy:
+            LLM_CALLS.inc((self.backend.name, "rejected"))
+            raise
         except Exception as e:
+            LLM_CALLS.inc((self.backend.name, "error"))
             return {
                 "success": False,
                 "error": str(e)
             }
     
-    def _build_context(self, messages: List[Dict], user_id: int, 
-                      use_health_data: bool, insight_type: str = "raw_data") -> str:
-        """Build context string for Gemini with specified insight type"""
-        context_parts = []
-        
+    def _insight_data(self, user_id: int, insight_type: str) -> Any:
+        """The health data behind an insight type (None for unknown types)"""
+        if insight_type == "raw_data":
+            return self.health_tool.get_7_day_health_summary(user_id)
+        if insight_type == "trend_summary":
+            return self.health_tool.get_health_trend_summary(user_id, 14)
+        if insight_type == "consistency_score":
+            return self.health_tool.get_health_consistency_score(user_id, 30)
+        if insight_type == "correlations":
+            return self.health_tool.get_correlation_insights(user_id, 30)
+        if insight_type == "sleep":
+            # Reconstructed sleep sessions (14 nights)
+            return self.health_tool.get_sleep_summary(user_id, 14)
+        if insight_type == "percentiles":
+            # Comparison with users of the same age band
+            return self.health_tool.get_cohort_percentiles(user_id)
+        if insight_type == "comprehensive":
+            return self.health_tool.get_comprehensive_insights(user_id)
+        return None
+
+    def _build_context(self, messages: List[Dict], user_id: int,
+                      use_health_data: bool, insight_type: str = "raw_data") -> Dict[str, Any]:
+        """Build a token-budgeted prompt for Gemini with specified insight type
+
+        Returns {"prompt": str, "metrics": {...}} (see ContextEncoder.build)
+        """
+        encoder = ContextEncoder()
+
         # System prompt
-        context_parts.append(
+        encoder.add_text("system",
             "You are a helpful health assistant analyzing Apple Health data. "
             "Provide insightful, actionable advice based on the user's health metrics. "
             "Be supportive, informative, and encouraging. When analyzing data, "
-            "look for patterns, trends, and provide specific recommendations."
+            "look for patterns, trends, and provide specific recommendations. "
+            "Tables are pipe-separated with a header row; empty cells are missing values."
         )
         
         # Include health data if requested
         if use_health_data:
             try:
+                data = self.insight_calls.run((user_id, insight_type),
+                                              lambda: self._insight_data(user_id, insight_type))
                 if insight_type == "raw_data":
-                    # Last 7 days raw data
-                    health_data = self.health_tool.get_7_day_health_summary(user_id)
-                    context_parts.append(f"\n\nUser's Last 7 Days Health Data:\n{json.dumps(health_data, indent=2, default=str)}")
-                
+                    encoder.add_data("health_data", "\nUser's Last 7 Days Health Data:", data, 60)
                 elif insight_type == "trend_summary":
-                    # Trend summary (14 days)
-                    trend_data = self.health_tool.get_health_trend_summary(user_id, 14)
-                    context_parts.append(f"\n\nHealth Trend Analysis:\n{json.dumps(trend_data, indent=2, default=str)}")
-                
+                    encoder.add_mapping("trends", "\nHealth Trend Analysis:", data, 80)
                 elif insight_type == "consistency_score":
-                    # Consistency score (30 days)
-                    consistency_data = self.health_tool.get_health_consistency_score(user_id, 30)
-                    context_parts.append(f"\n\nHealth Data Consistency Analysis:\n{json.dumps(consistency_data, indent=2, default=str)}")
-                
+                    encoder.add_mapping("consistency", "\nHealth Data Consistency Analysis:", data, 80)
                 elif insight_type == "correlations":
-                    # Correlation insights (30 days)
-                    correlation_data = self.health_tool.get_correlation_insights(user_id, 30)
-                    context_parts.append(f"\n\nHealth Metrics Correlations:\n{json.dumps(correlation_data, indent=2, default=str)}")
-                
+                    encoder.add_mapping("correlations", "\nHealth Metrics Correlations:", data, 80)
+                elif insight_type == "sleep":
+                    encoder.add_data("sleep", "\nSleep Sessions (times in UTC, nights dated by the UTC wake day):", data, 80)
+                elif insight_type == "percentiles":
+                    encoder.add_data("percentiles", "\nHow the User Compares With Their Age Cohort:", data, 80)
                 elif insight_type == "comprehensive":
-                    # All insights combined
-                    trend_data = self.health_tool.get_health_trend_summary(user_id, 14)
-                    consistency_data = self.health_tool.get_health_consistency_score(user_id, 30)
-                    correlation_data = self.health_tool.get_correlation_insights(user_id, 30)
-                    
-                    context_parts.append(f"\n\nComprehensive Health Analysis:")
-                    context_parts.append(f"\n1. Trends (14 days):\n{json.dumps(trend_data, indent=2, default=str)}")
-                    context_parts.append(f"\n2. Consistency (30 days):\n{json.dumps(consistency_data, indent=2, default=str)}")
-                    context_parts.append(f"\n3. Correlations (30 days):\n{json.dumps(correlation_data, indent=2, default=str)}")
-                
+                    encoder.add_text("comprehensive", "\nComprehensive Health Analysis:", 80)
+                    encoder.add_mapping("trends", "1. Trends (14 days):", data["trends"], 80)
+                    encoder.add_mapping("consistency", "2. Consistency (30 days):", data["consistency"], 79)
+                    encoder.add_mapping("correlations", "3. Correlations (30 days):", data["correlations"], 78)
+
             except Exception as e:
-                context_parts.append(f"\n\nNote: Could not fetch health insights: {str(e)}")
-        
-        # Add conversation history (last 10 messages to keep context reasonable)
-        context_parts.append("\n\nConversation History:")
-        for msg in messages[-10:]:
-            role = "User" if msg['role'] == 'user' else "Assistant"
-            context_parts.append(f"{role}: {msg['content']}")
+                encoder.add_text("health_error", f"\nNote: Could not fetch health insights: {str(e)}")
+
+        # Add conversation history (last 10 messages, oldest trimmed first when over budget)
+        encoder.add_history(messages, 70, limit=10)
         
-        return "\n".join(context_parts)
+        return encoder.build()
@@ -0,0 +1,180 @@
+# Resumable chunked uploads of large export ZIPs
+import hashlib
+import json
+import os
+import shutil
+import time
+import uuid
+from pathlib import Path
+from typing import Dict, Any, List, Optional
+
+# Bytes per chunk (the last chunk may be shorter); clients must use the size returned at initiate
+CHUNK_SIZE = int(float(os.getenv("UPLOAD_CHUNK_MB", "8")) * 1024 * 1024)
+MAX_UPLOAD_BYTES = int(float(os.getenv("UPLOAD_MAX_GB", "20")) * 1024 ** 3)
+# Unfinished sessions older than this are removed
+SESSION_TTL_S = float(os.getenv("UPLOAD_SESSION_TTL_H", "48")) * 3600
+
+
+class UploadError(Exception):
+    """A request the upload protocol rejects; status_code is the HTTP status to return"""
+
+    def __init__(self, message: str, status_code: int = 400):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class UploadSessions:
+    """Upload sessions stored under <root>/<user_id>/sessions/<upload_id>/
+
+    A session directory holds:
+      meta.json  - filename, size and chunk size (written once at initiate)
+      data       - the ZIP, preallocated to its full size; chunks are written
+                   in place at their offsets, so no assembly step is needed
+      received   - one byte per chunk, set to 1 once that chunk is on disk
+
+    Every chunk owns distinct bytes of `data` and `received`, so chunks can be
+    written in parallel, from any worker process, without locking.
+    """
+
+    def __init__(self, root: Path, chunk_size: int = CHUNK_SIZE, max_bytes: int = MAX_UPLOAD_BYTES,
+                 ttl: float = SESSION_TTL_S):
+        self.root = root
+        self.chunk_size = chunk_size
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+
+    def _dir(self, user_id: int, upload_id: str) -> Path:
+        try:
+            uuid.UUID(upload_id)
+        except ValueError:
+            raise UploadError("Upload not found", 404)
+        return self.root / str(user_id) / "sessions" / upload_id
+
+    def _meta(self, user_id: int, upload_id: str) -> Dict[str, Any]:
+        path = self._dir(user_id, upload_id) / "meta.json"
+        try:
+            return json.loads(path.read_text())
+        except FileNotFoundError:
+            raise UploadError("Upload not found", 404)
+
+    def _chunk_count(self, meta: Dict[str, Any]) -> int:
+        return -(-meta["size"] // meta["chunk_size"])
+
+    def initiate(self, user_id: int, filename: str, size: int) -> Dict[str, Any]:
+        """Create a session with a preallocated (sparse) data file"""
+        if not filename.endswith(".zip"):
+            raise UploadError("Only ZIP files are allowed")
+        if size <= 0 or size > self.max_bytes:
+            raise UploadError(f"File size must be between 1 byte and {self.max_bytes} bytes", 413)
+        self.expire(user_id)
+
+        upload_id = str(uuid.uuid4())
+        session = self._dir(user_id, upload_id)
+        session.mkdir(parents=True)
+        meta = {
+            "upload_id": upload_id,
+            "filename": Path(filename).name,
+            "size": size,
+            "chunk_size": self.chunk_size,
+            "created_at": time.time(),
+        }
+        with open(session / "data", "wb") as f:
+            f.truncate(size)
+        with open(session / "received", "wb") as f:
+            f.write(bytes(self._chunk_count(meta)))
+        (session / "meta.json").write_text(json.dumps(meta))
+        return self.status(user_id, upload_id)
+
+    def write_chunk(self, user_id: int, upload_id: str, offset: int, body: bytes, sha256: str) -> Dict[str, Any]:
+        """Verify and store one chunk at its offset; re-sending a chunk is harmless"""
+        meta = self._meta(user_id, upload_id)
+        chunk_size, size = meta["chunk_size"], meta["size"]
+        if offset < 0 or offset >= size or offset % chunk_size:
+            raise UploadError(f"Offset must be a multiple of {chunk_size} below {size}", 416)
+        expected = min(chunk_size, size - offset)
+        if len(body) != expected:
+            raise UploadError(f"Chunk at offset {offset} must be {expected} bytes, got {len(body)}")
+        if hashlib.sha256(body).hexdigest() != sha256.lower():
+            raise UploadError("Chunk checksum mismatch", 422)
+
+        session = self._dir(user_id, upload_id)
+        try:
+            with open(session / "data", "r+b") as f:
+                f.seek(offset)
+                f.write(body)
+                f.flush()
+                os.fsync(f.fileno())
+            with open(session / "received", "r+b") as f:
+                f.seek(offset // chunk_size)
+                f.write(b"\x01")
+        except FileNotFoundError:
+            # Finalized or aborted while this chunk was in flight
+            raise UploadError("Upload is no longer accepting chunks", 409)
+        return {"offset": offset, "length": expected}
+
+    def _received(self, user_id: int, upload_id: str) -> bytes:
+        try:
+            return (self._dir(user_id, upload_id) / "received").read_bytes()
+        except FileNotFoundError:
+            raise UploadError("Upload not found", 404)
+
+    def status(self, user_id: int, upload_id: str) -> Dict[str, Any]:
+        """Session info with the received byte ranges as [start, end) pairs"""
+        meta = self._meta(user_id, upload_id)
+        received = self._received(user_id, upload_id)
+        chunk_size, size = meta["chunk_size"], meta["size"]
+        ranges: List[List[int]] = []
+        for i, flag in enumerate(received):
+            if not flag:
+                continue
+            start, end = i * chunk_size, min((i + 1) * chunk_size, size)
+            if ranges and ranges[-1][1] == start:
+                ranges[-1][1] = end
+            else:
+                ranges.append([start, end])
+        return {
+            **meta,
+            "received": ranges,
+            "received_bytes": sum(end - start for start, end in ranges),
+            "missing_chunks": received.count(0),
+            "complete": 0 not in received,
+        }
+
+    def finalize(self, user_id: int, upload_id: str, dest_dir: Path) -> Path:
+        """Move the completed data file into dest_dir and drop the session
+
+        The rename is the only step, so the importer gets the file without a
+        copy, and of two concurrent finalize calls only one can succeed.
+        """
+        meta = self._meta(user_id, upload_id)
+        missing = self._received(user_id, upload_id).count(0)
+        if missing:
+            raise UploadError(f"{missing} chunk(s) still missing", 409)
+        dest_dir.mkdir(parents=True, exist_ok=True)
+        dest = dest_dir / f"{upload_id}-{meta['filename']}"
+        try:
+            os.replace(self._dir(user_id, upload_id) / "data", dest)
+        except FileNotFoundError:
+            raise UploadError("Upload already finalized", 409)
+        shutil.rmtree(self._dir(user_id, upload_id), ignore_errors=True)
+        return dest
+
+    def abort(self, user_id: int, upload_id: str):
+        self._meta(user_id, upload_id)
+        shutil.rmtree(self._dir(user_id, upload_id), ignore_errors=True)
+
+    def expire(self, user_id: int) -> int:
+        """Remove this user's sessions older than the TTL; returns how many"""
+        sessions = self.root / str(user_id) / "sessions"
+        if not sessions.is_dir():
+            return 0
+        removed = 0
+        cutoff = time.time() - self.ttl
+        for session in sessions.iterdir():
+            try:
+                if session.stat().st_mtime < cutoff and (session / "received").stat().st_mtime < cutoff:
+                    shutil.rmtree(session, ignore_errors=True)
+                    removed += 1
+            except FileNotFoundError:
+                continue
+        return removed
@@ -0,0 +1,361 @@
+#!/usr/bin/env python3
+"""
+Cohort percentiles: how a user's HRV and resting heart rate compare with
+other users of the same age band.
+
+`build` (nightly, cron) splits users into user_id ranges and hands them to a
+process pool. Each worker computes its users' metric values (the median of
+their daily means over their latest COHORT_WINDOW_DAYS days of data) and
+folds them into per-cohort t-digests. The parent merges the digests, stores
+each cohort's percentile table in cohort_percentile and each user's rank in
+user_percentile, so the API and chat read precomputed rows.
+
+After an upload, `refresh_user` recomputes one user's values and ranks them
+against the stored tables without touching anyone else.
+
+Usage:
+    python3 cohorts.py build                # nightly (cron)
+    python3 cohorts.py refresh --user-id 1
+    python3 cohorts.py status
+"""
+import argparse
+import bisect
+import json
+import math
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from database import cursor, fetch_all, fetch_one, fetch_scalar
+
+# Metric -> whether a higher value is the healthier direction
+METRICS = {"hrv": True, "resting_hr": False}
+RESTING_HR_TYPE = "HKQuantityTypeIdentifierRestingHeartRate"
+
+# Days of each user's most recent data that make up their value, and the minimum with readings
+WINDOW_DAYS = int(os.getenv("COHORT_WINDOW_DAYS", "30"))
+MIN_DAYS = 7
+# Cohorts smaller than this are not published; their users are ranked against everyone
+MIN_COHORT_USERS = int(os.getenv("COHORT_MIN_USERS", "20"))
+# (lowest age, label); the band runs up to the next entry's lowest age
+AGE_BANDS = ((0, "under 30"), (30, "30-39"), (40, "40-49"), (50, "50-59"), (60, "60+"))
+ALL = "all"
+
+WORKERS = int(os.getenv("COHORT_WORKERS", str(os.cpu_count() or 1)))
+# Users per pool task
+CHUNK_USERS = 500
+
+# Daily means over each user's latest WINDOW_DAYS days of readings, for a user_id range
+_HRV_DAILY_SQL = """
+    SELECT h.user_id, DATE(h.start_date) AS day, AVG(h.value) AS value
+    FROM hrv h
+    JOIN (SELECT user_id, MAX(start_date) AS last FROM hrv WHERE user_id BETWEEN %s AND %s GROUP BY user_id) m
+      ON m.user_id = h.user_id
+    WHERE h.user_id BETWEEN %s AND %s AND h.start_date > m.last - INTERVAL %s DAY
+    GROUP BY h.user_id, DATE(h.start_date)
+"""
+
+_RESTING_HR_DAILY_SQL = """
+    SELECT hr.user_id, DATE(hr.start_date) AS day, AVG(hr.value) AS value
+    FROM health_record hr
+    JOIN (SELECT user_id, MAX(start_date) AS last FROM health_record
+          WHERE user_id BETWEEN %s AND %s AND type_id = %s GROUP BY user_id) m
+      ON m.user_id = hr.user_id
+    WHERE hr.user_id BETWEEN %s AND %s AND hr.type_id = %s AND hr.start_date > m.last - INTERVAL %s DAY
+    GROUP BY hr.user_id, DATE(hr.start_date)
+"""
+
+_USER_SQL = """
+    INSERT INTO user_percentile (user_id, metric, value, days, cohort, percentile, computed_at)
+    VALUES (%s, %s, %s, %s, %s, %s, NOW())
+    ON DUPLICATE KEY UPDATE value = VALUES(value), days = VALUES(days), cohort = VALUES(cohort),
+      percentile = VALUES(percentile), computed_at = VALUES(computed_at)
+"""
+
+
+class TDigest:
+    """Merging t-digest (Dunning): a mergeable quantile sketch of bounded size
+
+    Values are buffered and periodically merged into at most ~compression
+    centroids, kept small near the tails so extreme quantiles stay accurate.
+    Partial digests from pool workers merge into the cohort's digest.
+    """
+
+    def __init__(self, compression: float = 100.0):
+        self.compression = compression
+        self.means: List[float] = []
+        self.weights: List[float] = []
+        self.count = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+        self._buffer: List[Tuple[float, float]] = []
+
+    def add(self, x: float, w: float = 1.0):
+        self._buffer.append((x, w))
+        self.count += w
+        self.min = min(self.min, x)
+        self.max = max(self.max, x)
+        if len(self._buffer) >= 5 * self.compression:
+            self._compress()
+
+    def merge(self, other: "TDigest"):
+        other._compress()
+        self._buffer.extend(zip(other.means, other.weights))
+        self.count += other.count
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        self._compress()
+
+    def _k(self, q: float) -> float:
+        return self.compression / (2 * math.pi) * math.asin(2 * min(max(q, 0.0), 1.0) - 1)
+
+    def _compress(self):
+        if not self._buffer:
+            return
+        items = sorted(list(zip(self.means, self.weights)) + self._buffer)
+        self._buffer = []
+        means, weights = [], []
+        cum = 0.0
+        k_left = self._k(0.0)
+        mean, weight = items[0]
+        for m, w in items[1:]:
+            if self._k((cum + weight + w) / self.count) - k_left <= 1:
+                weight += w
+                mean += (m - mean) * w / weight
+            else:
+                means.append(mean)
+                weights.append(weight)
+                cum += weight
+                k_left = self._k(cum / self.count)
+                mean, weight = m, w
+        means.append(mean)
+        weights.append(weight)
+        self.means, self.weights = means, weights
+
+    def quantile(self, q: float) -> Optional[float]:
+        self._compress()
+        if not self.means:
+            return None
+        if len(self.means) == 1:
+            return self.means[0]
+        target = q * self.count
+        first, last = self.weights[0], self.weights[-1]
+        if target <= first / 2:
+            return self.min + (self.means[0] - self.min) * (target / (first / 2) if first else 0.0)
+        if target >= self.count - last / 2:
+            tail = (target - (self.count - last / 2)) / (last / 2) if last else 0.0
+            return self.means[-1] + (self.max - self.means[-1]) * tail
+        cum = first / 2
+        for i in range(len(self.means) - 1):
+            step = (self.weights[i] + self.weights[i + 1]) / 2
+            if target <= cum + step:
+                return self.means[i] + (self.means[i + 1] - self.means[i]) * (target - cum) / step
+            cum += step
+        return self.means[-1]
+
+
+def age_band(birth_date: Optional[date], today: date) -> str:
+    if birth_date is None:
+        return ALL
+    age = today.year - birth_date.year - ((today.month, today.day) < (birth_date.month, birth_date.day))
+    label = ALL
+    for lowest, band in AGE_BANDS:
+        if age >= lowest:
+            label = band
+    return label
+
+
+def percentile_of(quantiles: List[float], value: float) -> float:
+    """Percentile rank (0-100) of value in a table of the 0th..100th percentiles"""
+    i = bisect.bisect_left(quantiles, value)
+    if i == 0:
+        return 0.0
+    if i >= len(quantiles):
+        return 100.0
+    lo, hi = quantiles[i - 1], quantiles[i]
+    return round(i - 1 + ((value - lo) / (hi - lo) if hi > lo else 0.0), 1)
+
+
+def user_values(lo: int, hi: int, read: bool = True) -> Dict[Tuple[int, str], Tuple[float, int]]:
+    """(user_id, metric) -> (median of daily means, days with data) for users lo..hi"""
+    days: Dict[Tuple[int, str], List[float]] = {}
+    for r in fetch_all(_HRV_DAILY_SQL, (lo, hi, lo, hi, WINDOW_DAYS), label="cohorts.hrv", read=read):
+        days.setdefault((r["user_id"], "hrv"), []).append(float(r["value"]))
+    type_id = fetch_scalar("SELECT type_id FROM record_type WHERE name = %s", (RESTING_HR_TYPE,), read=read)
+    if type_id is not None:
+        rows = fetch_all(_RESTING_HR_DAILY_SQL, (lo, hi, type_id, lo, hi, type_id, WINDOW_DAYS),
+                         label="cohorts.resting_hr", read=read)
+        for r in rows:
+            days.setdefault((r["user_id"], "resting_hr"), []).append(float(r["value"]))
+    return {key: (float(np.median(values)), len(values)) for key, values in days.items() if len(values) >= MIN_DAYS}
+
+
+def _birth_dates(lo: int, hi: int) -> Dict[int, Optional[date]]:
+    rows = fetch_all("SELECT user_id, birth_date FROM user WHERE user_id BETWEEN %s AND %s", (lo, hi))
+    return {r["user_id"]: r["birth_date"] for r in rows}
+
+
+def _build_chunk(bounds: Tuple[int, int]) -> Tuple[List[Tuple], Dict[Tuple[str, str], TDigest]]:
+    """Pool task: values and partial cohort digests for one user_id range"""
+    lo, hi = bounds
+    today = date.today()
+    births = _birth_dates(lo, hi)
+    rows: List[Tuple] = []
+    digests: Dict[Tuple[str, str], TDigest] = {}
+    for (user_id, metric), (value, days) in user_values(lo, hi).items():
+        band = age_band(births.get(user_id), today)
+        for cohort in {band, ALL}:
+            digests.setdefault((cohort, metric), TDigest()).add(value)
+        rows.append((user_id, metric, value, days, band))
+    return rows, digests
+
+
+def _rank(tables: Dict[Tuple[str, str], Dict[str, Any]], user_id: int, metric: str,
+          value: float, days: int, band: str) -> Optional[Tuple]:
+    """user_percentile row against the user's band, or everyone if the band is too small"""
+    cohort = band if (band, metric) in tables else ALL
+    table = tables.get((cohort, metric))
+    if table is None:
+        return None
+    return (user_id, metric, value, days, cohort, percentile_of(table["quantiles"], value))
+
+
+def _load_tables() -> Dict[Tuple[str, str], Dict[str, Any]]:
+    rows = fetch_all("SELECT cohort, metric, users, quantiles FROM cohort_percentile", ())
+    return {(r["cohort"], r["metric"]): {"users": r["users"], "quantiles": json.loads(r["quantiles"])} for r in rows}
+
+
+def build(workers: int = WORKERS, chunk_users: int = CHUNK_USERS) -> Dict[str, Any]:
+    """Recompute every cohort table and every user's percentiles"""
+    started = time.monotonic()
+    built_at = fetch_scalar("SELECT NOW()", (), read=False)
+    bounds = fetch_one("SELECT MIN(user_id) AS lo, MAX(user_id) AS hi FROM user", ())
+    if not bounds or bounds["lo"] is None:
+        return {"users": 0, "cohorts": 0, "seconds": 0.0}
+    chunks = [(lo, min(lo + chunk_users - 1, bounds["hi"])) for lo in range(bounds["lo"], bounds["hi"] + 1, chunk_users)]
+
+    rows: List[Tuple] = []
+    digests: Dict[Tuple[str, str], TDigest] = {}
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for chunk_rows, chunk_digests in pool.map(_build_chunk, chunks):
+            rows.extend(chunk_rows)
+            for key, digest in chunk_digests.items():
+                if key in digests:
+                    digests[key].merge(digest)
+                else:
+                    digests[key] = digest
+
+    tables: Dict[Tuple[str, str], Dict[str, Any]] = {}
+    for (cohort, metric), digest in digests.items():
+        if digest.count < MIN_COHORT_USERS:
+            continue
+        quantiles = [round(digest.quantile(p / 100), 3) for p in range(101)]
+        # Keep the table monotonic for bisect despite interpolation rounding
+        for i in range(1, len(quantiles)):
+            quantiles[i] = max(quantiles[i], quantiles[i - 1])
+        tables[(cohort, metric)] = {"users": int(digest.count), "quantiles": quantiles}
+
+    ranked = [r for r in (_rank(tables, *row) for row in rows) if r is not None]
+    with cursor(commit=True, label="cohorts.build") as cur:
+        cur.execute("DELETE FROM cohort_percentile")
+        cur.executemany(
+            """
+            INSERT INTO cohort_percentile (cohort, metric, users, p10, p25, p50, p75, p90, quantiles, computed_at)
+            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, NOW())
+            """,
+            [(cohort, metric, t["users"], *(t["quantiles"][p] for p in (10, 25, 50, 75, 90)),
+              json.dumps(t["quantiles"], separators=(",", ":")))
+             for (cohort, metric), t in tables.items()]
+        )
+    for i in range(0, len(ranked), 1000):
+        with cursor(commit=True, label="cohorts.build") as cur:
+            cur.executemany(_USER_SQL, ranked[i:i + 1000])
+    # Users whose data aged out of every cohort table
+    with cursor(commit=True, label="cohorts.build") as cur:
+        cur.execute("DELETE FROM user_percentile WHERE computed_at < %s", (built_at,))
+    return {"users": len({r[0] for r in ranked}), "cohorts": len(tables),
+            "seconds": round(time.monotonic() - started, 1)}
+
+
+def refresh_user(user_id: int) -> int:
+    """Re-rank one user against the stored cohort tables (after an upload); returns metrics ranked"""
+    # The import just committed; replicas may not have it yet
+    values = user_values(user_id, user_id, read=False)
+    tables = _load_tables()
+    band = age_band(_birth_dates(user_id, user_id).get(user_id), date.today())
+    ranked = [r for r in (_rank(tables, user_id, metric, value, days, band)
+                          for (_, metric), (value, days) in values.items()) if r is not None]
+    with cursor(commit=True, label="cohorts.refresh_user") as cur:
+        cur.execute("DELETE FROM user_percentile WHERE user_id = %s", (user_id,))
+        if ranked:
+            cur.executemany(_USER_SQL, ranked)
+    return len(ranked)
+
+
+def user_percentiles(user_id: int) -> List[Dict[str, Any]]:
+    return fetch_all(
+        """
+        SELECT up.metric, up.value, up.days, up.cohort, up.percentile, cp.users AS cohort_users,
+               cp.p25 AS cohort_p25, cp.p50 AS cohort_median, cp.p75 AS cohort_p75, up.computed_at
+        FROM user_percentile up
+        LEFT JOIN cohort_percentile cp ON cp.cohort = up.cohort AND cp.metric = up.metric
+        WHERE up.user_id = %s
+        ORDER BY up.metric
+        """,
+        (user_id,)
+    )
+
+
+def summary(user_id: int) -> Dict[str, Any]:
+    """Percentile rows for the chat context"""
+    rows = user_percentiles(user_id)
+    if not rows:
+        return {"type": "cohort_percentiles", "error": "Not enough recent HRV or resting heart rate data"}
+    return {
+        "type": "cohort_percentiles",
+        "window": f"median of daily means over the latest {WINDOW_DAYS} days of data",
+        "note": "percentile = share of the cohort with a lower value",
+        "metrics": [
+            {"metric": r["metric"], "value": r["value"], "percentile": r["percentile"], "cohort": r["cohort"],
+             "cohort_users": r["cohort_users"], "cohort_median": r["cohort_median"],
+             "higher_is_better": METRICS[r["metric"]]}
+            for r in rows
+        ],
+    }
+
+
+def status():
+    for r in fetch_all("SELECT cohort, metric, users, p10, p50, p90, computed_at FROM cohort_percentile "
+                       "ORDER BY metric, cohort", (), read=False):
+        print(f"{r['metric']:<11} {r['cohort']:<9} users={r['users']:<6} p10={r['p10']:<8} "
+              f"p50={r['p50']:<8} p90={r['p90']:<8} computed {r['computed_at']}")
+    ranked = fetch_scalar("SELECT COUNT(DISTINCT user_id) FROM user_percentile", (), read=False)
+    print(f"{ranked} user(s) ranked")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Cohort percentiles of HRV and resting heart rate")
+    parser.add_argument("command", choices=("build", "refresh", "status"))
+    parser.add_argument("--user-id", type=int, help="User to re-rank (refresh)")
+    parser.add_argument("--workers", type=int, default=WORKERS, help="Processes for build")
+    args = parser.parse_args()
+
+    if args.command == "build":
+        result = build(args.workers)
+        print(f"ranked {result['users']} user(s) in {result['cohorts']} cohort table(s) in {result['seconds']}s")
+    elif args.command == "refresh":
+        if args.user_id is None:
+            parser.error("refresh needs --user-id")
+        print(f"user {args.user_id}: {refresh_user(args.user_id)} metric(s) ranked")
+    else:
+        status()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
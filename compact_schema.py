@@ -0,0 +1,223 @@
+#!/usr/bin/env python3
+"""
+Dictionary-encode health_record's type/unit/source/device strings.
+
+Databases created from an older queries.sql store those strings on every
+row. `migrate` creates the record_type/record_unit/record_source/record_device
+lookup tables, fills them from the distinct values, backfills the id columns
+in primary-key batches, replaces the triggers, then drops the string columns
+and rebuilds the table so the space is actually returned.
+
+Usage:
+    python3 compact_schema.py migrate   # one-off, idempotent
+    python3 compact_schema.py status    # table/index sizes and lookup cardinalities
+"""
+import argparse
+import sys
+from typing import Set
+
+from database import cursor, fetch_all, fetch_scalar, execute
+
+LOOKUP_TABLES = ("record_type", "record_unit", "record_source", "record_device")
+STRING_COLUMNS = ("type", "unit", "source_name", "source_version", "device")
+
+_CREATE_LOOKUPS = [
+    """
+    CREATE TABLE IF NOT EXISTS record_type (
+        type_id SMALLINT UNSIGNED AUTO_INCREMENT PRIMARY KEY,
+        name VARCHAR(255) CHARACTER SET utf8mb4 COLLATE utf8mb4_bin NOT NULL,
+        UNIQUE KEY uq_record_type_name (name)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS record_unit (
+        unit_id SMALLINT UNSIGNED AUTO_INCREMENT PRIMARY KEY,
+        name VARCHAR(50) CHARACTER SET utf8mb4 COLLATE utf8mb4_bin NOT NULL,
+        UNIQUE KEY uq_record_unit_name (name)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS record_source (
+        source_id INT UNSIGNED AUTO_INCREMENT PRIMARY KEY,
+        name VARCHAR(255) CHARACTER SET utf8mb4 COLLATE utf8mb4_bin NOT NULL,
+        version VARCHAR(50) CHARACTER SET utf8mb4 COLLATE utf8mb4_bin NOT NULL DEFAULT '',
+        UNIQUE KEY uq_record_source (name, version)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS record_device (
+        device_id INT UNSIGNED AUTO_INCREMENT PRIMARY KEY,
+        name TEXT NOT NULL,
+        name_hash BINARY(16) NOT NULL,
+        UNIQUE KEY uq_record_device_hash (name_hash)
+    )
+    """,
+    # Fixed ids the health_record trigger compares against
+    """
+    INSERT IGNORE INTO record_type (type_id, name) VALUES
+    (1, 'HKQuantityTypeIdentifierHeartRateVariabilitySDNN'),
+    (2, 'HKQuantityTypeIdentifierHeartRate')
+    """,
+]
+
+_FILL_LOOKUPS = [
+    "INSERT IGNORE INTO record_type (name) SELECT DISTINCT type FROM health_record WHERE type IS NOT NULL",
+    "INSERT IGNORE INTO record_unit (name) SELECT DISTINCT unit FROM health_record WHERE unit IS NOT NULL",
+    "INSERT IGNORE INTO record_source (name, version) "
+    "SELECT DISTINCT source_name, COALESCE(source_version, '') FROM health_record WHERE source_name IS NOT NULL",
+    "INSERT IGNORE INTO record_device (name, name_hash) "
+    "SELECT DISTINCT device, UNHEX(MD5(device)) FROM health_record WHERE device IS NOT NULL",
+]
+
+_BACKFILL_SQL = """
+    UPDATE health_record hr
+    LEFT JOIN record_type t ON t.name = hr.type
+    LEFT JOIN record_unit u ON u.name = hr.unit
+    LEFT JOIN record_source s ON s.name = hr.source_name AND s.version = COALESCE(hr.source_version, '')
+    LEFT JOIN record_device d ON d.name_hash = UNHEX(MD5(hr.device))
+    SET hr.type_id = t.type_id, hr.unit_id = u.unit_id, hr.source_id = s.source_id, hr.device_id = d.device_id
+    WHERE hr.record_id > %s AND hr.record_id <= %s
+"""
+
+# Same definitions as queries.sql (section 3); the old ones read the dropped columns
+_TRIGGERS = [
+    "DROP TRIGGER IF EXISTS after_insert_health_record",
+    """
+    CREATE TRIGGER after_insert_health_record
+    AFTER INSERT ON health_record
+    FOR EACH ROW
+    BEGIN
+      IF NEW.type_id = 1 THEN
+        INSERT INTO hrv (user_id, value, unit, creation_date, start_date, end_date)
+        VALUES (NEW.user_id, NEW.value, (SELECT name FROM record_unit WHERE unit_id = NEW.unit_id),
+                NEW.creation_date, NEW.start_date, NEW.end_date);
+      END IF;
+
+      IF NEW.type_id = 2 THEN
+        INSERT INTO health_sample
+          (user_id, sample_type, avg_value, min_value, max_value, unit, start_time, end_time)
+        VALUES (
+          NEW.user_id, 'heart_rate', NEW.value, NEW.value, NEW.value,
+          (SELECT name FROM record_unit WHERE unit_id = NEW.unit_id),
+          DATE(NEW.start_date), DATE(NEW.end_date)
+        )
+        ON DUPLICATE KEY UPDATE
+          avg_value = (avg_value + VALUES(avg_value)) / 2,
+          min_value = LEAST(min_value, VALUES(min_value)),
+          max_value = GREATEST(max_value, VALUES(max_value));
+      END IF;
+    END
+    """,
+    "DROP TRIGGER IF EXISTS after_insert_metadata",
+    """
+    CREATE TRIGGER after_insert_metadata
+    AFTER INSERT ON metadata_entry
+    FOR EACH ROW
+    BEGIN
+      DECLARE v_device TEXT;
+
+      IF NEW.meta_key = 'HKMetadataKeyHeartRateMotionContext' THEN
+        SELECT CONCAT(COALESCE(d.name, ''), ' | MotionContext=', COALESCE(NEW.meta_value, ''))
+          INTO v_device
+        FROM health_record hr
+        LEFT JOIN record_device d ON d.device_id = hr.device_id
+        WHERE hr.record_id = NEW.record_id AND hr.start_date = NEW.start_date;
+
+        IF v_device IS NOT NULL THEN
+          INSERT INTO record_device (name, name_hash) VALUES (v_device, UNHEX(MD5(v_device)))
+            ON DUPLICATE KEY UPDATE device_id = LAST_INSERT_ID(device_id);
+          UPDATE health_record
+          SET device_id = LAST_INSERT_ID()
+          WHERE record_id = NEW.record_id AND start_date = NEW.start_date;
+        END IF;
+      END IF;
+    END
+    """,
+]
+
+_CREATE_VIEW = """
+    CREATE OR REPLACE VIEW health_record_named AS
+    SELECT hr.record_id, hr.user_id, hr.type_id, t.name AS type, u.name AS unit, hr.value,
+           s.name AS source_name, NULLIF(s.version, '') AS source_version, d.name AS device,
+           hr.creation_date, hr.start_date, hr.end_date
+    FROM health_record hr
+    LEFT JOIN record_type t ON t.type_id = hr.type_id
+    LEFT JOIN record_unit u ON u.unit_id = hr.unit_id
+    LEFT JOIN record_source s ON s.source_id = hr.source_id
+    LEFT JOIN record_device d ON d.device_id = hr.device_id
+"""
+
+
+def _columns(table: str) -> Set[str]:
+    rows = fetch_all(
+        "SELECT COLUMN_NAME AS name FROM information_schema.COLUMNS "
+        "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s", (table,), read=False)
+    return {r["name"] for r in rows}
+
+
+def migrate(batch_size: int = 50000):
+    """Convert health_record from string columns to lookup ids (idempotent)"""
+    columns = _columns("health_record")
+    if "type" not in columns and "type_id" in columns:
+        print("health_record is already dictionary-encoded")
+        return
+
+    with cursor(commit=True, label="compact_schema.lookups") as cur:
+        for sql in _CREATE_LOOKUPS:
+            cur.execute(sql)
+    if "type_id" not in columns:
+        execute("ALTER TABLE health_record ADD COLUMN type_id SMALLINT UNSIGNED, "
+                "ADD COLUMN unit_id SMALLINT UNSIGNED, ADD COLUMN source_id INT UNSIGNED, "
+                "ADD COLUMN device_id INT UNSIGNED", ())
+
+    # Switch the triggers first so rows imported during the backfill get ids
+    # from the new transfer.py and are not rejected by triggers reading old columns
+    with cursor(commit=True, label="compact_schema.triggers") as cur:
+        for sql in _TRIGGERS:
+            cur.execute(sql)
+
+    for sql in _FILL_LOOKUPS:
+        execute(sql, ())
+    last = 0
+    top = fetch_scalar("SELECT MAX(record_id) FROM health_record", (), read=False) or 0
+    while last < top:
+        # Rows written by the new importer already have ids and no strings
+        execute(_BACKFILL_SQL + " AND hr.type_id IS NULL", (last, last + batch_size))
+        last += batch_size
+        print(f"backfilled ids up to record_id {min(last, top)} of {top}")
+
+    # FORCE rebuilds the table; dropping columns alone does not return the space
+    execute(f"ALTER TABLE health_record {', '.join(f'DROP COLUMN {c}' for c in STRING_COLUMNS)}", ())
+    execute("ALTER TABLE health_record FORCE", ())
+    execute(_CREATE_VIEW, ())
+    print("Migration complete")
+
+
+def status():
+    rows = fetch_all(
+        """
+        SELECT TABLE_NAME AS name, TABLE_ROWS AS approx_rows, DATA_LENGTH AS data_bytes, INDEX_LENGTH AS index_bytes
+        FROM information_schema.TABLES
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME IN ('health_record', %s, %s, %s, %s)
+        ORDER BY TABLE_NAME
+        """,
+        LOOKUP_TABLES, read=False
+    )
+    for r in rows:
+        print(f"{r['name']:<16} ~{r['approx_rows']} rows  data {r['data_bytes'] / 1048576:.1f} MB  "
+              f"indexes {r['index_bytes'] / 1048576:.1f} MB")
+    columns = _columns("health_record")
+    encoded = "type_id" in columns and "type" not in columns
+    print(f"health_record is {'dictionary-encoded' if encoded else 'not migrated yet'}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Dictionary-encode health_record strings")
+    parser.add_argument("command", choices=("migrate", "status"))
+    args = parser.parse_args()
+    {"migrate": migrate, "status": status}[args.command]()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
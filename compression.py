@@ -0,0 +1,138 @@
+# Response compression (brotli when available, else gzip) above a size threshold
+import gzip
+import os
+import zlib
+from typing import Optional
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+MIN_SIZE = int(os.getenv("COMPRESSION_MIN_BYTES", "1024"))
+GZIP_LEVEL = 6
+# Brotli quality 4-5 is close to gzip speed with noticeably smaller output
+BROTLI_QUALITY = 4
+# Levels for content compressed once ahead of time (static assets)
+GZIP_LEVEL_BEST = 9
+BROTLI_QUALITY_BEST = 11
+
+COMPRESSIBLE_TYPES = ("application/json", "text/", "application/javascript", "image/svg+xml")
+
+
+def negotiate(accept_encoding: str) -> Optional[str]:
+    """Pick "br" or "gzip" from an Accept-Encoding header (q=0 means refused)"""
+    accepted = {}
+    for part in accept_encoding.lower().split(","):
+        name, _, params = part.strip().partition(";")
+        q = 1.0
+        if params.strip().startswith("q="):
+            try:
+                q = float(params.strip()[2:])
+            except ValueError:
+                q = 0.0
+        accepted[name.strip()] = q
+    if brotli is not None and accepted.get("br", 0) > 0:
+        return "br"
+    if accepted.get("gzip", 0) > 0:
+        return "gzip"
+    return None
+
+
+def compress(body: bytes, encoding: str, best: bool = False) -> bytes:
+    """Compress a whole body; `best` trades CPU for size when the result is reused"""
+    if encoding == "br":
+        return brotli.compress(body, quality=BROTLI_QUALITY_BEST if best else BROTLI_QUALITY)
+    return gzip.compress(body, compresslevel=GZIP_LEVEL_BEST if best else GZIP_LEVEL, mtime=0)
+
+
+class _StreamCompressor:
+    """Incremental compressor that flushes after every chunk (keeps streamed responses live)"""
+
+    def __init__(self, encoding: str):
+        self.encoding = encoding
+        if encoding == "br":
+            self._c = brotli.Compressor(quality=BROTLI_QUALITY)
+        else:
+            self._c = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def chunk(self, data: bytes) -> bytes:
+        if self.encoding == "br":
+            return self._c.process(data) + self._c.flush()
+        return self._c.compress(data) + self._c.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self) -> bytes:
+        if self.encoding == "br":
+            return self._c.finish()
+        return self._c.flush(zlib.Z_FINISH)
+
+
+class CompressionMiddleware:
+    """Pure ASGI middleware compressing text/JSON responses of at least `minimum_size` bytes
+
+    Responses that already carry a Content-Encoding (e.g. precompressed files)
+    are passed through untouched.
+    """
+
+    def __init__(self, app, minimum_size: int = MIN_SIZE):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        headers = dict(scope.get("headers") or [])
+        encoding = negotiate(headers.get(b"accept-encoding", b"").decode("latin-1"))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        state = {"start": None, "stream": None, "passthrough": False}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                state["start"] = message
+                return
+            if message["type"] != "http.response.body":
+                await send(message)
+                return
+
+            start = state["start"]
+            body = message.get("body", b"")
+            more = message.get("more_body", False)
+
+            if start is not None:
+                state["start"] = None
+                resp_headers = [(k.lower(), v) for k, v in start.get("headers", [])]
+                ctype = next((v.decode("latin-1") for k, v in resp_headers if k == b"content-type"), "")
+                already = any(k == b"content-encoding" for k, _ in resp_headers)
+                if already or not ctype.startswith(COMPRESSIBLE_TYPES) or (not more and len(body) < self.minimum_size):
+                    state["passthrough"] = True
+                    await send(start)
+                    await send(message)
+                    return
+
+                vary = [v for k, v in resp_headers if k == b"vary"] + [b"Accept-Encoding"]
+                kept = [(k, v) for k, v in resp_headers if k not in (b"content-length", b"vary")]
+                kept.append((b"content-encoding", encoding.encode()))
+                kept.append((b"vary", b", ".join(vary)))
+                if not more:
+                    compressed = compress(body, encoding)
+                    kept.append((b"content-length", str(len(compressed)).encode()))
+                    await send({**start, "headers": kept})
+                    await send({"type": "http.response.body", "body": compressed})
+                    return
+                state["stream"] = _StreamCompressor(encoding)
+                await send({**start, "headers": kept})
+
+            if state["passthrough"]:
+                await send(message)
+                return
+            stream = state["stream"]
+            data = stream.chunk(body) if body else b""
+            if not more:
+                data += stream.finish()
+            await send({"type": "http.response.body", "body": data, "more_body": more})
+
+        await self.app(scope, receive, send_wrapper)
@@ -0,0 +1,184 @@
+# Compact, token-budgeted context encoding for Gemini prompts
+import os
+from datetime import datetime, date
+from decimal import Decimal
+from typing import List, Dict, Any, Optional
+
+# Rough chars-per-token ratio for English/number-heavy prompts
+CHARS_PER_TOKEN = 4
+
+DEFAULT_TOKEN_BUDGET = int(os.getenv("CHAT_CONTEXT_TOKEN_BUDGET", "8000"))
+
+
+def estimate_tokens(text: str) -> int:
+    """Cheap token estimate (no tokenizer round trip)"""
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+def compact_value(value: Any, digits: int = 1) -> str:
+    """Render a single cell: rounded numbers, ISO dates, empty for NULL"""
+    if value is None:
+        return ""
+    if isinstance(value, bool):
+        return "1" if value else "0"
+    if isinstance(value, (Decimal, float)):
+        text = f"{float(value):.{digits}f}"
+        if "." in text:
+            text = text.rstrip("0").rstrip(".")
+        return text
+    if isinstance(value, datetime):
+        if value.hour == 0 and value.minute == 0 and value.second == 0:
+            return value.date().isoformat()
+        return value.strftime("%Y-%m-%dT%H:%M")
+    if isinstance(value, date):
+        return value.isoformat()
+    return str(value).replace("|", "/").replace("\n", " ")
+
+
+def encode_table(rows: List[Dict[str, Any]], digits: int = 1) -> List[str]:
+    """Encode rows as a header line followed by one pipe-separated line per row"""
+    if not rows:
+        return []
+    columns = list(rows[0].keys())
+    lines = ["|".join(columns)]
+    for row in rows:
+        lines.append("|".join(compact_value(row.get(col), digits) for col in columns))
+    return lines
+
+
+def _is_rows(value: Any) -> bool:
+    """A list of row dicts (what encode_table takes)"""
+    return isinstance(value, list) and bool(value) and all(isinstance(v, dict) for v in value)
+
+
+def encode_mapping(data: Dict[str, Any], digits: int = 1, prefix: str = "") -> List[str]:
+    """Encode a dict as `key: value` lines, skipping empty values
+
+    Nested dicts become `key.sub: value` lines and lists of scalars one
+    comma-separated value; lists of rows only get their count here, since
+    add_data renders them as tables.
+    """
+    lines = []
+    for key, value in data.items():
+        name = f"{prefix}{key}"
+        if isinstance(value, dict):
+            lines.extend(encode_mapping(value, digits, f"{name}."))
+            continue
+        if _is_rows(value):
+            text = f"{len(value)} rows"
+        elif isinstance(value, list):
+            text = ", ".join(t for t in (compact_value(v, digits) for v in value) if t)
+        else:
+            text = compact_value(value, digits)
+        if text:
+            lines.append(f"{name}: {text}")
+    return lines
+
+
+class PromptSection:
+    """A block of prompt lines that can be trimmed line by line"""
+
+    def __init__(self, name: str, header: str, lines: List[str], priority: int,
+                 keep: int = 0, fixed_lines: int = 0):
+        # priority: lower is trimmed first
+        # keep: minimum number of trimmable lines that must survive
+        # fixed_lines: leading lines that are never trimmed (e.g. table header)
+        self.name = name
+        self.header = header
+        self.fixed = lines[:fixed_lines]
+        self.lines = lines[fixed_lines:]
+        self.priority = priority
+        self.keep = keep
+        self.dropped = 0
+
+    def can_trim(self) -> bool:
+        return len(self.lines) > self.keep
+
+    def trim_one(self) -> int:
+        """Drop the oldest trimmable line and return its estimated token cost"""
+        line = self.lines.pop(0)
+        self.dropped += 1
+        return estimate_tokens(line) + 1
+
+    def render(self) -> str:
+        if not self.lines and not self.fixed and not self.header:
+            return ""
+        if not self.lines and self.keep == 0 and self.dropped:
+            # Nothing left worth sending for this section
+            return ""
+        parts = [self.header] if self.header else []
+        parts.extend(self.fixed)
+        parts.extend(self.lines)
+        return "\n".join(parts)
+
+
+class ContextEncoder:
+    """Build a prompt from sections and trim it to a token budget by priority"""
+
+    def __init__(self, budget_tokens: Optional[int] = None, digits: int = 1):
+        self.budget_tokens = budget_tokens or DEFAULT_TOKEN_BUDGET
+        self.digits = digits
+        self.sections: List[PromptSection] = []
+
+    def add_text(self, name: str, text: str, priority: int = 100):
+        """Add a block that is never trimmed line by line"""
+        self.sections.append(PromptSection(name, "", [text], priority, keep=1))
+
+    def add_table(self, name: str, title: str, rows: List[Dict[str, Any]], priority: int):
+        """Add a tabular data section; oldest rows are trimmed first"""
+        lines = encode_table(rows, self.digits)
+        if not lines:
+            lines = ["(no data)"]
+            self.sections.append(PromptSection(name, title, lines, priority, keep=1))
+            return
+        self.sections.append(PromptSection(name, title, lines, priority, fixed_lines=1))
+
+    def add_mapping(self, name: str, title: str, data: Dict[str, Any], priority: int):
+        """Add a key/value section (insight results)"""
+        lines = encode_mapping(data, self.digits) or ["(no data)"]
+        self.sections.append(PromptSection(name, title, lines, priority))
+
+    def add_data(self, name: str, title: str, data: Dict[str, Any], priority: int):
+        """Add a dict whose fields become a mapping and lists of rows become tables"""
+        tables = {k: v for k, v in data.items() if _is_rows(v) or v == []}
+        self.add_mapping(name, title, {k: v for k, v in data.items() if k not in tables}, priority)
+        for key, value in tables.items():
+            self.add_table(f"{name}.{key}", f"[{key}]", value, priority - 1)
+
+    def add_history(self, messages: List[Dict[str, Any]], priority: int, limit: int = 10):
+        """Add conversation history; the newest message is always kept"""
+        lines = []
+        for msg in messages[-limit:]:
+            role = "User" if msg['role'] == 'user' else "Assistant"
+            lines.append(f"{role}: {msg['content']}")
+        self.sections.append(
+            PromptSection("history", "\nConversation History:", lines, priority, keep=min(1, len(lines)))
+        )
+
+    def build(self) -> Dict[str, Any]:
+        """Trim sections to the budget and return the prompt plus size metrics"""
+        total = sum(estimate_tokens(s.render()) + 1 for s in self.sections)
+        est_before = total
+
+        # Trim the lowest-priority section first, oldest lines first
+        for section in sorted(self.sections, key=lambda s: s.priority):
+            while total > self.budget_tokens and section.can_trim():
+                total -= section.trim_one()
+            if total <= self.budget_tokens:
+                break
+
+        rendered = [(s, s.render()) for s in self.sections]
+        prompt = "\n".join(text for _, text in rendered if text)
+        est_tokens = estimate_tokens(prompt)
+        return {
+            "prompt": prompt,
+            "metrics": {
+                "chars": len(prompt),
+                "est_tokens": est_tokens,
+                "est_tokens_untrimmed": est_before,
+                "budget_tokens": self.budget_tokens,
+                "over_budget": est_tokens > self.budget_tokens,
+                "sections": {s.name: estimate_tokens(text) for s, text in rendered if text},
+                "trimmed_lines": {s.name: s.dropped for s in self.sections if s.dropped},
+            },
+        }
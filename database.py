@@ -1,10 +1,18 @@
 # Database helper functions
 import mysql.connector
-from mysql.connector import pooling
-from typing import List, Dict, Any, Optional
+from mysql.connector.errors import PoolError
+import sys
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import List, Dict, Any, Optional, Sequence
 import os
 from dotenv import load_dotenv
 
+from metrics import Histogram, REGISTRY, _fmt_labels
+
 load_dotenv()
 
 # Database configuration
@@ -16,29 +24,670 @@ DB_CONFIG = {
     "password": os.getenv("DB_PASS", "maria"),
 }
 
-pool = pooling.MySQLConnectionPool(
-    pool_name="health_pool",
-    pool_size=8,
-    **DB_CONFIG
+# Pool sizing and lifecycle (see .env.example)
+POOL_CONFIG = {
+    "size": int(os.getenv("DB_POOL_SIZE", "8")),
+    "max_overflow": int(os.getenv("DB_POOL_MAX_OVERFLOW", "4")),
+    "timeout": float(os.getenv("DB_POOL_TIMEOUT_S", "10")),
+    "recycle": float(os.getenv("DB_POOL_RECYCLE_S", "1800")),
+    "pre_ping": float(os.getenv("DB_POOL_PRE_PING_S", "30")),
+}
+
+# Read replicas: comma-separated host[:port] list; empty means all reads go to the primary
+REPLICA_HOSTS = os.getenv("DB_REPLICA_HOSTS", "")
+REPLICA_POOL_CONFIG = dict(
+    POOL_CONFIG,
+    size=int(os.getenv("DB_REPLICA_POOL_SIZE", "8")),
+    max_overflow=int(os.getenv("DB_REPLICA_POOL_MAX_OVERFLOW", "4")),
 )
+# After a write, a user's reads go to the primary for this long (read-your-writes)
+READ_YOUR_WRITES_S = float(os.getenv("DB_READ_YOUR_WRITES_S", "5"))
+# Longer pin after an import finishes, while replicas apply the bulk insert
+IMPORT_PIN_S = float(os.getenv("DB_IMPORT_PIN_S", "120"))
+# A replica that fails a checkout is skipped for this long
+REPLICA_RETRY_S = float(os.getenv("DB_REPLICA_RETRY_S", "30"))
+# How long a read waits on a saturated replica before trying the next one
+REPLICA_CHECKOUT_TIMEOUT_S = float(os.getenv("DB_REPLICA_CHECKOUT_TIMEOUT_S", "0.25"))
+
+
+class PoolTimeout(PoolError):
+    """No connection became available within the checkout timeout"""
+
+
+class PooledConnection:
+    """Proxy around a driver connection; close() returns it to the pool"""
+
+    def __init__(self, pool: "ConnectionPool", cnx):
+        self._pool = pool
+        self._cnx = cnx
+        self.created_at = time.monotonic()
+        self.last_used = self.created_at
+        self.checked_out = False
+        # Process that opened the socket (see ConnectionPool._after_fork)
+        self.pid = os.getpid()
+
+    def __getattr__(self, name):
+        return getattr(self._cnx, name)
+
+    def close(self):
+        if self.checked_out:
+            self._pool._checkin(self)
+
+
+class ConnectionPool:
+    """Thread-safe pool with overflow, a bounded wait queue, pre-ping and recycling
+
+    - up to `size` connections are kept idle for reuse; up to `max_overflow`
+      extra connections are opened under load and closed when returned
+    - when everything is checked out, callers wait (FIFO-ish) up to `timeout`
+      seconds and then get PoolTimeout instead of an immediate failure
+    - idle connections older than `recycle` seconds are replaced, and ones idle
+      longer than `pre_ping` seconds are pinged before being handed out
+    """
+
+    def __init__(self, pool_name: str, size: int = 8, max_overflow: int = 0, timeout: float = 10.0,
+                 recycle: float = 1800.0, pre_ping: float = 30.0, **config):
+        self.pool_name = pool_name
+        self.pool_size = size
+        self.max_overflow = max_overflow
+        self.timeout = timeout
+        self.recycle = recycle
+        self.pre_ping = pre_ping
+        self._config = config
+
+        self._pid = os.getpid()
+        self._cond = threading.Condition()
+        self._idle: List[PooledConnection] = []
+        self._open = 0
+        self._in_use = 0
+        self._waiting = 0
+        # Connections inherited across a fork: never used or closed by this process
+        self._inherited: List[PooledConnection] = []
+
+        self.wait_ms = Histogram()
+        self.checkouts = 0
+        self.timeouts = 0
+        self.created = 0
+        self.recycled = 0
+        self.ping_failures = 0
+
+    def _connect(self) -> PooledConnection:
+        cnx = mysql.connector.connect(**self._config)
+        self.created += 1
+        return PooledConnection(self, cnx)
+
+    def _discard(self, conn: PooledConnection):
+        try:
+            conn._cnx.close()
+        except Exception:
+            pass
+
+    def _validate(self, conn: PooledConnection) -> bool:
+        """Recycle old connections and ping ones that sat idle too long"""
+        now = time.monotonic()
+        if self.recycle and now - conn.created_at > self.recycle:
+            self.recycled += 1
+            return False
+        if self.pre_ping and now - conn.last_used > self.pre_ping:
+            try:
+                conn._cnx.ping(reconnect=False)
+            except Exception:
+                self.ping_failures += 1
+                return False
+        return True
+
+    def _after_fork(self):
+        """Start empty in a forked child
+
+        Inherited sockets still belong to the parent's sessions; closing them here
+        would send COM_QUIT on the parent's connection, so they are only dropped
+        from the pool and kept referenced.
+        """
+        self._inherited.extend(self._idle)
+        self._pid = os.getpid()
+        self._cond = threading.Condition()
+        self._idle = []
+        self._open = self._in_use = self._waiting = 0
+
+    def get_connection(self, timeout: Optional[float] = None) -> PooledConnection:
+        """Check out a connection, waiting up to `timeout` seconds"""
+        if self._pid != os.getpid():
+            self._after_fork()
+        timeout = self.timeout if timeout is None else timeout
+        start = time.monotonic()
+        deadline = start + timeout
+        conn = None
+        with self._cond:
+            while True:
+                if self._idle:
+                    conn = self._idle.pop()
+                    break
+                if self._open < self.pool_size + self.max_overflow:
+                    # Reserve a slot; connect outside the lock
+                    self._open += 1
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self.timeouts += 1
+                    raise PoolTimeout(
+                        f"Timed out after {timeout:.1f}s waiting for a connection from "
+                        f"'{self.pool_name}' ({self._in_use} in use, {self._waiting} waiting)"
+                    )
+                self._waiting += 1
+                try:
+                    self._cond.wait(remaining)
+                finally:
+                    self._waiting -= 1
+            self._in_use += 1
+            self.checkouts += 1
+
+        if conn is not None and not self._validate(conn):
+            self._discard(conn)
+            conn = None
+        if conn is None:
+            try:
+                conn = self._connect()
+            except Exception:
+                with self._cond:
+                    self._open -= 1
+                    self._in_use -= 1
+                    self._cond.notify()
+                raise
+
+        conn.checked_out = True
+        self.wait_ms.observe((time.monotonic() - start) * 1000)
+        return conn
+
+    def _checkin(self, conn: PooledConnection):
+        conn.checked_out = False
+        if conn.pid != os.getpid():
+            # Checked out before a fork: not ours to reuse or close
+            return
+        conn.last_used = time.monotonic()
+        try:
+            if conn._cnx.in_transaction:
+                conn._cnx.rollback()
+            healthy = True
+        except Exception:
+            healthy = False
+        with self._cond:
+            self._in_use -= 1
+            if healthy and len(self._idle) < self.pool_size:
+                self._idle.append(conn)
+                conn = None
+            else:
+                # Overflow (or broken) connection: close it and free the slot
+                self._open -= 1
+            self._cond.notify()
+        if conn is not None:
+            self._discard(conn)
+
+    def warm(self, count: int) -> int:
+        """Open up to `count` idle connections ahead of the first requests"""
+        conns = []
+        try:
+            for _ in range(min(count, self.pool_size)):
+                conns.append(self.get_connection())
+        finally:
+            for conn in conns:
+                conn.close()
+        return len(conns)
+
+    def close_all(self):
+        """Close idle connections (checked-out ones are closed when returned)"""
+        with self._cond:
+            idle, self._idle = self._idle, []
+            self._open -= len(idle)
+        for conn in idle:
+            self._discard(conn)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            open_, in_use, idle, waiting = self._open, self._in_use, len(self._idle), self._waiting
+        return {
+            "pool": self.pool_name,
+            "size": self.pool_size,
+            "max_overflow": self.max_overflow,
+            "open": open_,
+            "in_use": in_use,
+            "idle": idle,
+            "waiting": waiting,
+            "checkouts": self.checkouts,
+            "checkout_timeouts": self.timeouts,
+            "connections_created": self.created,
+            "connections_recycled": self.recycled,
+            "ping_failures": self.ping_failures,
+            "checkout_wait_ms": self.wait_ms.snapshot(),
+        }
+
+
+def _replica_configs(hosts: str) -> List[Dict[str, Any]]:
+    """Connection configs for each host[:port] entry in DB_REPLICA_HOSTS"""
+    configs = []
+    for entry in filter(None, (h.strip() for h in hosts.split(","))):
+        host, _, port = entry.partition(":")
+        configs.append(dict(
+            DB_CONFIG,
+            host=host,
+            port=int(port or DB_CONFIG["port"]),
+            user=os.getenv("DB_REPLICA_USER", DB_CONFIG["user"]),
+            password=os.getenv("DB_REPLICA_PASS", DB_CONFIG["password"]),
+        ))
+    return configs
+
+
+# Primary: all writes, imports and pinned reads
+pool = ConnectionPool(pool_name="health_pool", **POOL_CONFIG, **DB_CONFIG)
+replica_pools = [
+    ConnectionPool(pool_name=f"replica_{i}", **REPLICA_POOL_CONFIG, **config)
+    for i, config in enumerate(_replica_configs(REPLICA_HOSTS))
+]
+
+
+class ReplicaRouter:
+    """Chooses the pool for each checkout
+
+    - writes always go to the primary
+    - reads are spread round-robin over healthy replicas, falling back to the
+      primary when none is reachable
+    - a replica whose pool is merely saturated is not marked down: the read
+      tries the other replicas briefly, then waits on one like any pool checkout
+    - a user who just wrote (or whose import just finished) is pinned to the
+      primary for a short window so they read their own writes
+
+    Pins are per process; with several workers a user may briefly read a
+    lagging replica from another worker.
+    """
+
+    def __init__(self, primary: ConnectionPool, replicas: List[ConnectionPool],
+                 retry_after: float = REPLICA_RETRY_S):
+        self.primary = primary
+        self.replicas = replicas
+        self.retry_after = retry_after
+        self._lock = threading.Lock()
+        self._next = 0
+        self._pins: Dict[int, float] = {}
+        self._down_until: Dict[str, float] = {}
+        self.routed = {"primary": 0, "replica": 0, "pinned": 0, "fallback": 0, "replica_busy": 0}
+
+    def pin(self, user_id: int, seconds: float = READ_YOUR_WRITES_S):
+        """Route the user's reads to the primary for the next `seconds`"""
+        if not self.replicas or seconds <= 0:
+            return
+        now = time.monotonic()
+        with self._lock:
+            self._pins[user_id] = max(self._pins.get(user_id, 0.0), now + seconds)
+            if len(self._pins) > 10000:
+                self._pins = {u: t for u, t in self._pins.items() if t > now}
+
+    def is_pinned(self, user_id: Optional[int]) -> bool:
+        if user_id is None:
+            return False
+        with self._lock:
+            until = self._pins.get(user_id)
+        return until is not None and until > time.monotonic()
+
+    def _healthy_replicas(self) -> List[ConnectionPool]:
+        now = time.monotonic()
+        with self._lock:
+            return [r for r in self.replicas if self._down_until.get(r.pool_name, 0.0) <= now]
+
+    def get_connection(self, read: bool = False, user_id: Optional[int] = None) -> PooledConnection:
+        if not read or not self.replicas:
+            self.routed["primary"] += 1
+            return self.primary.get_connection()
+        if self.is_pinned(user_id):
+            self.routed["pinned"] += 1
+            return self.primary.get_connection()
+
+        replicas = self._healthy_replicas()
+        busy: List[ConnectionPool] = []
+        for _ in range(len(replicas)):
+            with self._lock:
+                replica = replicas[self._next % len(replicas)]
+                self._next += 1
+            try:
+                conn = replica.get_connection(timeout=REPLICA_CHECKOUT_TIMEOUT_S)
+            except PoolTimeout:
+                busy.append(replica)
+                continue
+            except mysql.connector.Error as e:
+                print(f"Replica {replica.pool_name} unavailable, skipping for {self.retry_after:.0f}s: {e}")
+                with self._lock:
+                    self._down_until[replica.pool_name] = time.monotonic() + self.retry_after
+                continue
+            self.routed["replica"] += 1
+            return conn
+
+        if busy:
+            # Load, not an outage: queue on a replica rather than moving reads to the primary
+            self.routed["replica_busy"] += 1
+            return busy[0].get_connection()
+
+        self.routed["fallback"] += 1
+        return self.primary.get_connection()
+
+    def pools(self) -> List[ConnectionPool]:
+        return [self.primary] + self.replicas
+
+    def stats(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        with self._lock:
+            pinned = sum(1 for t in self._pins.values() if t > now)
+            down = [name for name, t in self._down_until.items() if t > now]
+        return {"replicas": len(self.replicas), "pinned_users": pinned,
+                "replicas_down": down, "routed": dict(self.routed)}
+
+
+router = ReplicaRouter(pool, replica_pools)
+
+# Connections opened per pool at worker startup (0 = connect on first use)
+POOL_WARM = int(os.getenv("DB_POOL_WARM", "0"))
+
+
+def _reset_pools_after_fork():
+    for p in router.pools():
+        p._after_fork()
+
+
+# Covers forks that do not go through get_connection first (e.g. gunicorn --preload)
+os.register_at_fork(after_in_child=_reset_pools_after_fork)
+
 
-def get_connection():
-    """Get a database connection from the pool"""
-    return pool.get_connection()
+def warm_pools(count: int = POOL_WARM) -> int:
+    """Open `count` connections per pool in this process; returns how many were opened"""
+    opened = 0
+    for p in router.pools():
+        try:
+            opened += p.warm(count)
+        except mysql.connector.Error as e:
+            print(f"Could not warm pool {p.pool_name}: {e}")
+    return opened
 
-def fetch_all(sql: str, params: tuple) -> List[Dict[str, Any]]:
-    """Execute query and fetch all results"""
-    cnx = get_connection()
+
+def close_pools():
+    """Close idle connections of every pool (worker shutdown)"""
+    for p in router.pools():
+        p.close_all()
+
+# Queries slower than this get their EXPLAIN plan captured (0 disables)
+SLOW_QUERY_MS = float(os.getenv("DB_SLOW_QUERY_MS", "200"))
+# Capture at most one plan per call site per interval
+SLOW_QUERY_EXPLAIN_INTERVAL_S = 60.0
+
+
+class QueryStats:
+    """Per-call-site latency histograms, row counts and a slow query log"""
+
+    def __init__(self, slow_log_size: int = 50):
+        self._lock = threading.Lock()
+        self._sites: Dict[str, Dict[str, Any]] = {}
+        self._slow_log: deque = deque(maxlen=slow_log_size)
+        self._last_explain: Dict[str, float] = {}
+
+    def record(self, label: str, sql: str, ms: float, rows: int, error: bool = False):
+        with self._lock:
+            site = self._sites.get(label)
+            if site is None:
+                site = self._sites[label] = {
+                    "sql": " ".join(sql.split())[:300],
+                    "calls": 0,
+                    "rows": 0,
+                    "errors": 0,
+                    "latency_ms": Histogram(),
+                }
+            site["calls"] += 1
+            site["rows"] += max(rows, 0)
+            site["errors"] += int(error)
+        site["latency_ms"].observe(ms)
+
+    def should_explain(self, label: str) -> bool:
+        now = time.monotonic()
+        with self._lock:
+            if now - self._last_explain.get(label, -SLOW_QUERY_EXPLAIN_INTERVAL_S) < SLOW_QUERY_EXPLAIN_INTERVAL_S:
+                return False
+            self._last_explain[label] = now
+            return True
+
+    def record_slow(self, label: str, sql: str, ms: float, rows: int, plan: Optional[List[Dict[str, Any]]]):
+        self._slow_log.append({
+            "label": label,
+            "sql": " ".join(sql.split())[:1000],
+            "ms": round(ms, 2),
+            "rows": rows,
+            "at": time.time(),
+            "explain": plan,
+        })
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            sites = dict(self._sites)
+            slow = list(self._slow_log)
+        queries = []
+        for label, site in sites.items():
+            latency = site["latency_ms"].snapshot()
+            queries.append({
+                "label": label,
+                "sql": site["sql"],
+                "calls": site["calls"],
+                "rows": site["rows"],
+                "errors": site["errors"],
+                "total_ms": latency["sum"],
+                "latency_ms": latency,
+            })
+        queries.sort(key=lambda q: q["total_ms"], reverse=True)
+        return {"slow_query_ms": SLOW_QUERY_MS, "queries": queries, "slow_log": slow}
+
+
+query_stats = QueryStats()
+
+
+# name -> (type, help) of the families rendered by _collect_db_metrics, in output order
+_DB_FAMILIES = {
+    "db_pool_size": ("gauge", "Configured connections per pool"),
+    "db_pool_open": ("gauge", "Connections currently open"),
+    "db_pool_in_use": ("gauge", "Connections checked out"),
+    "db_pool_idle": ("gauge", "Open connections waiting in the pool"),
+    "db_pool_waiting": ("gauge", "Threads waiting for a connection"),
+    "db_pool_checkouts_total": ("counter", "Connection checkouts"),
+    "db_pool_checkout_timeouts_total": ("counter", "Checkouts that timed out waiting for a connection"),
+    "db_pool_connections_created_total": ("counter", "Connections opened"),
+    "db_pool_connections_recycled_total": ("counter", "Connections closed for exceeding their maximum age"),
+    "db_pool_checkout_wait_ms": ("summary", "Time spent waiting for a connection"),
+    "db_routed_checkouts_total": ("counter", "Checkouts by read/write routing decision"),
+    "db_query_calls_total": ("counter", "Queries by call site"),
+    "db_query_errors_total": ("counter", "Failed queries by call site"),
+    "db_query_rows_total": ("counter", "Rows returned or affected by call site"),
+    "db_query_duration_ms": ("summary", "Query time by call site"),
+}
+
+
+def _collect_db_metrics() -> List[str]:
+    """Scrape-time exposition lines for pool and per-call-site query stats"""
+    samples: Dict[str, List[str]] = {name: [] for name in _DB_FAMILIES}
+
+    def add(family: str, suffix: str, label: str, value, metric: Any):
+        samples[family].append(f"{family}{suffix}{_fmt_labels((label,), (value,))} {metric}")
+
+    for p in router.pools():
+        stats = p.stats()
+        for key in ("size", "open", "in_use", "idle", "waiting"):
+            add(f"db_pool_{key}", "", "pool", stats["pool"], stats[key])
+        for key in ("checkouts", "checkout_timeouts", "connections_created", "connections_recycled"):
+            add(f"db_pool_{key}_total", "", "pool", stats["pool"], stats[key])
+        wait = stats["checkout_wait_ms"]
+        add("db_pool_checkout_wait_ms", "_sum", "pool", stats["pool"], wait["sum"])
+        add("db_pool_checkout_wait_ms", "_count", "pool", stats["pool"], wait["count"])
+    for route, count in dict(router.routed).items():
+        add("db_routed_checkouts_total", "", "route", route, count)
+    for q in query_stats.snapshot()["queries"]:
+        site = q["label"]
+        add("db_query_calls_total", "", "site", site, q["calls"])
+        add("db_query_errors_total", "", "site", site, q["errors"])
+        add("db_query_rows_total", "", "site", site, q["rows"])
+        add("db_query_duration_ms", "_sum", "site", site, q["total_ms"])
+        add("db_query_duration_ms", "_count", "site", site, q["calls"])
+
+    lines = []
+    for name, (kind, help_text) in _DB_FAMILIES.items():
+        lines += [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"] + samples[name]
+    return lines
+
+
+REGISTRY.register_collector(_collect_db_metrics)
+
+# Per-request state set by the HTTP middleware: DB timing for Server-Timing and the
+# authenticated user for read routing. The dict is shared (not copied) into threadpool
+# contexts, so values set by a dependency are visible to the endpoint.
+request_context: ContextVar[Optional[Dict[str, Any]]] = ContextVar("request_context", default=None)
+
+
+def bind_user(user_id: int):
+    """Record the authenticated user of the current request for read-your-writes routing"""
+    ctx = request_context.get()
+    if ctx is not None:
+        ctx["user_id"] = user_id
+
+
+def _current_user() -> Optional[int]:
+    ctx = request_context.get()
+    return ctx.get("user_id") if ctx is not None else None
+
+
+def pin_user(user_id: int, seconds: float = READ_YOUR_WRITES_S):
+    """Send the user's reads to the primary for a while (e.g. after an import)"""
+    router.pin(user_id, seconds)
+
+
+def pool_stats() -> Dict[str, Any]:
+    """Stats for every pool plus routing counters"""
+    return {"pools": [p.stats() for p in router.pools()], "routing": router.stats()}
+
+
+def _call_site() -> str:
+    """module.function:line of the first caller outside this module"""
+    frame = sys._getframe(1)
+    while frame is not None and frame.f_code.co_filename == __file__:
+        frame = frame.f_back
+    if frame is None:
+        return "unknown"
+    module = os.path.splitext(os.path.basename(frame.f_code.co_filename))[0]
+    return f"{module}.{frame.f_code.co_name}:{frame.f_lineno}"
+
+
+def _is_explainable(sql: str) -> bool:
+    head = sql.lstrip()[:6].lower()
+    return head.startswith("select") or head.startswith("with")
+
+
+class TimedCursor:
+    """Buffered cursor whose execute()/callproc() are timed and attributed to a call site"""
+
+    def __init__(self, cnx, dictionary: bool = False, label: Optional[str] = None):
+        self._cnx = cnx
+        self._cur = cnx.cursor(buffered=True, dictionary=dictionary)
+        self._label = label
+
+    def __getattr__(self, name):
+        return getattr(self._cur, name)
+
+    def _record(self, label: str, sql: str, params, ms: float, rows: int, error: bool = False):
+        query_stats.record(label, sql, ms, rows, error)
+        timing = request_context.get()
+        if timing is not None:
+            timing["db_ms"] += ms
+            timing["db_queries"] += 1
+        if not error and SLOW_QUERY_MS and ms >= SLOW_QUERY_MS and query_stats.should_explain(label):
+            plan = None
+            if _is_explainable(sql):
+                try:
+                    ex = self._cnx.cursor(buffered=True, dictionary=True)
+                    ex.execute("EXPLAIN " + sql, params)
+                    plan = [{k: (v if isinstance(v, (int, float, str)) or v is None else str(v))
+                             for k, v in row.items()} for row in ex.fetchall()]
+                    ex.close()
+                except Exception as e:
+                    plan = [{"error": str(e)}]
+            query_stats.record_slow(label, sql, ms, rows, plan)
+
+    def execute(self, sql: str, params: tuple = ()):
+        label = self._label or _call_site()
+        start = time.perf_counter()
+        try:
+            self._cur.execute(sql, params)
+        except Exception:
+            self._record(label, sql, params, (time.perf_counter() - start) * 1000, 0, error=True)
+            raise
+        self._record(label, sql, params, (time.perf_counter() - start) * 1000, self._cur.rowcount)
+
+    def callproc(self, name: str, args: Sequence[Any] = ()):
+        label = self._label or _call_site()
+        sql = f"CALL {name}"
+        start = time.perf_counter()
+        try:
+            result = self._cur.callproc(name, args)
+        except Exception:
+            self._record(label, sql, args, (time.perf_counter() - start) * 1000, 0, error=True)
+            raise
+        self._record(label, sql, args, (time.perf_counter() - start) * 1000, self._cur.rowcount)
+        return result
+
+
+def get_connection(read: bool = False):
+    """Get a database connection: primary by default, a replica when read=True"""
+    return router.get_connection(read=read, user_id=_current_user() if read else None)
+
+@contextmanager
+def cursor(dictionary: bool = False, commit: bool = False, label: Optional[str] = None,
+           read: bool = False):
+    """Yield a TimedCursor on a pooled connection; commits on success if commit=True, else rolls back on error
+
+    read=True allows the connection to come from a replica. Committed writes pin
+    the request's user to the primary for READ_YOUR_WRITES_S.
+    """
+    cnx = get_connection(read=read)
     try:
-        cur = cnx.cursor(dictionary=True)
-        cur.execute(sql, params)
-        rows = cur.fetchall()
-        cur.close()
-        return rows
+        cur = TimedCursor(cnx, dictionary=dictionary, label=label)
+        try:
+            yield cur
+            if commit:
+                cnx.commit()
+                user_id = _current_user()
+                if user_id is not None:
+                    router.pin(user_id)
+        except Exception:
+            cnx.rollback()
+            raise
+        finally:
+            cur.close()
     finally:
         cnx.close()
 
-def fetch_one(sql: str, params: tuple) -> Optional[Dict[str, Any]]:
+def fetch_all(sql: str, params: tuple, label: Optional[str] = None, read: bool = True) -> List[Dict[str, Any]]:
+    """Execute query and fetch all results (from a replica unless read=False or the user is pinned)"""
+    with cursor(dictionary=True, label=label or _call_site(), read=read) as cur:
+        cur.execute(sql, params)
+        return cur.fetchall()
+
+def fetch_one(sql: str, params: tuple, label: Optional[str] = None, read: bool = True) -> Optional[Dict[str, Any]]:
     """Execute query and fetch one result"""
-    rows = fetch_all(sql, params)
+    rows = fetch_all(sql, params, label or _call_site(), read)
     return rows[0] if rows else None
+
+def fetch_scalar(sql: str, params: tuple, label: Optional[str] = None, read: bool = True) -> Any:
+    """Execute query and return the first column of the first row (or None)"""
+    with cursor(label=label or _call_site(), read=read) as cur:
+        cur.execute(sql, params)
+        row = cur.fetchone()
+        return row[0] if row else None
+
+def execute(sql: str, params: tuple, label: Optional[str] = None) -> Dict[str, int]:
+    """Execute a single write statement and commit; returns rowcount and lastrowid"""
+    with cursor(commit=True, label=label or _call_site()) as cur:
+        cur.execute(sql, params)
+        return {"rowcount": cur.rowcount, "lastrowid": cur.lastrowid}
+
+def call_proc(name: str, args: Sequence[Any], label: Optional[str] = None) -> tuple:
+    """Call a stored procedure and commit; returns the (IN/OUT) argument tuple"""
+    with cursor(commit=True, label=label or _call_site()) as cur:
+        return cur.callproc(name, args)
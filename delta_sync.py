@@ -0,0 +1,57 @@
+# Data versions and day-range planning for the dashboard's delta-sync endpoint
+from datetime import date, timedelta
+from typing import List, Optional, Tuple
+
+from database import execute, fetch_all, fetch_scalar
+
+# Day ranges are half-open: [first, end)
+DayRange = Tuple[date, date]
+
+# Longest range a single sync request may ask for
+MAX_SYNC_DAYS = 3660
+
+
+def current_version(user_id: int) -> int:
+    """The user's data version: id of their latest data_change row, 0 before any"""
+    return fetch_scalar("SELECT COALESCE(MAX(change_id), 0) FROM data_change WHERE user_id = %s",
+                        (user_id,)) or 0
+
+
+def record_change(user_id: int, first_day: date, last_day: date) -> int:
+    """Record that an import touched first_day..last_day (inclusive); returns the new version"""
+    result = execute(
+        "INSERT INTO data_change (user_id, first_day, last_day) VALUES (%s, %s, %s)",
+        (user_id, first_day, last_day), label="delta_sync.record_change"
+    )
+    return result["lastrowid"]
+
+
+def changed_since(user_id: int, version: int) -> List[DayRange]:
+    rows = fetch_all(
+        "SELECT first_day, last_day FROM data_change WHERE user_id = %s AND change_id > %s",
+        (user_id, version)
+    )
+    return [(r["first_day"], r["last_day"] + timedelta(days=1)) for r in rows]
+
+
+def _merge(ranges: List[DayRange]) -> List[DayRange]:
+    merged: List[DayRange] = []
+    for lo, hi in sorted(r for r in ranges if r[0] < r[1]):
+        if merged and lo <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], hi))
+        else:
+            merged.append((lo, hi))
+    return merged
+
+
+def plan(want: DayRange, have: Optional[DayRange], changes: List[DayRange]) -> List[DayRange]:
+    """Day ranges to send: the wanted days the client lacks, plus changed days it holds or wants
+
+    `have` must overlap or touch `want` (the client keeps one contiguous
+    range), so the days it ends up holding are again one range.
+    """
+    if have is None:
+        return [want]
+    missing = [(want[0], min(want[1], have[0])), (max(want[0], have[1]), want[1])]
+    lo, hi = min(want[0], have[0]), max(want[1], have[1])
+    return _merge(missing + [(max(c[0], lo), min(c[1], hi)) for c in changes])
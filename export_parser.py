@@ -0,0 +1,85 @@
+# Constant-memory streaming over the top-level elements of an Apple Health export.xml
+import os
+import xml.etree.ElementTree as ET
+from typing import Iterable, Iterator, Optional
+
+try:
+    from lxml import etree as lxml_etree
+except ImportError:
+    lxml_etree = None
+
+# Top-level elements the importer handles. Everything else (ExportDate,
+# Correlation, ClinicalRecord, ...) is skipped without being kept in memory.
+IMPORTED_TAGS = ("Me", "Record", "Workout", "ActivitySummary")
+
+# "stdlib" or "lxml"; both keep memory flat, compare speed with parser_memcheck.py
+PARSER = os.getenv("EXPORT_PARSER", "stdlib")
+
+
+def _iter_stdlib(xml_path: str, tags: frozenset) -> Iterator[ET.Element]:
+    """ElementTree iterparse, detaching every finished top-level element from the root
+
+    Elements below a skipped top-level element are cleared and removed from
+    their parent as soon as they end, so even a large unwanted subtree only
+    holds its open elements plus whatever iterparse has read ahead.
+    """
+    depth = 0
+    root = None
+    skipping = False
+    # Open elements of the skipped subtree, from its top-level element down
+    open_skipped = []
+    for event, elem in ET.iterparse(xml_path, events=("start", "end")):
+        if event == "start":
+            depth += 1
+            if depth == 1:
+                root = elem
+            elif depth == 2:
+                skipping = elem.tag not in tags
+            if skipping and depth >= 2:
+                open_skipped.append(elem)
+            continue
+
+        depth -= 1
+        if depth == 1:
+            if not skipping:
+                yield elem
+            # The root only holds finished children here; dropping them keeps it empty
+            root.clear()
+            open_skipped.clear()
+        elif depth > 1 and skipping:
+            open_skipped.pop()
+            elem.clear()
+            # Finished siblings were already removed, so this is the parent's first child
+            open_skipped[-1].remove(elem)
+
+
+def _iter_lxml(xml_path: str, tags: frozenset) -> Iterator["lxml_etree._Element"]:
+    """lxml iterparse with tag filtering; events fire only for the imported tags"""
+    context = lxml_etree.iterparse(xml_path, events=("end",), tag=tuple(tags),
+                                   resolve_entities=False, no_network=True, huge_tree=True)
+    for _, elem in context:
+        parent = elem.getparent()
+        # Nested matches (e.g. Records inside a Correlation) are not top-level data
+        if parent is None or parent.getparent() is not None:
+            continue
+        yield elem
+        elem.clear(keep_tail=False)
+        # Drop this element and every sibling before it, including skipped subtrees
+        while elem.getprevious() is not None:
+            del parent[0]
+        del parent[0]
+
+
+def iter_export(xml_path: str, tags: Iterable[str] = IMPORTED_TAGS, parser: Optional[str] = None) -> Iterator:
+    """Yield the top-level elements of an export whose tag is in `tags`
+
+    Each element is complete (attributes and children such as MetadataEntry)
+    when yielded, and is freed as soon as the caller asks for the next one,
+    so callers must not keep references to yielded elements.
+    """
+    parser = parser or PARSER
+    if parser == "lxml":
+        if lxml_etree is None:
+            raise RuntimeError("EXPORT_PARSER=lxml but lxml is not installed")
+        return _iter_lxml(xml_path, frozenset(tags))
+    return _iter_stdlib(xml_path, frozenset(tags))
@@ -0,0 +1,263 @@
+# Vectorized health insight engine (replaces fn_health_trend_summary,
+# fn_health_consistency_score and fn_detect_correlations)
+from datetime import date, datetime, timedelta
+from typing import Dict, Any, Optional, Tuple
+
+import numpy as np
+
+from database import fetch_all
+
+# Row order of the per-day matrix
+# ("samples" counts health_sample rows of any type, as fn_health_consistency_score did)
+METRICS = ("hrv", "hr", "workouts", "active_energy", "samples")
+HRV, HR, WORKOUTS, ACTIVE_ENERGY, SAMPLES = range(len(METRICS))
+
+# One round trip: per-day sums and counts for every metric. Range predicates are
+# on the raw indexed columns so (user_id, start_date) indexes are usable; DATE()
+# only appears in GROUP BY.
+DAILY_MATRIX_SQL = """
+    SELECT 0 AS metric, DATE(start_date) AS day, SUM(value) AS total, COUNT(*) AS n
+    FROM hrv
+    WHERE user_id=%s AND start_date >= %s AND start_date < %s
+    GROUP BY DATE(start_date)
+    UNION ALL
+    SELECT 1, DATE(start_time), SUM(avg_value), COUNT(*)
+    FROM health_sample
+    WHERE user_id=%s AND sample_type='heart_rate' AND start_time >= %s AND start_time < %s
+    GROUP BY DATE(start_time)
+    UNION ALL
+    SELECT 2, DATE(start_date), COUNT(*), COUNT(*)
+    FROM workout
+    WHERE user_id=%s AND start_date >= %s AND start_date < %s
+    GROUP BY DATE(start_date)
+    UNION ALL
+    SELECT 3, date, SUM(active_energy_burned), COUNT(*)
+    FROM activity_summary
+    WHERE user_id=%s AND date >= %s AND date < %s
+    GROUP BY date
+    UNION ALL
+    SELECT 4, DATE(start_time), COUNT(*), COUNT(*)
+    FROM health_sample
+    WHERE user_id=%s AND start_time >= %s AND start_time < %s
+    GROUP BY DATE(start_time)
+"""
+
+
+class DailyMatrix:
+    """Per-day sums and counts, shape (len(METRICS), days); column 0 is `start`"""
+
+    def __init__(self, start: date, days: int):
+        self.start = start
+        self.days = days
+        self.sums = np.zeros((len(METRICS), days), dtype=np.float64)
+        self.counts = np.zeros((len(METRICS), days), dtype=np.int64)
+
+    def means(self) -> np.ndarray:
+        """Daily means with NaN for days without data"""
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return np.where(self.counts > 0, self.sums / np.maximum(self.counts, 1), np.nan)
+
+    def tail(self, days: int) -> "DailyMatrix":
+        """View of the last `days` columns (lets one fetch serve several windows)"""
+        days = min(days, self.days)
+        view = DailyMatrix(self.start + timedelta(days=self.days - days), 0)
+        view.days = days
+        view.sums = self.sums[:, self.days - days:]
+        view.counts = self.counts[:, self.days - days:]
+        return view
+
+    def window_mean(self, metric: int, lo: int, hi: int) -> Optional[float]:
+        """Mean of the raw values in day columns [lo, hi) (weighted like SQL AVG)"""
+        n = self.counts[metric, lo:hi].sum()
+        if n == 0:
+            return None
+        return float(self.sums[metric, lo:hi].sum() / n)
+
+
+def load_daily_matrix(user_id: int, days: int, end: Optional[datetime] = None) -> DailyMatrix:
+    """Fetch the last `days` days (ending with today, UTC) into a DailyMatrix"""
+    end = end or datetime.utcnow()
+    end_day = end.date() + timedelta(days=1)
+    start_day = end_day - timedelta(days=days)
+    params = (user_id, start_day, end_day) * len(METRICS)
+
+    matrix = DailyMatrix(start_day, days)
+    rows = fetch_all(DAILY_MATRIX_SQL, params)
+    if not rows:
+        return matrix
+
+    metric = np.fromiter((r["metric"] for r in rows), dtype=np.int64, count=len(rows))
+    offset = np.fromiter(((r["day"] - start_day).days for r in rows), dtype=np.int64, count=len(rows))
+    total = np.fromiter((float(r["total"] or 0) for r in rows), dtype=np.float64, count=len(rows))
+    n = np.fromiter((r["n"] for r in rows), dtype=np.int64, count=len(rows))
+
+    valid = (offset >= 0) & (offset < days)
+    np.add.at(matrix.sums, (metric[valid], offset[valid]), total[valid])
+    np.add.at(matrix.counts, (metric[valid], offset[valid]), n[valid])
+    return matrix
+
+
+def _rank(values: np.ndarray) -> np.ndarray:
+    """Average ranks (ties share the mean rank), like scipy.stats.rankdata"""
+    order = np.argsort(values, kind="mergesort")
+    sorted_vals = values[order]
+    # Start index of each run of equal values
+    starts = np.concatenate(([True], sorted_vals[1:] != sorted_vals[:-1]))
+    run_id = np.cumsum(starts) - 1
+    run_start = np.flatnonzero(starts)
+    run_end = np.append(run_start[1:], len(values))
+    avg_rank = (run_start + run_end - 1) / 2.0 + 1.0
+    ranks = np.empty(len(values), dtype=np.float64)
+    ranks[order] = avg_rank[run_id]
+    return ranks
+
+
+def pearson(x: np.ndarray, y: np.ndarray) -> Tuple[Optional[float], int]:
+    """Pearson r over days where both series have data; returns (r, n)"""
+    mask = ~(np.isnan(x) | np.isnan(y))
+    n = int(mask.sum())
+    if n < 3:
+        return None, n
+    xs, ys = x[mask], y[mask]
+    xs = xs - xs.mean()
+    ys = ys - ys.mean()
+    denom = np.sqrt((xs * xs).sum() * (ys * ys).sum())
+    if denom == 0:
+        return None, n
+    return float((xs * ys).sum() / denom), n
+
+
+def spearman(x: np.ndarray, y: np.ndarray) -> Tuple[Optional[float], int]:
+    """Spearman rho (Pearson on average ranks) over paired days"""
+    mask = ~(np.isnan(x) | np.isnan(y))
+    if mask.sum() < 3:
+        return None, int(mask.sum())
+    return pearson(_rank(x[mask]), _rank(y[mask]))
+
+
+def _round(value: Optional[float], digits: int = 1) -> Optional[float]:
+    return None if value is None else round(value, digits)
+
+
+def _direction(new: Optional[float], old: Optional[float], up: str, down: str) -> str:
+    """>5% change threshold, as in the old stored function"""
+    if new is None or old is None:
+        return "stable"
+    if new > old * 1.05:
+        return up
+    if new < old * 0.95:
+        return down
+    return "stable"
+
+
+def _slope_per_day(series: np.ndarray) -> Optional[float]:
+    """Least-squares slope of a daily series, ignoring missing days"""
+    x = np.flatnonzero(~np.isnan(series)).astype(np.float64)
+    if len(x) < 2:
+        return None
+    y = series[~np.isnan(series)]
+    x -= x.mean()
+    return float((x * (y - y.mean())).sum() / (x * x).sum())
+
+
+def trend_summary(matrix: DailyMatrix) -> Dict[str, Any]:
+    """First-half vs second-half averages for HRV and heart rate"""
+    half = matrix.days // 2
+    split = matrix.days - half
+    means = matrix.means()
+
+    hrv_old = matrix.window_mean(HRV, 0, split)
+    hrv_new = matrix.window_mean(HRV, split, matrix.days)
+    hr_old = matrix.window_mean(HR, 0, split)
+    hr_new = matrix.window_mean(HR, split, matrix.days)
+    hrv_trend = _direction(hrv_new, hrv_old, "improving", "declining")
+    hr_trend = _direction(hr_new, hr_old, "increasing", "decreasing")
+
+    summary = (
+        f"HRV: {_round(hrv_new) if hrv_new is not None else 'N/A'}ms ({hrv_trend}), "
+        f"HR: {_round(hr_new) if hr_new is not None else 'N/A'}bpm ({hr_trend})"
+    )
+    return {
+        "type": "trend_summary",
+        "period_days": matrix.days,
+        "summary": summary,
+        "hrv_previous_ms": _round(hrv_old),
+        "hrv_recent_ms": _round(hrv_new),
+        "hrv_trend": hrv_trend,
+        "hrv_slope_ms_per_day": _round(_slope_per_day(means[HRV]), 3),
+        "hr_previous_bpm": _round(hr_old),
+        "hr_recent_bpm": _round(hr_new),
+        "hr_trend": hr_trend,
+        "hr_slope_bpm_per_day": _round(_slope_per_day(means[HR]), 3),
+    }
+
+
+def consistency_score(matrix: DailyMatrix) -> Dict[str, Any]:
+    """Share of days with any HRV, health sample (of any type) or workout data"""
+    has_data = (matrix.counts[[HRV, SAMPLES, WORKOUTS]] > 0).any(axis=0)
+    days_with_data = int(has_data.sum())
+    score = min(days_with_data / matrix.days * 100, 100.0) if matrix.days else 0.0
+    return {
+        "type": "consistency_score",
+        "period_days": matrix.days,
+        "days_with_data": days_with_data,
+        "score": round(score, 2),
+        "rating": "Excellent" if score >= 80 else "Good" if score >= 60 else "Fair" if score >= 40 else "Needs Improvement",
+    }
+
+
+def correlations(matrix: DailyMatrix, max_lag: int = 2) -> Dict[str, Any]:
+    """Workout/rest-day HRV comparison plus Pearson, Spearman and lagged correlations"""
+    means = matrix.means()
+    workout_days_mask = matrix.counts[WORKOUTS] > 0
+    # A day without workouts is a real zero, not missing data
+    workout_count = matrix.sums[WORKOUTS].copy()
+
+    hrv_n = matrix.counts[HRV].sum()
+    hrv_avg = matrix.sums[HRV].sum() / hrv_n if hrv_n else None
+    high_hrv_days = int((means[HRV] > hrv_avg).sum()) if hrv_avg is not None else 0
+
+    workout_hrv = matrix.counts[HRV][workout_days_mask].sum()
+    rest_hrv = matrix.counts[HRV][~workout_days_mask].sum()
+    avg_hrv_workout = float(matrix.sums[HRV][workout_days_mask].sum() / workout_hrv) if workout_hrv else None
+    avg_hrv_rest = float(matrix.sums[HRV][~workout_days_mask].sum() / rest_hrv) if rest_hrv else None
+
+    result: Dict[str, Any] = {
+        "type": "correlations",
+        "period_days": matrix.days,
+        "workout_days": int(workout_days_mask.sum()),
+        "high_hrv_days": high_hrv_days,
+        "avg_hrv_workout_days_ms": _round(avg_hrv_workout),
+        "avg_hrv_rest_days_ms": _round(avg_hrv_rest),
+    }
+
+    series = {
+        "hrv": means[HRV],
+        "hr": means[HR],
+        "workouts": workout_count,
+        "active_energy": means[ACTIVE_ENERGY],
+    }
+    pairs = (("hrv", "hr"), ("hrv", "active_energy"), ("hrv", "workouts"),
+             ("hr", "active_energy"), ("hr", "workouts"))
+    for a, b in pairs:
+        r, n = pearson(series[a], series[b])
+        rho, _ = spearman(series[a], series[b])
+        result[f"pearson_{a}_{b}"] = _round(r, 3)
+        result[f"spearman_{a}_{b}"] = _round(rho, 3)
+        result[f"paired_days_{a}_{b}"] = n
+
+    # Lagged effects: does training on day t move HRV / HR on day t+lag?
+    for lag in range(1, max_lag + 1):
+        if lag >= matrix.days:
+            break
+        for target in ("hrv", "hr"):
+            r, _ = pearson(series["workouts"][:-lag], series[target][lag:])
+            result[f"lag{lag}_workouts_{target}"] = _round(r, 3)
+
+    result["summary"] = (
+        f"Workout days: {result['workout_days']}/{matrix.days}, "
+        f"High HRV days: {high_hrv_days}, "
+        f"Avg HRV (workout): {result['avg_hrv_workout_days_ms'] if avg_hrv_workout is not None else 'N/A'}ms, "
+        f"Avg HRV (rest): {result['avg_hrv_rest_days_ms'] if avg_hrv_rest is not None else 'N/A'}ms"
+    )
+    return result
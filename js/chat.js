@@ -27,6 +27,7 @@ async function authFetch(url, options = {}) {
     
     if (response.status === 401) {
         localStorage.removeItem('healthMonitorAuth');
+        await clearSeriesStore();
         window.location.href = '/';
         return;
     }
@@ -202,6 +203,13 @@ async function sendMessage(message, useHealthData, insightType = 'raw_data') {
         // Remove loading indicator
         document.getElementById('loadingMessage')?.remove();
         
+        if (response.status === 429) {
+            // Server is at its AI request limit: report queue position and retry hint
+            const busy = data.detail || {};
+            throw new Error(`${busy.message || 'AI is busy'} (queue position ${busy.queue_position}, ` +
+                `retry in ~${busy.retry_after}s)`);
+        }
+        
         if (data.success) {
             // Add AI response
             messagesContainer.innerHTML += createMessageHTML({
@@ -432,8 +440,9 @@ document.addEventListener('DOMContentLoaded', () => {
     });
     
     // Logout
-    document.getElementById('logoutBtn').addEventListener('click', () => {
+    document.getElementById('logoutBtn').addEventListener('click', async () => {
         localStorage.removeItem('healthMonitorAuth');
+        await clearSeriesStore();
         window.location.href = '/';
     });
     
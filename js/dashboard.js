@@ -32,6 +32,7 @@ async function authFetch(url, options = {}) {
     
     if (response.status === 401) {
         localStorage.removeItem('healthMonitorAuth');
+        await clearSeriesStore();
         window.location.href = '/';
         return;
     }
@@ -43,6 +44,7 @@ async function authFetch(url, options = {}) {
 let hrvChart = null;
 let heartRateChart = null;
 let activityChart = null;
+let sleepChart = null;
 
 // Utility functions
 function formatDate(dateStr) {
@@ -90,18 +92,6 @@ function initializeDates() {
 }
 
 // API calls
-async function fetchData(endpoint, userId, startDate, endDate) {
-    const start = toISOString(startDate);
-    const end = toISOString(endDate);
-    const url = `${API_BASE_URL}/api/users/${userId}${endpoint}?start=${encodeURIComponent(start)}&end=${encodeURIComponent(end)}`;
-    
-    const response = await authFetch(url);
-    if (!response.ok) {
-        throw new Error(`API error: ${response.statusText}`);
-    }
-    return await response.json();
-}
-
 async function fetchOverview(userId, startDate, endDate) {
     const start = toISOString(startDate);
     const end = toISOString(endDate);
@@ -291,6 +281,68 @@ function createActivityChart(data) {
     });
 }
 
+function createSleepChart(data) {
+    const ctx = document.getElementById('sleepChart').getContext('2d');
+    
+    if (sleepChart) {
+        sleepChart.destroy();
+    }
+    
+    const stages = [
+        { key: 'deep_min', label: 'Deep', color: '#4f46e5' },
+        { key: 'core_min', label: 'Core', color: '#7c3aed' },
+        { key: 'rem_min', label: 'REM', color: '#06b6d4' },
+        { key: 'unspecified_min', label: 'Asleep (unstaged)', color: '#64748b' },
+        { key: 'awake_min', label: 'Awake', color: '#f59e0b' }
+    ];
+    
+    sleepChart = new Chart(ctx, {
+        type: 'bar',
+        data: {
+            labels: data.map(d => formatDate(d.night)),
+            datasets: stages.map(stage => ({
+                label: stage.label,
+                data: data.map(d => +(d[stage.key] / 60).toFixed(2)),
+                backgroundColor: stage.color,
+                borderWidth: 0
+            }))
+        },
+        options: {
+            responsive: true,
+            maintainAspectRatio: false,
+            plugins: {
+                legend: {
+                    labels: { color: '#f1f5f9' }
+                },
+                tooltip: {
+                    callbacks: {
+                        footer: items => {
+                            const night = data[items[0].dataIndex];
+                            return night.efficiency != null
+                                ? `Efficiency: ${Math.round(night.efficiency * 100)}%`
+                                : '';
+                        }
+                    }
+                }
+            },
+            scales: {
+                y: {
+                    stacked: true,
+                    beginAtZero: true,
+                    title: { display: true, text: 'Hours', color: '#94a3b8' },
+                    ticks: { color: '#94a3b8' },
+                    grid: { color: '#334155' }
+                },
+                x: {
+                    stacked: true,
+                    ticks: { color: '#94a3b8' },
+                    grid: { color: '#334155' }
+                }
+            }
+        }
+    });
+}
+
 function getWorkoutIcon(activityType) {
     const icons = {
         'HKWorkoutActivityTypeRunning': '🏃',
@@ -321,7 +373,7 @@ function renderWorkouts(workouts) {
     }
     
     container.innerHTML = workouts.map(workout => `
-        <div class="workout-card">
+        <div class="workout-card${workout.has_route ? ' has-route' : ''}">
             <div class="workout-icon">${getWorkoutIcon(workout.activity_type)}</div>
             <div class="workout-info">
                 <h4>${formatWorkoutType(workout.activity_type)}</h4>
@@ -349,8 +401,69 @@ function renderWorkouts(workouts) {
             <div class="workout-time">
                 ${formatDateTime(workout.start_date)}
             </div>
+            ${workout.has_route ? `<canvas class="workout-route" data-workout-id="${workout.workout_id}" width="160" height="100"></canvas>` : ''}
         </div>
     `).join('');
+    
+    container.querySelectorAll('canvas.workout-route').forEach(canvas => {
+        loadWorkoutRoute(canvas).catch(error => console.error('Error loading route:', error));
+    });
+}
+
+// Decode an encoded polyline (precision 5) into [lat, lon] pairs
+function decodePolyline(encoded) {
+    const points = [];
+    let index = 0, lat = 0, lon = 0;
+    while (index < encoded.length) {
+        for (let k = 0; k < 2; k++) {
+            let result = 0, shift = 0, b;
+            do {
+                b = encoded.charCodeAt(index++) - 63;
+                result |= (b & 0x1f) << shift;
+                shift += 5;
+            } while (b >= 0x20);
+            const delta = (result & 1) ? ~(result >> 1) : (result >> 1);
+            if (k === 0) lat += delta; else lon += delta;
+        }
+        points.push([lat / 1e5, lon / 1e5]);
+    }
+    return points;
+}
+
+async function loadWorkoutRoute(canvas) {
+    // Ask for about one point per pixel of width; the server picks the matching simplification
+    const url = `${API_BASE_URL}/api/users/${currentUserId}/workouts/${canvas.dataset.workoutId}/route?max_points=${canvas.width * 2}`;
+    const response = await authFetch(url);
+    if (!response.ok) {
+        throw new Error(`API error: ${response.statusText}`);
+    }
+    const route = await response.json();
+    drawRoute(canvas, decodePolyline(route.polyline), route.bbox);
+}
+
+function drawRoute(canvas, points, bbox) {
+    const ctx = canvas.getContext('2d');
+    const [minLat, minLon, maxLat, maxLon] = bbox;
+    const pad = 6;
+    // Equirectangular projection scaled to fit, keeping the aspect ratio
+    const kx = Math.cos((minLat + maxLat) / 2 * Math.PI / 180);
+    const w = Math.max((maxLon - minLon) * kx, 1e-9);
+    const h = Math.max(maxLat - minLat, 1e-9);
+    const scale = Math.min((canvas.width - 2 * pad) / w, (canvas.height - 2 * pad) / h);
+    const ox = (canvas.width - w * scale) / 2;
+    const oy = (canvas.height - h * scale) / 2;
+    
+    ctx.clearRect(0, 0, canvas.width, canvas.height);
+    ctx.strokeStyle = '#7c3aed';
+    ctx.lineWidth = 2;
+    ctx.lineJoin = 'round';
+    ctx.beginPath();
+    points.forEach(([lat, lon], i) => {
+        const x = ox + (lon - minLon) * kx * scale;
+        const y = canvas.height - (oy + (lat - minLat) * scale);
+        if (i === 0) ctx.moveTo(x, y); else ctx.lineTo(x, y);
+    });
+    ctx.stroke();
 }
 
 function renderDailySnapshots(snapshots) {
@@ -394,6 +507,55 @@ function renderDailySnapshots(snapshots) {
 }
 
 // Load all data
+function dayString(date) {
+    return date.toISOString().slice(0, 10);
+}
+
+async function fetchSync(userId, want, meta) {
+    const params = new URLSearchParams({ start: want.start, end: want.end });
+    if (meta) {
+        params.set('version', meta.version);
+        params.set('have_start', meta.haveStart);
+        params.set('have_end', meta.haveEnd);
+    }
+    const response = await authFetch(`${API_BASE_URL}/api/users/${userId}/sync?${params}`);
+    if (!response.ok) {
+        throw new Error(`API error: ${response.statusText}`);
+    }
+    return await response.json();
+}
+
+let seriesStore = null;
+
+async function openSeriesStore(userId) {
+    if (!seriesStore || seriesStore.userId !== userId) {
+        const store = new SeriesStore(userId);
+        seriesStore = (await store.open()) ? store : false;
+    }
+    return seriesStore || null;
+}
+
+function renderSeries(data) {
+    if (data.hrv.length > 0) {
+        createHRVChart(data.hrv);
+    }
+    
+    if (data.heart_rate.length > 0) {
+        createHeartRateChart(data.heart_rate);
+    }
+    
+    if (data.activity.length > 0) {
+        createActivityChart(data.activity);
+    }
+    
+    if (data.sleep.length > 0) {
+        createSleepChart(data.sleep);
+    }
+    
+    renderWorkouts(data.workouts);
+    renderDailySnapshots(data.snapshots);
+}
+
 async function loadAllData() {
     const userId = currentUserId;
     const startDate = document.getElementById('startDate').valueAsDate;
@@ -412,33 +574,43 @@ async function loadAllData() {
     showLoading(true);
     
     try {
-        // Fetch all data in parallel
-        const [overview, hrvData, hrData, activityData, workoutsData, snapshotsData] = await Promise.all([
-            fetchOverview(userId, startDate, endDate),
-            fetchData('/hrv/daily', userId, startDate, endDate),
-            fetchData('/heart-rate/daily', userId, startDate, endDate),
-            fetchData('/activity/summary', userId, startDate, endDate),
-            fetchData('/workouts', userId, startDate, endDate),
-            fetchData('/daily-snapshot', userId, startDate, endDate)
-        ]);
-        
-        // Update UI
-        updateOverviewStats(overview);
-        
-        if (hrvData && hrvData.length > 0) {
-            createHRVChart(hrvData);
+        // Days [start, end); the cache holds one contiguous range that is current as of meta.version
+        const want = { start: dayString(startDate), end: dayString(endDate) };
+        const store = await openSeriesStore(userId);
+        let meta = store ? await store.meta() : null;
+        if (meta && (meta.haveEnd < want.start || want.end < meta.haveStart)) {
+            // A disjoint range would leave a gap in the cache; start over from this one
+            meta = null;
         }
         
-        if (hrData && hrData.length > 0) {
-            createHeartRateChart(hrData);
+        // Render what the cache already has, then ask only for missing or changed days
+        let rendered = false;
+        if (meta && meta.haveStart <= want.start && want.end <= meta.haveEnd) {
+            renderSeries(await store.read(want.start, want.end));
+            rendered = true;
+            showLoading(false);
         }
         
-        if (activityData && activityData.length > 0) {
-            createActivityChart(activityData);
+        const sync = await fetchSync(userId, want, meta);
+        let data = sync.series;
+        if (store) {
+            await store.apply(sync, want, meta);
+            if (!rendered || sync.ranges.length > 0) {
+                data = await store.read(want.start, want.end);
+            }
+        }
+        if (!rendered || sync.ranges.length > 0) {
+            renderSeries(data);
         }
         
-        renderWorkouts(workoutsData);
-        renderDailySnapshots(snapshotsData);
+        let overview = store ? await store.getOverview(sync.version, want) : null;
+        if (!overview) {
+            overview = await fetchOverview(userId, startDate, endDate);
+            if (store) {
+                await store.putOverview(sync.version, want, overview);
+            }
+        }
+        updateOverviewStats(overview);
         
     } catch (error) {
         console.error('Error loading data:', error);
@@ -0,0 +1,138 @@
+// IndexedDB cache of the dashboard's daily series, kept current through /api/users/{id}/sync
+const SERIES_STORE_DB = 'healthMonitorSeries';
+const SYNC_SERIES = ['hrv', 'heart_rate', 'activity', 'sleep', 'workouts', 'snapshots'];
+// Field holding each row's day (workouts use the date part of start_date)
+const SERIES_DAY_FIELD = {
+    hrv: 'day',
+    heart_rate: 'day',
+    activity: 'date',
+    sleep: 'night',
+    workouts: 'start_date',
+    snapshots: 'day'
+};
+
+// Drop the whole cache on sign-out or rejected credentials, so health data does not outlive the session.
+// Resolves once deleted (or if it cannot be); open connections close themselves via onversionchange.
+function clearSeriesStore() {
+    if (!window.indexedDB) {
+        return Promise.resolve();
+    }
+    return new Promise(resolve => {
+        const request = indexedDB.deleteDatabase(SERIES_STORE_DB);
+        request.onsuccess = () => resolve();
+        request.onerror = () => resolve();
+        request.onblocked = () => resolve();
+    });
+}
+
+function requestPromise(request) {
+    return new Promise((resolve, reject) => {
+        request.onsuccess = () => resolve(request.result);
+        request.onerror = () => reject(request.error);
+    });
+}
+
+function transactionDone(tx) {
+    return new Promise((resolve, reject) => {
+        tx.oncomplete = () => resolve();
+        tx.onerror = () => reject(tx.error);
+        tx.onabort = () => reject(tx.error);
+    });
+}
+
+class SeriesStore {
+    constructor(userId) {
+        this.userId = userId;
+        this.db = null;
+    }
+
+    // Returns false when IndexedDB is unavailable (private windows, old browsers)
+    async open() {
+        if (!window.indexedDB) {
+            return false;
+        }
+        const request = indexedDB.open(SERIES_STORE_DB, 1);
+        request.onupgradeneeded = () => {
+            const db = request.result;
+            // { key: [userId, series, day], rows: [...] }
+            db.createObjectStore('days', { keyPath: 'key' });
+            // { userId, version, haveStart, haveEnd }: days in [haveStart, haveEnd) are current as of version
+            db.createObjectStore('meta', { keyPath: 'userId' });
+            // { key: [userId, version, start, end], overview }
+            db.createObjectStore('overview', { keyPath: 'key' });
+        };
+        try {
+            this.db = await requestPromise(request);
+            // Let clearSeriesStore() (possibly from another tab) delete the database
+            this.db.onversionchange = () => this.db.close();
+            return true;
+        } catch (error) {
+            console.warn('Series cache unavailable:', error);
+            return false;
+        }
+    }
+
+    async meta() {
+        const tx = this.db.transaction('meta', 'readonly');
+        return (await requestPromise(tx.objectStore('meta').get(this.userId))) || null;
+    }
+
+    // Rows of every series for days in [start, end)
+    async read(start, end) {
+        const tx = this.db.transaction('days', 'readonly');
+        const store = tx.objectStore('days');
+        const data = {};
+        await Promise.all(SYNC_SERIES.map(async name => {
+            const range = IDBKeyRange.bound([this.userId, name, start], [this.userId, name, end], false, true);
+            const records = await requestPromise(store.getAll(range));
+            data[name] = records.flatMap(record => record.rows);
+        }));
+        return data;
+    }
+
+    // Replace the synced ranges with the response's rows and record the new version
+    async apply(sync, want, meta) {
+        const tx = this.db.transaction(['days', 'meta'], 'readwrite');
+        const days = tx.objectStore('days');
+        if (sync.reset || !meta) {
+            days.delete(IDBKeyRange.bound([this.userId, ''], [this.userId, '\uffff']));
+        }
+        for (const [lo, hi] of sync.ranges) {
+            for (const name of SYNC_SERIES) {
+                days.delete(IDBKeyRange.bound([this.userId, name, lo], [this.userId, name, hi], false, true));
+                const byDay = new Map();
+                for (const row of sync.series[name]) {
+                    const day = String(row[SERIES_DAY_FIELD[name]]).slice(0, 10);
+                    if (day >= lo && day < hi) {
+                        if (!byDay.has(day)) byDay.set(day, []);
+                        byDay.get(day).push(row);
+                    }
+                }
+                byDay.forEach((rows, day) => days.put({ key: [this.userId, name, day], rows }));
+            }
+        }
+        const kept = meta && !sync.reset;
+        tx.objectStore('meta').put({
+            userId: this.userId,
+            version: sync.version,
+            haveStart: kept && meta.haveStart < want.start ? meta.haveStart : want.start,
+            haveEnd: kept && meta.haveEnd > want.end ? meta.haveEnd : want.end
+        });
+        await transactionDone(tx);
+    }
+
+    async getOverview(version, want) {
+        const tx = this.db.transaction('overview', 'readonly');
+        const record = await requestPromise(tx.objectStore('overview').get([this.userId, version, want.start, want.end]));
+        return record ? record.overview : null;
+    }
+
+    async putOverview(version, want, overview) {
+        const tx = this.db.transaction('overview', 'readwrite');
+        const store = tx.objectStore('overview');
+        // Overviews of older versions can never be used again
+        store.delete(IDBKeyRange.bound([this.userId, 0], [this.userId, version], false, true));
+        store.put({ key: [this.userId, version, want.start, want.end], overview });
+        await transactionDone(tx);
+    }
+}
@@ -45,8 +45,9 @@ async function loadUserInfo() {
 }
 
 // Logout
-document.getElementById('logoutBtn').addEventListener('click', () => {
+document.getElementById('logoutBtn').addEventListener('click', async () => {
     localStorage.removeItem('healthMonitorAuth');
+    await clearSeriesStore();
     window.location.href = '/';
 });
 
@@ -91,6 +92,140 @@ fileDropArea.addEventListener('drop', (e) => {
     }
 });
 
+// Chunked, resumable upload
+const PARALLEL_CHUNKS = 4;
+const CHUNK_RETRIES = 5;
+const RESUME_KEY = 'healthMonitorUploads';
+
+function authHeader() {
+    return 'Basic ' + btoa(authCredentials.username + ':' + authCredentials.password);
+}
+
+function fileKey(file) {
+    return `${authCredentials.username}:${file.name}:${file.size}:${file.lastModified}`;
+}
+
+function savedUploads() {
+    return JSON.parse(localStorage.getItem(RESUME_KEY) || '{}');
+}
+
+function rememberUpload(file, uploadId) {
+    const saved = savedUploads();
+    if (uploadId) {
+        saved[fileKey(file)] = uploadId;
+    } else {
+        delete saved[fileKey(file)];
+    }
+    localStorage.setItem(RESUME_KEY, JSON.stringify(saved));
+}
+
+async function apiJson(path, options = {}) {
+    const response = await fetch(`${API_BASE_URL}${path}`, {
+        ...options,
+        headers: { 'Authorization': authHeader(), ...(options.headers || {}) }
+    });
+    if (response.status === 401) {
+        localStorage.removeItem('healthMonitorAuth');
+        await clearSeriesStore();
+        window.location.href = '/';
+    }
+    const data = await response.json().catch(() => ({}));
+    if (!response.ok) {
+        const error = new Error(data.detail || `Request failed (${response.status})`);
+        error.status = response.status;
+        throw error;
+    }
+    return data;
+}
+
+// Resume the session saved for this file, or start a new one
+async function openSession(file) {
+    const uploadId = savedUploads()[fileKey(file)];
+    if (uploadId) {
+        try {
+            return await apiJson(`/api/uploads/${uploadId}`);
+        } catch (error) {
+            if (error.status !== 404) throw error;
+        }
+    }
+    const session = await apiJson('/api/uploads', {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({ filename: file.name, size: file.size })
+    });
+    rememberUpload(file, session.upload_id);
+    return session;
+}
+
+async function sha256Hex(buffer) {
+    const digest = await crypto.subtle.digest('SHA-256', buffer);
+    return Array.from(new Uint8Array(digest), b => b.toString(16).padStart(2, '0')).join('');
+}
+
+async function sendChunk(file, session, offset) {
+    const buffer = await file.slice(offset, offset + session.chunk_size).arrayBuffer();
+    const checksum = await sha256Hex(buffer);
+    for (let attempt = 0; ; attempt++) {
+        try {
+            return await apiJson(`/api/uploads/${session.upload_id}/chunks?offset=${offset}`, {
+                method: 'PUT',
+                headers: { 'Content-Type': 'application/octet-stream', 'X-Chunk-SHA256': checksum },
+                body: buffer
+            });
+        } catch (error) {
+            // Client errors other than a corrupted chunk will not fix themselves
+            const retryable = !error.status || error.status >= 500 || error.status === 422;
+            if (!retryable || attempt + 1 >= CHUNK_RETRIES) throw error;
+            await new Promise(resolve => setTimeout(resolve, 1000 * 2 ** attempt));
+        }
+    }
+}
+
+function missingOffsets(session) {
+    const offsets = [];
+    let next = 0;
+    for (const [start, end] of [...session.received, [session.size, session.size]]) {
+        for (let offset = next; offset < start; offset += session.chunk_size) {
+            offsets.push(offset);
+        }
+        next = end;
+    }
+    return offsets;
+}
+
+function showUploadProgress(sent, total) {
+    const percent = total ? Math.floor(100 * sent / total) : 100;
+    const fill = document.getElementById('progressFill');
+    fill.style.animation = 'none';
+    fill.style.width = `${percent}%`;
+    showProgress(true, `Uploading... ${percent}% (${(sent / 1048576).toFixed(0)} of ${(total / 1048576).toFixed(0)} MB)`);
+}
+
+async function uploadFile(file) {
+    const session = await openSession(file);
+    const pending = missingOffsets(session);
+    let sent = session.received_bytes;
+    showUploadProgress(sent, session.size);
+
+    async function worker() {
+        while (pending.length) {
+            const offset = pending.shift();
+            const stored = await sendChunk(file, session, offset);
+            sent += stored.length;
+            showUploadProgress(sent, session.size);
+        }
+    }
+    await Promise.all(Array.from({ length: PARALLEL_CHUNKS }, worker));
+
+    showProgress(true, 'Processing...');
+    const fill = document.getElementById('progressFill');
+    fill.style.animation = '';
+    fill.style.width = '';
+    const result = await apiJson(`/api/uploads/${session.upload_id}/complete`, { method: 'POST' });
+    rememberUpload(file, null);
+    return result;
+}
+
 // Upload form submission
 document.getElementById('uploadForm').addEventListener('submit', async (e) => {
     e.preventDefault();
@@ -106,26 +241,11 @@ document.getElementById('uploadForm').addEventListener('submit', async (e) => {
         return;
     }
     
-    const formData = new FormData();
-    formData.append('file', file);
-    
     try {
         uploadBtn.disabled = true;
-        showProgress(true, 'Uploading and processing...');
-        
-        const response = await fetch(`${API_BASE_URL}/api/upload`, {
-            method: 'POST',
-            headers: {
-                'Authorization': 'Basic ' + btoa(authCredentials.username + ':' + authCredentials.password)
-            },
-            body: formData
-        });
+        showProgress(true, 'Uploading...');
         
-        const data = await response.json();
-        
-        if (!response.ok) {
-            throw new Error(data.detail || 'Upload failed');
-        }
+        await uploadFile(file);
         
         showProgress(false);
         showSuccess('Health data imported successfully! Redirecting to dashboard...');
@@ -142,7 +262,8 @@ document.getElementById('uploadForm').addEventListener('submit', async (e) => {
         
     } catch (error) {
         showProgress(false);
-        showError(error.message);
+        // The session is kept, so submitting the same file again resumes it
+        showError(`${error.message} - submit again to resume the upload`);
         uploadBtn.disabled = false;
     }
 });
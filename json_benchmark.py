@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+"""
+CPU cost per request of the response_model path vs FastJSONResponse on large range queries.
+
+Builds synthetic rows shaped like mysql-connector output (Decimal, datetime, date)
+for the workouts and heart-rate endpoints and serves them from a throwaway app
+both ways, with and without compression. No database is needed.
+
+Example:
+    python3 json_benchmark.py --rows 2000 --requests 200
+"""
+import argparse
+import json
+import random
+import sys
+import time
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+from typing import List, Dict, Any, Callable
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from compression import CompressionMiddleware
+from fast_json import FastJSONResponse, orjson
+from main import WorkoutOut, HRDaily
+
+
+def workout_rows(n: int, rng: random.Random) -> List[Dict[str, Any]]:
+    start = datetime(2024, 1, 1, 7)
+    rows = []
+    for i in range(n):
+        s = start + timedelta(hours=13 * i)
+        rows.append({
+            "workout_id": i + 1,
+            "activity_type": "HKWorkoutActivityTypeRunning",
+            "duration": Decimal(f"{rng.uniform(20, 90):.2f}"),
+            "duration_unit": "min",
+            "total_distance": Decimal(f"{rng.uniform(2, 15):.2f}"),
+            "total_distance_unit": "km",
+            "total_energy_burned": Decimal(f"{rng.uniform(150, 900):.2f}"),
+            "total_energy_burned_unit": "kcal",
+            "start_date": s,
+            "end_date": s + timedelta(minutes=45),
+            "source_name": "Apple Watch",
+        })
+    return rows
+
+
+def heart_rate_rows(n: int, rng: random.Random) -> List[Dict[str, Any]]:
+    day = date(2012, 1, 1)
+    rows = []
+    for i in range(n):
+        avg = rng.uniform(55, 80)
+        rows.append({
+            "day": day + timedelta(days=i),
+            "avg_bpm": Decimal(f"{avg:.4f}"),
+            "min_bpm": Decimal(f"{avg - 15:.4f}"),
+            "max_bpm": Decimal(f"{avg + 60:.4f}"),
+            "unit": "count/min",
+        })
+    return rows
+
+
+def _endpoints(rows: List[Dict[str, Any]]):
+    # Closures rather than default arguments, which FastAPI would treat as query parameters
+    def validated():
+        return rows
+
+    def fast():
+        return FastJSONResponse(rows)
+
+    return validated, fast
+
+
+def build_app(datasets: Dict[str, tuple]) -> FastAPI:
+    app = FastAPI()
+    app.add_middleware(CompressionMiddleware)
+    for name, (model, rows) in datasets.items():
+        validated, fast = _endpoints(rows)
+        app.add_api_route(f"/validated/{name}", validated, response_model=List[model])
+        app.add_api_route(f"/fast/{name}", fast)
+    return app
+
+
+def measure(call: Callable[[], Any], requests: int) -> Dict[str, float]:
+    for _ in range(min(10, requests)):
+        call()
+    cpu0, wall0 = time.process_time(), time.perf_counter()
+    for _ in range(requests):
+        call()
+    return {
+        "cpu_ms": (time.process_time() - cpu0) * 1000 / requests,
+        "wall_ms": (time.perf_counter() - wall0) * 1000 / requests,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="response_model vs FastJSONResponse CPU per request")
+    parser.add_argument("--rows", type=int, default=2000, help="Rows per response")
+    parser.add_argument("--requests", type=int, default=200, help="Requests per variant")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    datasets = {
+        "workouts": (WorkoutOut, workout_rows(args.rows, rng)),
+        "heart_rate": (HRDaily, heart_rate_rows(args.rows, rng)),
+    }
+    client = TestClient(build_app(datasets))
+    print(f"encoder: {'orjson' if orjson else 'stdlib json'}  rows/response: {args.rows}  "
+          f"requests/variant: {args.requests}")
+
+    for name in datasets:
+        identity = {"Accept-Encoding": "identity"}
+        slow = client.get(f"/validated/{name}", headers=identity)
+        fast = client.get(f"/fast/{name}", headers=identity)
+        if json.loads(slow.content) != json.loads(fast.content):
+            print(f"{name}: fast path output differs from response_model output")
+            return 1
+
+        print(f"\n{name}")
+        for encoding in ("identity", "gzip, br"):
+            headers = {"Accept-Encoding": encoding}
+            base = measure(lambda: client.get(f"/validated/{name}", headers=headers), args.requests)
+            new = measure(lambda: client.get(f"/fast/{name}", headers=headers), args.requests)
+            size = len(client.get(f"/fast/{name}", headers=headers).read())
+            wire = client.get(f"/fast/{name}", headers=headers).headers.get("content-length")
+            saved = 100 * (1 - new["cpu_ms"] / base["cpu_ms"]) if base["cpu_ms"] else 0.0
+            print(f"  {encoding:<9} response_model cpu={base['cpu_ms']:7.2f}ms  fast cpu={new['cpu_ms']:7.2f}ms  "
+                  f"saved={saved:5.1f}%  body={size}B  wire={wire}B")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
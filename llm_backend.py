@@ -0,0 +1,97 @@
+# LLM backends used by ChatService
+import hashlib
+import os
+import random
+import time
+from typing import Iterator, Optional
+
+
+class LLMBackend:
+    """Interface for text generation backends"""
+
+    name = "base"
+
+    def generate(self, prompt: str) -> str:
+        """Return the full response text for a prompt"""
+        raise NotImplementedError
+
+    def stream(self, prompt: str) -> Iterator[str]:
+        """Yield the response in chunks (default: a single chunk)"""
+        yield self.generate(prompt)
+
+
+class GeminiBackend(LLMBackend):
+    """Google Gemini via google-generativeai"""
+
+    name = "gemini"
+
+    def __init__(self, api_key: str, model_name: str = "gemini-2.5-pro"):
+        import google.generativeai as genai
+
+        genai.configure(api_key=api_key)
+        self.model_name = model_name
+        self.model = genai.GenerativeModel(model_name)
+
+    def generate(self, prompt: str) -> str:
+        response = self.model.generate_content(prompt)
+        return response.text
+
+    def stream(self, prompt: str) -> Iterator[str]:
+        for chunk in self.model.generate_content(prompt, stream=True):
+            if chunk.text:
+                yield chunk.text
+
+
+class StubBackend(LLMBackend):
+    """Deterministic local backend for tests and load testing
+
+    The response depends only on the prompt, and latency is simulated with
+    sleep so that concurrency behaves like a remote call (the GIL is released).
+    """
+
+    name = "stub"
+
+    def __init__(self, latency_ms: float = 0.0, jitter_ms: float = 0.0,
+                 chunks: int = 4, seed: int = 0):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.chunks = max(1, chunks)
+        self._rng = random.Random(seed)
+
+    def _delay(self) -> float:
+        jitter = self._rng.uniform(-self.jitter_ms, self.jitter_ms) if self.jitter_ms else 0.0
+        return max(0.0, self.latency_ms + jitter) / 1000.0
+
+    def _response(self, prompt: str) -> str:
+        digest = hashlib.sha256(prompt.encode()).hexdigest()[:12]
+        return (
+            f"[stub:{digest}] Based on your recent data, keep a consistent routine, "
+            f"prioritise sleep, and watch your HRV trend. ({len(prompt)} prompt chars)"
+        )
+
+    def generate(self, prompt: str) -> str:
+        time.sleep(self._delay())
+        return self._response(prompt)
+
+    def stream(self, prompt: str) -> Iterator[str]:
+        text = self._response(prompt)
+        delay = self._delay() / self.chunks
+        size = -(-len(text) // self.chunks)
+        for i in range(0, len(text), size):
+            time.sleep(delay)
+            yield text[i:i + size]
+
+
+def create_backend(api_key: Optional[str] = None, name: Optional[str] = None) -> LLMBackend:
+    """Build the backend selected by LLM_BACKEND (gemini | stub)"""
+    name = (name or os.getenv("LLM_BACKEND", "gemini")).lower()
+    if name == "stub":
+        return StubBackend(
+            latency_ms=float(os.getenv("STUB_LLM_LATENCY_MS", "0")),
+            jitter_ms=float(os.getenv("STUB_LLM_JITTER_MS", "0")),
+        )
+    if name == "gemini":
+        if not api_key:
+            raise ValueError("GEMINI_API_KEY is required for the gemini backend")
+        return GeminiBackend(api_key, os.getenv("GEMINI_MODEL", "gemini-2.5-pro"))
+    raise ValueError(f"Unknown LLM backend: {name}")
@@ -0,0 +1,190 @@
+# Scheduler in front of LLM calls: global concurrency limit, per-user fair queues, coalescing
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, Hashable, Optional
+
+
+class SchedulerBusy(Exception):
+    """Raised when a request cannot be queued (or waited too long in the queue)"""
+
+    def __init__(self, message: str, queue_position: int, retry_after: int):
+        super().__init__(message)
+        self.queue_position = queue_position
+        self.retry_after = retry_after
+
+
+class _Ticket:
+    __slots__ = ("user_id", "event", "granted")
+
+    def __init__(self, user_id: int):
+        self.user_id = user_id
+        self.event = threading.Event()
+        self.granted = False
+
+
+class LLMScheduler:
+    """Blocking scheduler for LLM calls made from worker threads
+
+    - at most `max_concurrency` calls run at once
+    - waiting requests are kept in per-user FIFO queues and slots are handed
+      out round-robin across users, so one chatty user cannot starve others
+    - queues are bounded; overflow raises SchedulerBusy with a queue position
+    - calls sharing a coalesce key while one is in flight share its result
+    """
+
+    def __init__(self, max_concurrency: int = 4, max_queue_per_user: int = 2,
+                 max_queue_total: int = 32, queue_timeout: float = 30.0):
+        self.max_concurrency = max_concurrency
+        self.max_queue_per_user = max_queue_per_user
+        self.max_queue_total = max_queue_total
+        self.queue_timeout = queue_timeout
+
+        self._lock = threading.Lock()
+        self._active = 0
+        self._queues: "OrderedDict[int, deque]" = OrderedDict()
+        self._queued = 0
+        self._inflight: Dict[Hashable, Future] = {}
+
+        # Counters for stats()
+        self._completed = 0
+        self._rejected = 0
+        self._timed_out = 0
+        self._coalesced = 0
+        self._avg_call_s = 5.0
+
+    @classmethod
+    def from_env(cls) -> "LLMScheduler":
+        return cls(
+            max_concurrency=int(os.getenv("LLM_MAX_CONCURRENCY", "4")),
+            max_queue_per_user=int(os.getenv("LLM_MAX_QUEUE_PER_USER", "2")),
+            max_queue_total=int(os.getenv("LLM_MAX_QUEUE", "32")),
+            queue_timeout=float(os.getenv("LLM_QUEUE_TIMEOUT_S", "30")),
+        )
+
+    def _position(self, user_id: int, index: int) -> int:
+        """Approximate 1-based position of the index-th queued ticket of a user under round-robin"""
+        ahead = sum(min(len(q), index + 1) for uid, q in self._queues.items() if uid != user_id)
+        return ahead + index + 1
+
+    def _retry_after(self, position: int) -> int:
+        waves = position / max(1, self.max_concurrency)
+        return max(1, int(round(waves * self._avg_call_s)))
+
+    def queue_position(self, user_id: int) -> int:
+        """Position of the user's next queued request, 0 if the user has none queued"""
+        with self._lock:
+            if user_id not in self._queues:
+                return 0
+            return self._position(user_id, 0)
+
+    def _acquire(self, user_id: int) -> float:
+        """Block until a slot is granted; returns seconds spent waiting"""
+        with self._lock:
+            if self._active < self.max_concurrency and not self._queued:
+                self._active += 1
+                return 0.0
+
+            queue = self._queues.get(user_id)
+            depth = len(queue) if queue else 0
+            if depth >= self.max_queue_per_user or self._queued >= self.max_queue_total:
+                self._rejected += 1
+                position = self._position(user_id, depth)
+                raise SchedulerBusy("Too many AI requests in progress, please retry shortly",
+                                    position, self._retry_after(position))
+
+            ticket = _Ticket(user_id)
+            if queue is None:
+                queue = self._queues[user_id] = deque()
+            queue.append(ticket)
+            self._queued += 1
+
+        start = time.perf_counter()
+        ticket.event.wait(self.queue_timeout)
+        with self._lock:
+            if not ticket.granted:
+                # Timed out while still queued: withdraw the ticket
+                queue = self._queues.get(user_id)
+                if queue is not None:
+                    queue.remove(ticket)
+                    if not queue:
+                        del self._queues[user_id]
+                self._queued -= 1
+                self._timed_out += 1
+                raise SchedulerBusy("Timed out waiting for an AI slot, please retry",
+                                    self._queued + 1, self._retry_after(self._queued + 1))
+        return time.perf_counter() - start
+
+    def _release(self, call_s: float):
+        with self._lock:
+            self._completed += 1
+            self._avg_call_s = 0.9 * self._avg_call_s + 0.1 * call_s
+            if not self._queues:
+                self._active -= 1
+                return
+            # Round-robin: serve the user at the head, then move them to the back
+            user_id, queue = next(iter(self._queues.items()))
+            ticket = queue.popleft()
+            if queue:
+                self._queues.move_to_end(user_id)
+            else:
+                del self._queues[user_id]
+            self._queued -= 1
+            # The slot passes directly to the ticket; _active is unchanged
+            ticket.granted = True
+            ticket.event.set()
+
+    def submit(self, user_id: int, fn: Callable[[], Any],
+               coalesce_key: Optional[Hashable] = None) -> Dict[str, Any]:
+        """Run fn() under the scheduler and return {"result", "queue_wait_ms", "coalesced"}"""
+        if coalesce_key is not None:
+            with self._lock:
+                shared = self._inflight.get(coalesce_key)
+                if shared is None:
+                    owner = self._inflight[coalesce_key] = Future()
+                else:
+                    self._coalesced += 1
+            if shared is not None:
+                start = time.perf_counter()
+                result = shared.result()
+                return {"result": result, "queue_wait_ms": (time.perf_counter() - start) * 1000,
+                        "coalesced": True}
+        else:
+            owner = None
+
+        try:
+            waited = self._acquire(user_id)
+            start = time.perf_counter()
+            try:
+                result = fn()
+            finally:
+                self._release(time.perf_counter() - start)
+        except BaseException as e:
+            if owner is not None:
+                owner.set_exception(e)
+            raise
+        finally:
+            if owner is not None:
+                with self._lock:
+                    self._inflight.pop(coalesce_key, None)
+
+        if owner is not None:
+            owner.set_result(result)
+        return {"result": result, "queue_wait_ms": waited * 1000, "coalesced": False}
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "max_concurrency": self.max_concurrency,
+                "active": self._active,
+                "queued": self._queued,
+                "queued_users": len(self._queues),
+                "inflight_coalescable": len(self._inflight),
+                "completed": self._completed,
+                "rejected": self._rejected,
+                "timed_out": self._timed_out,
+                "coalesced": self._coalesced,
+                "avg_call_ms": round(self._avg_call_s * 1000, 1),
+            }
@@ -4,35 +4,66 @@ import shutil
 import zipfile
 import subprocess
 import json
+import re
+import threading
+import time
+_IMPORT_STARTED = time.perf_counter()
+from collections import Counter
+from contextlib import asynccontextmanager
 from pathlib import Path
 from datetime import datetime, timezone, timedelta
 from typing import Optional, List, Any, Dict
 from datetime import datetime, date
-from fastapi import FastAPI, HTTPException, Query, UploadFile, File, Form, Depends, status
+from fastapi import FastAPI, HTTPException, Query, UploadFile, File, Form, Header, Depends, Request, status
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse, StreamingResponse
+from fastapi.responses import StreamingResponse, PlainTextResponse
 from fastapi.security import HTTPBasic, HTTPBasicCredentials
+from fastapi.concurrency import run_in_threadpool
 from pydantic import BaseModel
 import uvicorn
 import hashlib
+import hmac
+import uuid
 from dotenv import load_dotenv
 
 # Load environment variables
 load_dotenv()
 
 # Import database and chat service
-from database import pool, fetch_all, fetch_one, get_connection
+from database import (fetch_all, fetch_one, fetch_scalar, execute, cursor, query_stats, request_context,
+                      bind_user, pin_user, pool_stats, warm_pools, close_pools, IMPORT_PIN_S)
 from chat_service import ChatService
+from user_deletion import deletion_jobs
+from chunked_upload import UploadSessions, UploadError
+import partitions
+import sleep
+import cohorts
+import delta_sync
+import profiling
+from series_cache import series_cache
+from fast_json import FastJSONResponse, dumps
+from compression import CompressionMiddleware
+from static_assets import static_assets
+from llm_scheduler import SchedulerBusy
+from metrics import (REGISTRY, MetricsMiddleware, IMPORT_JOBS_RUNNING, IMPORT_RECORDS,
+                     IMPORT_RECORDS_PER_SECOND, APP_STARTUP_SECONDS)
 
-# Initialize chat service
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
-if not GEMINI_API_KEY:
-    print("Warning: GEMINI_API_KEY not found in environment variables")
-    chat_service = None
-else:
-    chat_service = ChatService(GEMINI_API_KEY)
+# Token for the metrics endpoints (X-Admin-Token or Authorization: Bearer); unset hides them
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")
+# Created per worker process in lifespan(), after any fork
+chat_service: Optional[ChatService] = None
+
+def create_chat_service() -> Optional[ChatService]:
+    """Build the chat service (LLM_BACKEND=stub runs without a Gemini key)"""
+    if not GEMINI_API_KEY and os.getenv("LLM_BACKEND", "gemini").lower() != "stub":
+        print("Warning: GEMINI_API_KEY not found in environment variables")
+        return None
+    return ChatService(GEMINI_API_KEY)
 
 # Helpers
+MOTION_CONTEXT_KEY = "HKMetadataKeyHeartRateMotionContext"
+
 def as_sql_ts(dt: datetime) -> str:
     """
     Normalize incoming datetimes to UTC and return 'YYYY-MM-DD HH:MM:SS' for DATETIME columns.
@@ -74,12 +105,63 @@ class WorkoutOut(BaseModel):
     start_date: datetime
     end_date: datetime
     source_name: Optional[str]
+    has_route: bool
+
+class WorkoutRouteOut(BaseModel):
+    workout_id: int
+    level: int
+    tolerance_m: float
+    point_count: int
+    total_points: int
+    distance_m: float
+    bbox: List[float]
+    start_time: Optional[datetime]
+    end_time: Optional[datetime]
+    polyline: str
 
 
 class MotionContextCount(BaseModel):
     motion_context: str
     count: int
 
+class AnomalyEventOut(BaseModel):
+    metric: str
+    day: date
+    direction: str
+    first_at: datetime
+    value: Optional[float]
+    baseline: float
+    stddev: float
+    z_score: float
+    readings: int
+
+class SleepSessionOut(BaseModel):
+    night: date
+    in_bed_start: datetime
+    in_bed_end: datetime
+    onset: datetime
+    wake: datetime
+    asleep_min: float
+    awake_min: float
+    in_bed_min: float
+    core_min: float
+    deep_min: float
+    rem_min: float
+    unspecified_min: float
+    efficiency: Optional[float]
+
+class PercentileOut(BaseModel):
+    metric: str
+    value: float
+    days: int
+    cohort: str
+    percentile: float
+    cohort_users: Optional[int]
+    cohort_p25: Optional[float]
+    cohort_median: Optional[float]
+    cohort_p75: Optional[float]
+    computed_at: datetime
+
 class DateRange(BaseModel):
     start: datetime
     end: datetime
@@ -108,8 +190,30 @@ class ChatMessage(BaseModel):
 class ChatRename(BaseModel):
     new_name: str
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Per-worker initialization; runs in each process after uvicorn/gunicorn fork"""
+    global chat_service
+    started = time.perf_counter()
+    UPLOAD_DIR.mkdir(exist_ok=True)
+    chat_service = create_chat_service()
+    warmed = await run_in_threadpool(warm_pools)
+    assets = await run_in_threadpool(static_assets.build)
+    try:
+        resumed = await run_in_threadpool(deletion_jobs.resume_pending)
+        if resumed:
+            print(f"Resumed {resumed} pending user deletion job(s)")
+    except Exception as e:
+        print(f"Could not resume user deletion jobs: {e}")
+    elapsed = time.perf_counter() - started
+    APP_STARTUP_SECONDS.set(elapsed, ("lifespan",))
+    print(f"Worker {os.getpid()} ready: import {IMPORT_SECONDS:.3f}s, "
+          f"startup {elapsed:.3f}s, {warmed} DB connection(s) warmed, {assets} static file(s) built")
+    yield
+    close_pools()
+
 # FastAPI app
-app = FastAPI(title="Health API", version="1.0.0")
+app = FastAPI(title="Health API", version="1.0.0", lifespan=lifespan)
 
 # CORS middleware to allow frontend to connect
 app.add_middleware(
@@ -120,12 +224,38 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# gzip/brotli for JSON and text responses above COMPRESSION_MIN_BYTES
+app.add_middleware(CompressionMiddleware)
+
+# Per-route request count and latency, plus an in-flight gauge, for /metrics
+app.add_middleware(MetricsMiddleware)
+
+# Per-request DB timing, reported to the browser/proxies as a Server-Timing header
+@app.middleware("http")
+async def server_timing(request: Request, call_next):
+    timing = {"db_ms": 0.0, "db_queries": 0, "user_id": None}
+    token = request_context.set(timing)
+    start = time.perf_counter()
+    try:
+        response = await call_next(request)
+    finally:
+        request_context.reset(token)
+    total_ms = (time.perf_counter() - start) * 1000
+    response.headers["Server-Timing"] = (
+        f'db;dur={timing["db_ms"]:.1f};desc="{timing["db_queries"]} queries", total;dur={total_ms:.1f}'
+    )
+    return response
+
+# Per-request cProfile for admins (X-Profile header); only installed when PROFILING_TOKEN is set
+if profiling.ENABLED:
+    app.add_middleware(profiling.ProfileMiddleware)
+
 # Security
 security = HTTPBasic()
 
-# Upload directory
+# Upload directory (created at startup)
 UPLOAD_DIR = Path("uploads")
-UPLOAD_DIR.mkdir(exist_ok=True)
+upload_sessions = UploadSessions(UPLOAD_DIR)
 
 # Helper functions for auth
 def hash_password(password: str) -> str:
@@ -133,37 +263,23 @@ def hash_password(password: str) -> str:
 
 def verify_user(username: str, password: str) -> Optional[int]:
     """Verify user credentials and return user_id if valid"""
-    cnx = get_connection()
-    try:
-        cur = cnx.cursor(dictionary=True)
-        cur.execute(
-            "SELECT user_id, password FROM user WHERE username = %s",
-            (username,)
-        )
-        result = cur.fetchone()
-        cur.close()
-        
-        if result and result['password'] == hash_password(password):
-            return result['user_id']
-        return None
-    finally:
-        cnx.close()
+    # Primary, so a just-registered user can log in before replicas catch up
+    result = fetch_one(
+        "SELECT user_id, password FROM user WHERE username = %s",
+        (username,),
+        read=False
+    )
+    if result and result['password'] == hash_password(password):
+        return result['user_id']
+    return None
 
 def create_user(username: str, name: str, password: str) -> int:
     """Create a new user and return user_id"""
-    cnx = get_connection()
-    try:
-        cur = cnx.cursor()
-        cur.execute(
-            "INSERT INTO user (username, name, password) VALUES (%s, %s, %s)",
-            (username, name, hash_password(password))
-        )
-        user_id = cur.lastrowid
-        cnx.commit()
-        cur.close()
-        return user_id
-    finally:
-        cnx.close()
+    result = execute(
+        "INSERT INTO user (username, name, password) VALUES (%s, %s, %s)",
+        (username, name, hash_password(password))
+    )
+    return result["lastrowid"]
 
 def get_current_user(credentials: HTTPBasicCredentials = Depends(security)) -> int:
     """Dependency to get current authenticated user"""
@@ -174,27 +290,26 @@ def get_current_user(credentials: HTTPBasicCredentials = Depends(security)) -> i
             detail="Invalid credentials",
             headers={"WWW-Authenticate": "Basic"},
         )
+    bind_user(user_id)
     return user_id
 
+def require_own_data(user_id: int, current_user: int):
+    """Users may only read their own data"""
+    if current_user != user_id:
+        raise HTTPException(status_code=403, detail="Not allowed to access another user's data")
+
 def require_valid_range(start: datetime, end: datetime):
     if end <= start:
         raise HTTPException(status_code=400, detail="end must be after start")
 
 # Authentication endpoints
 @app.post("/api/register")
-async def register(username: str = Form(...), name: str = Form(...), password: str = Form(...)):
+def register(username: str = Form(...), name: str = Form(...), password: str = Form(...)):
     """Register a new user"""
     try:
         # Check if user already exists
-        cnx = get_connection()
-        try:
-            cur = cnx.cursor()
-            cur.execute("SELECT user_id FROM user WHERE username = %s", (username,))
-            if cur.fetchone():
-                raise HTTPException(status_code=400, detail="Username already exists")
-            cur.close()
-        finally:
-            cnx.close()
+        if fetch_one("SELECT user_id FROM user WHERE username = %s", (username,)):
+            raise HTTPException(status_code=400, detail="Username already exists")
         
         user_id = create_user(username, name, password)
         return {"success": True, "user_id": user_id, "message": "User created successfully"}
@@ -204,7 +319,7 @@ async def register(username: str = Form(...), name: str = Form(...), password: s
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/api/login")
-async def login(username: str = Form(...), password: str = Form(...)):
+def login(username: str = Form(...), password: str = Form(...)):
     """Login endpoint"""
     user_id = verify_user(username, password)
     if user_id is None:
@@ -212,106 +327,91 @@ async def login(username: str = Form(...), password: str = Form(...)):
     return {"success": True, "user_id": user_id}
 
 @app.get("/api/me")
-async def get_me(user_id: int = Depends(get_current_user)):
+def get_me(user_id: int = Depends(get_current_user)):
     """Get current user info"""
-    cnx = get_connection()
-    try:
-        cur = cnx.cursor(dictionary=True)
-        cur.execute("SELECT user_id, username, name FROM user WHERE user_id = %s", (user_id,))
-        user = cur.fetchone()
-        cur.close()
-        return user
-    finally:
-        cnx.close()
+    return fetch_one("SELECT user_id, username, name FROM user WHERE user_id = %s", (user_id,))
 
-@app.delete("/api/user/delete")
+@app.delete("/api/user/delete", status_code=202)
 async def delete_user(user_id: int = Depends(get_current_user)):
-    """Delete current user and all associated data"""
-    cnx = get_connection()
+    """Lock the account and delete it and all associated data in a background job"""
     try:
-        cur = cnx.cursor()
-        
-        # Delete all user data (in order due to foreign key constraints)
-        # Delete chat messages
-        cur.execute("DELETE cm FROM chat_message cm JOIN chats c ON cm.chat_id = c.chat_id WHERE c.user_id = %s", (user_id,))
-        
-        # Delete chats
-        cur.execute("DELETE FROM chats WHERE user_id = %s", (user_id,))
-        
-        # Delete metadata entries
-        cur.execute("""
-            DELETE me FROM metadata_entry me 
-            JOIN health_record hr ON me.record_id = hr.record_id 
-            WHERE hr.user_id = %s
-        """, (user_id,))
-        
-        # Delete health records
-        cur.execute("DELETE FROM health_record WHERE user_id = %s", (user_id,))
-        
-        # Delete health samples
-        cur.execute("DELETE FROM health_sample WHERE user_id = %s", (user_id,))
-        
-        # Delete HRV data
-        cur.execute("DELETE FROM hrv WHERE user_id = %s", (user_id,))
-        
-        # Delete activity summaries
-        cur.execute("DELETE FROM activity_summary WHERE user_id = %s", (user_id,))
-        
-        # Delete workouts
-        cur.execute("DELETE FROM workout WHERE user_id = %s", (user_id,))
-        
-        # Finally, delete the user
-        cur.execute("DELETE FROM user WHERE user_id = %s", (user_id,))
-        
-        cnx.commit()
-        cur.close()
-        
-        return {"success": True, "message": "User account and all data deleted successfully"}
+        job = await run_in_threadpool(deletion_jobs.submit, user_id)
+        series_cache.invalidate(user_id)
+        return {"success": True, "message": "Account deletion started", "job": job}
     except Exception as e:
-        cnx.rollback()
         raise HTTPException(status_code=500, detail=f"Failed to delete user: {str(e)}")
+
+@app.get("/api/user/delete/{job_id}")
+def delete_user_status(job_id: str):
+    """Progress of a deletion job
+
+    Unauthenticated on purpose: the account can no longer log in, so the job
+    id (a random UUID4, returned only to the account owner) is a bearer
+    capability. The response holds only progress, never the user id.
+    """
+    job = deletion_jobs.status(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Deletion job not found")
+    return job
+
+def _run_import(user_id: int, cmd: List[str]) -> subprocess.CompletedProcess:
+    """Run transfer.py, feeding its PROGRESS lines into the import gauges"""
+    IMPORT_JOBS_RUNNING.inc()
+    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+    # Drain stderr on a thread so a chatty importer cannot block on a full pipe
+    stderr_chunks: List[str] = []
+    drain = threading.Thread(target=lambda: stderr_chunks.append(proc.stderr.read()), daemon=True)
+    drain.start()
+    output, last_records = [], 0
+    try:
+        for line in proc.stdout:
+            if line.startswith("PROGRESS "):
+                # PROGRESS <records> <elapsed_s>
+                _, records, elapsed = line.split()
+                records, elapsed = int(records), float(elapsed)
+                IMPORT_RECORDS.inc(amount=records - last_records)
+                IMPORT_RECORDS_PER_SECOND.set(records / elapsed if elapsed else 0.0, (str(user_id),))
+                last_records = records
+            else:
+                output.append(line)
+        proc.wait()
+        drain.join()
     finally:
-        cnx.close()
+        IMPORT_JOBS_RUNNING.dec()
+        IMPORT_RECORDS_PER_SECOND.remove((str(user_id),))
+    return subprocess.CompletedProcess(cmd, proc.returncode, "".join(output), "".join(stderr_chunks))
 
-# Upload endpoint
-@app.post("/api/upload")
-async def upload_export(file: UploadFile = File(...), user_id: int = Depends(get_current_user)):
-    """Upload and process Apple Health export zip file"""
-    if not file.filename.endswith('.zip'):
-        raise HTTPException(status_code=400, detail="Only ZIP files are allowed")
-    
-    # Create user-specific upload directory
-    user_upload_dir = UPLOAD_DIR / str(user_id)
-    user_upload_dir.mkdir(exist_ok=True)
-    
-    # Save uploaded file
-    zip_path = user_upload_dir / file.filename
+def _extract_export(zip_path: Path, extract_dir: Path) -> Optional[Path]:
+    """Unpack an export ZIP (blocking; multi-GB exports take a while) and return its export.xml"""
+    if extract_dir.exists():
+        shutil.rmtree(extract_dir)
+    extract_dir.mkdir()
+    with zipfile.ZipFile(zip_path, 'r') as zip_ref:
+        zip_ref.extractall(extract_dir)
+    # Look for export.xml in apple_health_export folder, then directly in the archive
+    for export_xml in (extract_dir / "apple_health_export" / "export.xml", extract_dir / "export.xml"):
+        if export_xml.exists():
+            return export_xml
+    return None
+
+def _remove_import_files(zip_path: Path, extract_dir: Path):
+    shutil.rmtree(extract_dir, ignore_errors=True)
+    zip_path.unlink(missing_ok=True)
+
+async def _import_zip(user_id: int, zip_path: Path) -> Dict[str, Any]:
+    """Extract an export ZIP, run the importer on it and remove both afterwards, whatever the outcome"""
+    # One directory per upload: a user may finalize two uploads at once
+    extract_dir = zip_path.parent / f"{zip_path.stem}.extracted"
     try:
-        with open(zip_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
-        
-        # Extract zip file
-        extract_dir = user_upload_dir / "extracted"
-        if extract_dir.exists():
-            shutil.rmtree(extract_dir)
-        extract_dir.mkdir()
-        
-        with zipfile.ZipFile(zip_path, 'r') as zip_ref:
-            zip_ref.extractall(extract_dir)
-        
-        # Look for export.xml in apple_health_export folder
-        export_xml = extract_dir / "apple_health_export" / "export.xml"
-        if not export_xml.exists():
-            # Try direct export.xml
-            export_xml = extract_dir / "export.xml"
-            if not export_xml.exists():
-                raise HTTPException(
-                    status_code=400, 
-                    detail="Could not find export.xml in apple_health_export folder"
-                )
+        export_xml = await run_in_threadpool(_extract_export, zip_path, extract_dir)
+        if export_xml is None:
+            raise HTTPException(
+                status_code=400,
+                detail="Could not find export.xml in apple_health_export folder"
+            )
         
         # Run transfer.py to import data
-        result = subprocess.run([
+        result = await run_in_threadpool(_run_import, user_id, [
             "python3", "transfer.py",
             "--xml", str(export_xml),
             "--user-id", str(user_id),
@@ -320,7 +420,7 @@ async def upload_export(file: UploadFile = File(...), user_id: int = Depends(get
             "--db", os.getenv("DB_NAME", "apple_health"),
             "--db-user", os.getenv("DB_USER", "havok"),
             "--db-pass", os.getenv("DB_PASS", "maria"),
-        ], capture_output=True, text=True)
+        ])
         
         if result.returncode != 0:
             raise HTTPException(
@@ -328,10 +428,33 @@ async def upload_export(file: UploadFile = File(...), user_id: int = Depends(get
                 detail=f"Import failed: {result.stderr}"
             )
         
-        # Cleanup
-        shutil.rmtree(extract_dir)
-        zip_path.unlink()
-        
+        # Keep this user's reads on the primary while replicas apply the import
+        pin_user(user_id, IMPORT_PIN_S)
+        series_cache.invalidate(user_id)
+
+        # Only nights from the latest stored session onwards are rebuilt
+        try:
+            nights = await run_in_threadpool(sleep.refresh, user_id)
+            print(f"Rebuilt {nights} sleep session(s) for user {user_id}")
+        except Exception as e:
+            print(f"Sleep session refresh failed for user {user_id}: {e}")
+
+        # New data version for delta sync, once sessions derived from the import are in place
+        changed = re.search(r"^CHANGED (\S+) (\S+)$", result.stdout, re.M)
+        if changed:
+            # A night's session is keyed by its wake date, which can be the day after the last record
+            try:
+                await run_in_threadpool(delta_sync.record_change, user_id, date.fromisoformat(changed.group(1)),
+                                        date.fromisoformat(changed.group(2)) + timedelta(days=1))
+            except Exception as e:
+                print(f"Recording data change failed for user {user_id}: {e}")
+
+        # Re-rank just this user against the nightly cohort tables
+        try:
+            await run_in_threadpool(cohorts.refresh_user, user_id)
+        except Exception as e:
+            print(f"Cohort percentile refresh failed for user {user_id}: {e}")
+
         return {
             "success": True,
             "message": "Health data imported successfully",
@@ -340,8 +463,138 @@ async def upload_export(file: UploadFile = File(...), user_id: int = Depends(get
         
     except zipfile.BadZipFile:
         raise HTTPException(status_code=400, detail="Invalid ZIP file")
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        await run_in_threadpool(_remove_import_files, zip_path, extract_dir)
+
+def _save_upload(source, zip_path: Path):
+    with open(zip_path, "wb") as buffer:
+        shutil.copyfileobj(source, buffer)
+
+# Upload endpoint
+@app.post("/api/upload")
+async def upload_export(file: UploadFile = File(...), user_id: int = Depends(get_current_user)):
+    """Upload and process Apple Health export zip file (single request; see /api/uploads for large files)"""
+    if not file.filename.endswith('.zip'):
+        raise HTTPException(status_code=400, detail="Only ZIP files are allowed")
+    
+    # Create user-specific upload directory
+    user_upload_dir = UPLOAD_DIR / str(user_id)
+    user_upload_dir.mkdir(parents=True, exist_ok=True)
+    
+    # Save uploaded file (uniquely named, so concurrent uploads never share files)
+    zip_path = user_upload_dir / f"{uuid.uuid4().hex}-{Path(file.filename).name}"
+    try:
+        await run_in_threadpool(_save_upload, file.file, zip_path)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    return await _import_zip(user_id, zip_path)
+
+# Resumable chunked uploads: initiate, PUT chunks, query received ranges, complete
+class UploadInit(BaseModel):
+    filename: str
+    size: int
+
+def _upload_error(e: UploadError) -> HTTPException:
+    return HTTPException(status_code=e.status_code, detail=str(e))
+
+@app.post("/api/uploads", status_code=201)
+def initiate_upload(body: UploadInit, user_id: int = Depends(get_current_user)):
+    """Start a chunked upload; returns the upload id and the chunk size to use"""
+    try:
+        return upload_sessions.initiate(user_id, body.filename, body.size)
+    except UploadError as e:
+        raise _upload_error(e)
+
+@app.put("/api/uploads/{upload_id}/chunks")
+async def put_upload_chunk(upload_id: str, request: Request,
+                           offset: int = Query(..., ge=0),
+                           x_chunk_sha256: str = Header(..., description="Hex SHA-256 of the chunk body"),
+                           user_id: int = Depends(get_current_user)):
+    """Store one chunk at `offset` (a multiple of the session's chunk size)"""
+    limit = upload_sessions.chunk_size
+    declared = request.headers.get("content-length")
+    if declared is not None and int(declared) > limit:
+        raise HTTPException(status_code=413, detail="Chunk larger than the chunk size")
+    # Chunked transfer encoding sends no Content-Length, so the cap is enforced while reading
+    body = bytearray()
+    async for part in request.stream():
+        body += part
+        if len(body) > limit:
+            raise HTTPException(status_code=413, detail="Chunk larger than the chunk size")
+    body = bytes(body)
+    try:
+        return await run_in_threadpool(upload_sessions.write_chunk, user_id, upload_id, offset, body, x_chunk_sha256)
+    except UploadError as e:
+        raise _upload_error(e)
+
+@app.get("/api/uploads/{upload_id}")
+def upload_status(upload_id: str, user_id: int = Depends(get_current_user)):
+    """Received byte ranges of an upload, for resuming"""
+    try:
+        return upload_sessions.status(user_id, upload_id)
+    except UploadError as e:
+        raise _upload_error(e)
+
+@app.delete("/api/uploads/{upload_id}")
+def abort_upload(upload_id: str, user_id: int = Depends(get_current_user)):
+    try:
+        upload_sessions.abort(user_id, upload_id)
+        return {"success": True}
+    except UploadError as e:
+        raise _upload_error(e)
+
+@app.post("/api/uploads/{upload_id}/complete")
+async def complete_upload(upload_id: str, user_id: int = Depends(get_current_user)):
+    """Check every chunk arrived, then import the file in place"""
+    try:
+        zip_path = await run_in_threadpool(upload_sessions.finalize, user_id, upload_id, UPLOAD_DIR / str(user_id))
+    except UploadError as e:
+        raise _upload_error(e)
+    return await _import_zip(user_id, zip_path)
+
+# Range-bounded SQL of the daily series series_cache serves, used when the cache is disabled
+_SERIES_SQL = {
+    "hrv": """
+      SELECT DATE(start_date) AS day, AVG(value) AS avg_sdnn_ms
+      FROM hrv
+      WHERE user_id=%s AND start_date >= %s AND start_date < %s
+      GROUP BY DATE(start_date)
+      ORDER BY day
+    """,
+    "heart_rate": """
+      SELECT DATE(start_time) AS day,
+             AVG(avg_value)   AS avg_bpm,
+             MIN(min_value)   AS min_bpm,
+             MAX(max_value)   AS max_bpm,
+             unit
+      FROM health_sample
+      WHERE user_id=%s
+        AND sample_type='heart_rate'
+        AND start_time >= %s AND end_time < %s
+      GROUP BY DATE(start_time), unit
+      ORDER BY day, unit
+    """,
+    "activity": """
+      SELECT date, active_energy_burned, move_time, exercise_time, stand_hours
+      FROM activity_summary
+      WHERE user_id=%s AND date >= DATE(%s) AND date < DATE(%s)
+      ORDER BY date
+    """,
+}
+
+def _series_json(user_id: int, name: str, start: datetime, end: datetime,
+                 limit: Optional[int] = None, offset: int = 0) -> bytes:
+    """Rows of a daily series in [start, end) as a JSON array, from series_cache when it is enabled"""
+    if series_cache.enabled:
+        return series_cache.read_json(user_id, name, start, end, limit, offset)
+    sql, params = _SERIES_SQL[name], (user_id, as_sql_ts(start), as_sql_ts(end))
+    if limit is not None:
+        sql, params = sql + " LIMIT %s OFFSET %s", params + (limit, offset)
+    return dumps(fetch_all(sql, params))
 
 # Protected endpoints - require authentication
 @app.get("/api/users/{user_id}/hrv/daily", response_model=List[HRVDaily])
@@ -350,15 +603,7 @@ def hrv_daily(user_id: int,
               end:   datetime = Query(..., description="ISO 8601 datetime, e.g., 2024-07-01T00:00:00Z"),
               current_user: int = Depends(get_current_user)):
     require_valid_range(start, end)
-    s, e = as_sql_ts(start), as_sql_ts(end)
-    sql = """
-      SELECT DATE(start_date) AS day, AVG(value) AS avg_sdnn_ms
-      FROM hrv
-      WHERE user_id=%s AND start_date >= %s AND start_date < %s
-      GROUP BY DATE(start_date)
-      ORDER BY day
-    """
-    return fetch_all(sql, (user_id, s, e))
+    return FastJSONResponse(_series_json(user_id, "hrv", start, end))
 
 @app.get("/api/users/{user_id}/heart-rate/daily", response_model=List[HRDaily])
 def heart_rate_daily(user_id: int,
@@ -368,22 +613,7 @@ def heart_rate_daily(user_id: int,
                      offset: int = Query(0, ge=0),
                      current_user: int = Depends(get_current_user)):
     require_valid_range(start, end)
-    s, e = as_sql_ts(start), as_sql_ts(end)
-    sql = """
-      SELECT DATE(start_time) AS day,
-             AVG(avg_value)   AS avg_bpm,
-             MIN(min_value)   AS min_bpm,
-             MAX(max_value)   AS max_bpm,
-             unit
-      FROM health_sample
-      WHERE user_id=%s
-        AND sample_type='heart_rate'
-        AND start_time >= %s AND end_time < %s
-      GROUP BY DATE(start_time), unit
-      ORDER BY day
-      LIMIT %s OFFSET %s
-    """
-    return fetch_all(sql, (user_id, s, e, limit, offset))
+    return FastJSONResponse(_series_json(user_id, "heart_rate", start, end, limit, offset))
 
 @app.get("/api/users/{user_id}/activity/summary", response_model=List[ActivitySummaryOut])
 def activity_summary(user_id: int,
@@ -391,14 +621,7 @@ def activity_summary(user_id: int,
                      end:   datetime = Query(...),
                      current_user: int = Depends(get_current_user)):
     require_valid_range(start, end)
-    s, e = as_sql_ts(start), as_sql_ts(end)
-    sql = """
-      SELECT date, active_energy_burned, move_time, exercise_time, stand_hours
-      FROM activity_summary
-      WHERE user_id=%s AND date >= DATE(%s) AND date < DATE(%s)
-      ORDER BY date
-    """
-    return fetch_all(sql, (user_id, s, e))
+    return FastJSONResponse(_series_json(user_id, "activity", start, end))
 
 @app.get("/api/users/{user_id}/workouts", response_model=List[WorkoutOut])
 def workouts(user_id: int,
@@ -408,17 +631,53 @@ def workouts(user_id: int,
              offset: int = Query(0, ge=0),
              current_user: int = Depends(get_current_user)):
     require_valid_range(start, end)
-    s, e = as_sql_ts(start), as_sql_ts(end)
+    return FastJSONResponse(_workout_rows(user_id, as_sql_ts(start), as_sql_ts(end), limit, offset))
+
+def _workout_rows(user_id: int, s: str, e: str, limit: Optional[int] = None, offset: int = 0) -> List[Dict[str, Any]]:
     sql = """
       SELECT workout_id, activity_type, duration, duration_unit,
              total_distance, total_distance_unit, total_energy_burned, total_energy_burned_unit,
-             start_date, end_date, source_name
-      FROM workout
+             start_date, end_date, source_name,
+             EXISTS(SELECT 1 FROM workout_route r WHERE r.workout_id = w.workout_id) AS has_route
+      FROM workout w
       WHERE user_id=%s AND start_date >= %s AND start_date < %s
       ORDER BY start_date
-      LIMIT %s OFFSET %s
     """
-    return fetch_all(sql, (user_id, s, e, limit, offset))
+    params: tuple = (user_id, s, e)
+    if limit is not None:
+        sql += " LIMIT %s OFFSET %s"
+        params += (limit, offset)
+    rows = fetch_all(sql, params)
+    for row in rows:
+        row["has_route"] = bool(row["has_route"])
+    return rows
+
+@app.get("/api/users/{user_id}/workouts/{workout_id}/route", response_model=WorkoutRouteOut)
+def workout_route(user_id: int, workout_id: int,
+                  max_points: int = Query(500, ge=2, le=100000, description="Largest number of points wanted"),
+                  current_user: int = Depends(get_current_user)):
+    """The most detailed stored simplification of a workout's route within max_points
+
+    The polyline uses the encoded polyline format (precision 5). If even the
+    coarsest level exceeds max_points, the coarsest level is returned.
+    """
+    require_own_data(user_id, current_user)
+    row = fetch_one(
+        """
+        SELECT r.workout_id, l.level, l.tolerance_m, l.point_count, r.point_count AS total_points,
+               r.distance_m, r.min_lat, r.min_lon, r.max_lat, r.max_lon, r.start_time, r.end_time, l.polyline
+        FROM workout_route r
+        JOIN workout_route_level l ON l.workout_id = r.workout_id
+        WHERE r.workout_id=%s AND r.user_id=%s
+        ORDER BY l.point_count <= %s DESC, IF(l.point_count <= %s, -l.point_count, l.point_count)
+        LIMIT 1
+        """,
+        (workout_id, user_id, max_points, max_points)
+    )
+    if row is None:
+        raise HTTPException(status_code=404, detail="Workout has no route")
+    row["bbox"] = [row.pop("min_lat"), row.pop("min_lon"), row.pop("max_lat"), row.pop("max_lon")]
+    return FastJSONResponse(row)
 
 @app.get("/api/users/{user_id}/heart-rate/motion-context", response_model=List[MotionContextCount])
 def motion_context_counts(user_id: int,
@@ -427,17 +686,128 @@ def motion_context_counts(user_id: int,
                           current_user: int = Depends(get_current_user)):
     require_valid_range(start, end)
     s, e = as_sql_ts(start), as_sql_ts(end)
+    # start_date predicates on both tables let each prune to the window's monthly partitions
     sql = """
       SELECT me.meta_value AS motion_context, COUNT(*) AS count
       FROM metadata_entry me
-      JOIN health_record hr ON hr.record_id = me.record_id
+      JOIN health_record hr ON hr.record_id = me.record_id AND hr.start_date = me.start_date
       WHERE hr.user_id=%s
         AND me.meta_key='HKMetadataKeyHeartRateMotionContext'
         AND hr.start_date >= %s AND hr.start_date < %s
+        AND me.start_date >= %s AND me.start_date < %s
       GROUP BY me.meta_value
       ORDER BY count DESC
     """
-    return fetch_all(sql, (user_id, s, e))
+    rows = fetch_all(sql, (user_id, s, e, s, e))
+    archived = partitions.read_archived("metadata_entry", user_id, s, e, ["meta_value"],
+                                        [("meta_key", "=", MOTION_CONTEXT_KEY)])
+    if not archived:
+        return rows
+    counts = Counter({r["motion_context"]: r["count"] for r in rows})
+    counts.update(r["meta_value"] for r in archived)
+    return [{"motion_context": k, "count": v} for k, v in counts.most_common()]
+
+@app.get("/api/users/{user_id}/anomalies", response_model=List[AnomalyEventOut])
+def anomalies(user_id: int,
+              start: datetime = Query(...),
+              end:   datetime = Query(...),
+              metric: Optional[str] = Query(None, description="hrv or resting_hr"),
+              current_user: int = Depends(get_current_user)):
+    """HRV / resting HR readings that moved sharply from the user's baseline (found during import)"""
+    require_own_data(user_id, current_user)
+    require_valid_range(start, end)
+    sql = """
+      SELECT metric, day, direction, first_at, value, baseline, stddev, z_score, readings
+      FROM anomaly_event
+      WHERE user_id=%s AND day >= %s AND day <= %s
+    """
+    params = [user_id, start.date(), end.date()]
+    if metric:
+        sql += " AND metric=%s"
+        params.append(metric)
+    return FastJSONResponse(fetch_all(sql + " ORDER BY day DESC, metric", tuple(params)))
+
+@app.get("/api/users/{user_id}/sleep", response_model=List[SleepSessionOut])
+def sleep_sessions(user_id: int,
+                   start: datetime = Query(...),
+                   end:   datetime = Query(...),
+                   current_user: int = Depends(get_current_user)):
+    """Nights of sleep (stage minutes, onset, wake, efficiency), keyed by the UTC date of waking
+
+    Times are UTC; the export's local offset is not kept, so a night can be
+    dated a day off from the user's local wake date.
+    """
+    require_own_data(user_id, current_user)
+    require_valid_range(start, end)
+    sql = """
+      SELECT night, in_bed_start, in_bed_end, onset, wake, asleep_min, awake_min, in_bed_min,
+             core_min, deep_min, rem_min, unspecified_min, efficiency
+      FROM sleep_session
+      WHERE user_id=%s AND night >= %s AND night <= %s
+      ORDER BY night
+    """
+    return FastJSONResponse(fetch_all(sql, (user_id, start.date(), end.date())))
+
+@app.get("/api/users/{user_id}/percentiles", response_model=List[PercentileOut])
+def percentiles(user_id: int, current_user: int = Depends(get_current_user)):
+    """HRV and resting HR compared with the user's age cohort (precomputed by cohorts.py)"""
+    require_own_data(user_id, current_user)
+    return FastJSONResponse(cohorts.user_percentiles(user_id))
+
+# Per-day series in a sync response; the dashboard caches each under the row's day
+SYNC_SERIES = ("hrv", "heart_rate", "activity", "sleep", "workouts", "snapshots")
+
+def _json_array(parts: List[bytes]) -> bytes:
+    """Concatenate encoded JSON arrays into one"""
+    return b"[" + b",".join(p[1:-1] for p in parts if len(p) > 2) + b"]"
+
+@app.get("/api/users/{user_id}/sync")
+def sync(user_id: int,
+         start: date = Query(...),
+         end: date = Query(..., description="First day after the wanted range"),
+         version: Optional[int] = Query(None, description="Data version of the client's cache"),
+         have_start: Optional[date] = Query(None, description="First day the client's cache holds"),
+         have_end: Optional[date] = Query(None, description="First day after the cached range"),
+         current_user: int = Depends(get_current_user)):
+    """Delta sync of the dashboard's daily series
+
+    Returns rows only for `ranges`: wanted days outside the client's cached
+    range, plus cached or wanted days changed by imports after `version`.
+    The client replaces its rows in those ranges and stores `version`; with
+    `reset` it must first drop its cache (the held range was not usable).
+    """
+    require_own_data(user_id, current_user)
+    if end <= start or (end - start).days > delta_sync.MAX_SYNC_DAYS:
+        raise HTTPException(status_code=400, detail="Invalid sync range")
+    latest = delta_sync.current_version(user_id)
+    have = None
+    if version is not None and have_start and have_end and have_start < have_end:
+        # A version from the future (e.g. a restored database) or a disjoint range cannot be patched
+        if version <= latest and have_start <= end and start <= have_end:
+            have = (have_start, have_end)
+    reset = version is not None and have is None
+    ranges = delta_sync.plan((start, end), have, delta_sync.changed_since(user_id, version) if have else [])
+
+    parts: Dict[str, List[bytes]] = {name: [] for name in SYNC_SERIES}
+    for lo, hi in ranges:
+        s = datetime(lo.year, lo.month, lo.day)
+        e = datetime(hi.year, hi.month, hi.day)
+        for name in ("hrv", "heart_rate", "activity"):
+            parts[name].append(_series_json(user_id, name, s, e))
+        parts["sleep"].append(dumps(fetch_all(
+            """
+            SELECT night, in_bed_start, in_bed_end, onset, wake, asleep_min, awake_min, in_bed_min,
+                   core_min, deep_min, rem_min, unspecified_min, efficiency
+            FROM sleep_session WHERE user_id=%s AND night >= %s AND night < %s ORDER BY night
+            """,
+            (user_id, lo, hi)
+        )))
+        parts["workouts"].append(dumps(_workout_rows(user_id, as_sql_ts(s), as_sql_ts(e))))
+        parts["snapshots"].append(dumps(_daily_snapshots(user_id, lo, hi)))
+
+    series = b",".join(b'"%s":%s' % (name.encode(), _json_array(parts[name])) for name in SYNC_SERIES)
+    head = dumps({"version": latest, "reset": reset, "ranges": [[lo, hi] for lo, hi in ranges]})
+    return FastJSONResponse(head[:-1] + b',"series":{' + series + b"}}")
 
 # Optional GET overview with query params
 @app.get("/api/users/{user_id}/overview", response_model=OverviewOut)
@@ -461,17 +831,14 @@ def daily_snapshot(user_id: int,
                    current_user: int = Depends(get_current_user)):
     """Get daily snapshots using fn_user_daily_snapshot stored function"""
     require_valid_range(start, end)
-    
-    # Generate list of dates between start and end
-    start_date = start.date()
-    end_date = end.date()
-    
+    return _daily_snapshots(user_id, start.date(), end.date())
+
+def _daily_snapshots(user_id: int, start_date: date, end_date: date) -> List[Dict[str, Any]]:
+    """fn_user_daily_snapshot for each day in [start_date, end_date), plus archived motion context"""
     results = []
     current_date = start_date
     
-    cnx = get_connection()
-    try:
-        cur = cnx.cursor()
+    with cursor(read=True) as cur:
         while current_date < end_date:
             # Call the stored function
             cur.execute("SELECT fn_user_daily_snapshot(%s, %s) AS snapshot", (user_id, current_date))
@@ -479,21 +846,27 @@ def daily_snapshot(user_id: int,
             
             if row and row[0]:
                 try:
-                    snapshot_data = json.loads(row[0])
-                    results.append(DailySnapshotOut(
-                        day=current_date,
-                        snapshot=snapshot_data
-                    ))
+                    results.append({"day": current_date, "snapshot": json.loads(row[0])})
                 except json.JSONDecodeError:
                     # Skip invalid JSON
                     pass
             
             current_date += timedelta(days=1)
-        
-        cur.close()
-        return results
-    finally:
-        cnx.close()
+
+    # Motion context for archived months lives in Parquet, not in the stored function's tables
+    archived = partitions.read_archived("metadata_entry", user_id, start_date, end_date,
+                                        ["meta_value", "start_date"], [("meta_key", "=", MOTION_CONTEXT_KEY)])
+    if archived:
+        per_day: Dict[date, Counter] = {}
+        for r in archived:
+            per_day.setdefault(r["start_date"].date(), Counter())[r["meta_value"]] += 1
+        for item in results:
+            extra = per_day.get(item["day"])
+            if extra:
+                mc = item["snapshot"].setdefault("motion_context", {})
+                for key in ("0", "1"):
+                    mc[key] = mc.get(key, 0) + extra.get(key, 0)
+    return results
 
 def _overview_common(user_id: int, start: datetime, end: datetime) -> OverviewOut:
     s, e = as_sql_ts(start), as_sql_ts(end)
@@ -532,7 +905,7 @@ def _overview_common(user_id: int, start: datetime, end: datetime) -> OverviewOu
 
 # Chat endpoints
 @app.post("/api/chat/new")
-async def create_new_chat(user_id: int = Depends(get_current_user)):
+def create_new_chat(user_id: int = Depends(get_current_user)):
     """Create a new chat session"""
     if not chat_service:
         raise HTTPException(status_code=503, detail="Chat service not available. Please configure GEMINI_API_KEY")
@@ -545,7 +918,7 @@ async def create_new_chat(user_id: int = Depends(get_current_user)):
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/api/chat/list")
-async def list_chats(user_id: int = Depends(get_current_user)):
+def list_chats(user_id: int = Depends(get_current_user)):
     """Get all chats for current user"""
     if not chat_service:
         raise HTTPException(status_code=503, detail="Chat service not available")
@@ -556,8 +929,22 @@ async def list_chats(user_id: int = Depends(get_current_user)):
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/api/chat/search")
+def search_chats(q: str = Query(..., min_length=1, max_length=200),
+                 limit: int = Query(20, ge=1, le=100),
+                 user_id: int = Depends(get_current_user)):
+    """Search the current user's chat history"""
+    if not chat_service:
+        raise HTTPException(status_code=503, detail="Chat service not available")
+    
+    try:
+        results = chat_service.search_messages(user_id, q, limit)
+        return {"success": True, "query": q, "results": results}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
 @app.get("/api/chat/{chat_id}/messages")
-async def get_chat_messages(chat_id: str, user_id: int = Depends(get_current_user)):
+def get_chat_messages(chat_id: str, user_id: int = Depends(get_current_user)):
     """Get all messages for a chat"""
     if not chat_service:
         raise HTTPException(status_code=503, detail="Chat service not available")
@@ -577,7 +964,9 @@ async def send_chat_message(chat_id: str, message_data: ChatMessage, user_id: in
         raise HTTPException(status_code=503, detail="Chat service not available")
     
     try:
-        result = chat_service.send_message(
+        # Runs in the threadpool: the turn blocks on DB calls and on the LLM scheduler
+        result = await run_in_threadpool(
+            profiling.profiled(chat_service.send_message),
             chat_id, 
             user_id, 
             message_data.message, 
@@ -585,13 +974,32 @@ async def send_chat_message(chat_id: str, message_data: ChatMessage, user_id: in
             message_data.insight_type
         )
         return result
+    except SchedulerBusy as e:
+        raise HTTPException(
+            status_code=429,
+            detail={"message": str(e), "queue_position": e.queue_position, "retry_after": e.retry_after},
+            headers={"Retry-After": str(e.retry_after)},
+        )
     except ValueError as e:
         raise HTTPException(status_code=404, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/api/chat/queue")
+async def chat_queue_status(user_id: int = Depends(get_current_user)):
+    """Current AI request queue position for this user plus scheduler load"""
+    if not chat_service:
+        raise HTTPException(status_code=503, detail="Chat service not available")
+    
+    return {
+        "success": True,
+        "queue_position": chat_service.scheduler.queue_position(user_id),
+        "scheduler": chat_service.scheduler.stats(),
+        "insights_shared": chat_service.insight_calls.shared
+    }
+
 @app.delete("/api/chat/{chat_id}")
-async def delete_chat(chat_id: str, user_id: int = Depends(get_current_user)):
+def delete_chat(chat_id: str, user_id: int = Depends(get_current_user)):
     """Delete a chat and all its messages"""
     if not chat_service:
         raise HTTPException(status_code=503, detail="Chat service not available")
@@ -607,7 +1015,7 @@ async def delete_chat(chat_id: str, user_id: int = Depends(get_current_user)):
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.put("/api/chat/{chat_id}/rename")
-async def rename_chat(chat_id: str, rename_data: ChatRename, user_id: int = Depends(get_current_user)):
+def rename_chat(chat_id: str, rename_data: ChatRename, user_id: int = Depends(get_current_user)):
     """Rename a chat"""
     if not chat_service:
         raise HTTPException(status_code=503, detail="Chat service not available")
@@ -622,56 +1030,109 @@ async def rename_chat(chat_id: str, rename_data: ChatRename, user_id: int = Depe
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-# Serve static files - must be after all route definitions
-@app.get("/static/style.css")
-async def serve_css():
-    return FileResponse("css/style.css", media_type="text/css")
+# Metrics (admin only; SQL text, plans and pool internals are not for anonymous callers)
+def require_admin(x_admin_token: Optional[str] = Header(None), authorization: Optional[str] = Header(None)):
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=404, detail="Not found")
+    token = x_admin_token
+    if token is None and authorization and authorization.lower().startswith("bearer "):
+        token = authorization[7:].strip()
+    if token is None or not hmac.compare_digest(token, ADMIN_TOKEN):
+        raise HTTPException(status_code=403, detail="Invalid admin token")
+
+@app.get("/api/metrics/pool", dependencies=[Depends(require_admin)])
+async def pool_metrics():
+    """Per-pool saturation (open/in-use/idle, waiters, checkout wait, timeouts) and read routing counters"""
+    return pool_stats()
 
-@app.get("/static/dashboard.js")
-async def serve_dashboard_js():
-    return FileResponse("js/dashboard.js", media_type="application/javascript")
+@app.get("/api/metrics/series-cache", dependencies=[Depends(require_admin)])
+async def series_cache_metrics():
+    """Chart series cache occupancy, hit/miss counts and evictions"""
+    return series_cache.stats()
 
-@app.get("/static/auth.js")
-async def serve_auth_js():
-    return FileResponse("js/auth.js", media_type="application/javascript")
+@app.get("/api/metrics/queries", dependencies=[Depends(require_admin)])
+async def query_metrics():
+    """Per-call-site query latency histograms and row counts, plus recent slow queries with EXPLAIN plans"""
+    return query_stats.snapshot()
 
-@app.get("/static/register.js")
-async def serve_register_js():
-    return FileResponse("js/register.js", media_type="application/javascript")
+@app.get("/metrics", include_in_schema=False, dependencies=[Depends(require_admin)])
+async def prometheus_metrics():
+    """Prometheus text exposition of request, import, LLM and DB metrics"""
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
 
-@app.get("/static/upload.js")
-async def serve_upload_js():
-    return FileResponse("js/upload.js", media_type="application/javascript")
+# Profiling (admin only; disabled unless PROFILING_TOKEN is set)
+def require_profiling_admin(x_admin_token: Optional[str] = Header(None)):
+    if not profiling.ENABLED:
+        raise HTTPException(status_code=404, detail="Not found")
+    if not profiling.check_token(x_admin_token):
+        raise HTTPException(status_code=403, detail="Invalid admin token")
 
-@app.get("/static/chat.js")
-async def serve_chat_js():
-    return FileResponse("js/chat.js", media_type="application/javascript")
+@app.post("/api/admin/profile/sample", dependencies=[Depends(require_profiling_admin)])
+async def profile_sample(seconds: float = Query(10.0, gt=0, le=profiling.MAX_SAMPLE_SECONDS),
+                         interval_ms: float = Query(10.0, ge=1, le=1000),
+                         idle: bool = Query(False, description="Include threads waiting for work")):
+    """Sample this worker's stacks for `seconds`; returns collapsed stacks for flamegraph.pl or speedscope"""
+    try:
+        collapsed, stats = await run_in_threadpool(profiling.stack_sampler.sample, seconds, interval_ms, idle)
+    except profiling.ProfilerBusy as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    filename = f"profile-{stats['pid']}-{int(time.time())}.collapsed"
+    return PlainTextResponse(collapsed, headers={
+        "Content-Disposition": f'attachment; filename="{filename}"',
+        "X-Profile-Stats": json.dumps(stats),
+    })
+
+@app.get("/api/admin/profile/requests", dependencies=[Depends(require_profiling_admin)])
+def profiled_requests():
+    """Recent requests profiled with the X-Profile header, newest first"""
+    return profiling.request_profiles.list()
+
+@app.get("/api/admin/profile/requests/{profile_id}", dependencies=[Depends(require_profiling_admin)])
+def profiled_request(profile_id: str,
+                     sort: str = Query("cumulative", pattern="^(cumulative|tottime|ncalls|time|calls)$"),
+                     limit: int = Query(40, ge=1, le=500)):
+    """cProfile summary of one profiled request"""
+    profile = profiling.request_profiles.get(profile_id)
+    if profile is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return PlainTextResponse(profile.summary(sort, limit))
+
+# Serve static files - must be after all route definitions
+@app.get("/static/{name}")
+async def serve_static(name: str, request: Request):
+    response = static_assets.asset(request, name)
+    if response is None:
+        raise HTTPException(status_code=404, detail="Not found")
+    return response
 
 @app.get("/favicon.ico")
-async def serve_favicon():
-    return FileResponse("favicon.ico", media_type="image/x-icon")
+async def serve_favicon(request: Request):
+    return static_assets.favicon(request)
 
 @app.get("/")
-async def serve_login():
-    return FileResponse("html/login.html")
+async def serve_login(request: Request):
+    return static_assets.page(request, "login.html")
 
 @app.get("/register")
-async def serve_register():
-    return FileResponse("html/register.html")
+async def serve_register(request: Request):
+    return static_assets.page(request, "register.html")
 
 @app.get("/upload")
-async def serve_upload():
-    return FileResponse("html/upload.html")
+async def serve_upload(request: Request):
+    return static_assets.page(request, "upload.html")
 
 @app.get("/dashboard")
-async def serve_dashboard():
-    return FileResponse("html/dashboard.html")
-
-@app.get("/static/logo.png")
-async def serve_logo():
-    return FileResponse("light.png", media_type="image/png")
+async def serve_dashboard(request: Request):
+    return static_assets.page(request, "dashboard.html")
 
 @app.get("/chat")
-async def serve_chat():
-    return FileResponse("html/chat.html")
+async def serve_chat(request: Request):
+    return static_assets.page(request, "chat.html")
+
+# Sync endpoints and dependencies run on the threadpool, out of reach of the
+# loop thread's profiler; wrap them so profiled requests cover them too
+profiling.instrument(app)
 
+# Module import cost (imports, app and route construction); lifespan cost is recorded separately
+IMPORT_SECONDS = time.perf_counter() - _IMPORT_STARTED
+APP_STARTUP_SECONDS.set(IMPORT_SECONDS, ("import",))
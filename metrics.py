@@ -0,0 +1,258 @@
+# In-process metric primitives
+import threading
+import time
+from bisect import bisect_left
+from typing import Callable, Dict, Any, List, Optional, Sequence
+
+# Latency buckets in milliseconds (upper bounds, +Inf implied)
+DEFAULT_BUCKETS_MS = (0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+
+class Histogram:
+    """Fixed-bucket histogram; observe() is O(log buckets) under a lock"""
+
+    def __init__(self, buckets: Sequence[float] = DEFAULT_BUCKETS_MS):
+        self.buckets = tuple(buckets)
+        self._counts = [0] * (len(self.buckets) + 1)
+        self._sum = 0.0
+        self._count = 0
+        self._max = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        i = bisect_left(self.buckets, value)
+        with self._lock:
+            self._counts[i] += 1
+            self._sum += value
+            self._count += 1
+            if value > self._max:
+                self._max = value
+
+    def quantile(self, q: float) -> Optional[float]:
+        """Estimate a quantile by linear interpolation inside the matching bucket"""
+        with self._lock:
+            counts = list(self._counts)
+            total = self._count
+            top = self._max
+        if total == 0:
+            return None
+        rank = q * total
+        seen = 0
+        for i, c in enumerate(counts):
+            if seen + c >= rank and c:
+                lo = self.buckets[i - 1] if i > 0 else 0.0
+                hi = self.buckets[i] if i < len(self.buckets) else top
+                return min(top, lo + (hi - lo) * (rank - seen) / c)
+            seen += c
+        return top
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            counts = list(self._counts)
+            total, s, top = self._count, self._sum, self._max
+        cumulative, running = {}, 0
+        for bound, c in zip(list(self.buckets) + ["+Inf"], counts):
+            running += c
+            cumulative[str(bound)] = running
+        return {
+            "count": total,
+            "sum": round(s, 3),
+            "avg": round(s / total, 3) if total else None,
+            "max": round(top, 3),
+            "p50": self.quantile(0.5),
+            "p95": self.quantile(0.95),
+            "p99": self.quantile(0.99),
+            "buckets": cumulative,
+        }
+
+
+# Prometheus-style metric families ------------------------------------------
+
+# Latency buckets in seconds for request/LLM histograms
+DEFAULT_BUCKETS_S = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+def _escape(value) -> str:
+    """Label value escaped per the text exposition format"""
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _fmt_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class _Family:
+    kind = "untyped"
+
+    def __init__(self, name: str, help_text: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.help = help_text
+        self.label_names = tuple(labels)
+        self._lock = threading.Lock()
+
+    def header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Family):
+    """Monotonic counter keyed by label values"""
+
+    kind = "counter"
+
+    def __init__(self, name: str, help_text: str, labels: Sequence[str] = ()):
+        super().__init__(name, help_text, labels)
+        self._values: Dict[tuple, float] = {}
+
+    def inc(self, labels: tuple = (), amount: float = 1.0):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = list(self._values.items())
+        return self.header() + [f"{self.name}{_fmt_labels(self.label_names, k)} {v}" for k, v in items]
+
+
+class Gauge(Counter):
+    """Value that can go up and down"""
+
+    kind = "gauge"
+
+    def set(self, value: float, labels: tuple = ()):
+        with self._lock:
+            self._values[labels] = value
+
+    def dec(self, labels: tuple = (), amount: float = 1.0):
+        self.inc(labels, -amount)
+
+    def remove(self, labels: tuple):
+        with self._lock:
+            self._values.pop(labels, None)
+
+
+class HistogramFamily(_Family):
+    """Histograms keyed by label values"""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, labels: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS_S):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(buckets)
+        self._children: Dict[tuple, Histogram] = {}
+
+    def labels(self, labels: tuple = ()) -> Histogram:
+        child = self._children.get(labels)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(labels, Histogram(self.buckets))
+        return child
+
+    def observe(self, value: float, labels: tuple = ()):
+        self.labels(labels).observe(value)
+
+    def render(self) -> List[str]:
+        lines = self.header()
+        with self._lock:
+            items = list(self._children.items())
+        for key, hist in items:
+            snap = hist.snapshot()
+            for bound, count in snap["buckets"].items():
+                le = 'le="%s"' % bound
+                lines.append(f"{self.name}_bucket{_fmt_labels(self.label_names, key, le)} {count}")
+            lines.append(f"{self.name}_sum{_fmt_labels(self.label_names, key)} {snap['sum']}")
+            lines.append(f"{self.name}_count{_fmt_labels(self.label_names, key)} {snap['count']}")
+        return lines
+
+
+class Registry:
+    """Holds metric families and scrape-time collectors; renders text exposition format"""
+
+    def __init__(self):
+        self._families: List[_Family] = []
+        self._collectors: List[Callable[[], List[str]]] = []
+
+    def register(self, family: _Family) -> _Family:
+        self._families.append(family)
+        return family
+
+    def register_collector(self, fn: Callable[[], List[str]]):
+        """fn() is called on each scrape and returns exposition lines"""
+        self._collectors.append(fn)
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for family in self._families:
+            lines.extend(family.render())
+        for collector in self._collectors:
+            try:
+                lines.extend(collector())
+            except Exception as e:
+                lines.append(f"# collector error: {e}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+HTTP_REQUESTS = REGISTRY.register(Counter(
+    "http_requests_total", "HTTP requests by route template and status", ("method", "route", "status")))
+HTTP_LATENCY = REGISTRY.register(HistogramFamily(
+    "http_request_duration_seconds", "HTTP request latency by route template", ("method", "route")))
+HTTP_IN_FLIGHT = REGISTRY.register(Gauge(
+    "http_requests_in_flight", "HTTP requests currently being handled"))
+
+IMPORT_JOBS_RUNNING = REGISTRY.register(Gauge(
+    "import_jobs_running", "Health export imports currently running"))
+IMPORT_RECORDS_PER_SECOND = REGISTRY.register(Gauge(
+    "import_records_per_second", "Current insert rate of each running import", ("user_id",)))
+IMPORT_RECORDS = REGISTRY.register(Counter(
+    "import_records_total", "Records imported from health exports"))
+
+APP_STARTUP_SECONDS = REGISTRY.register(Gauge(
+    "app_startup_seconds", "Worker start-up cost: module import and lifespan initialization", ("phase",)))
+
+LLM_LATENCY = REGISTRY.register(HistogramFamily(
+    "llm_call_duration_seconds", "LLM call latency (excluding scheduler queueing)", ("backend",)))
+LLM_CALLS = REGISTRY.register(Counter(
+    "llm_calls_total", "LLM calls by outcome", ("backend", "outcome")))
+LLM_TOKENS = REGISTRY.register(Counter(
+    "llm_tokens_total", "Estimated LLM tokens", ("backend", "kind")))
+
+
+class MetricsMiddleware:
+    """Pure ASGI middleware recording per-route request count, latency and in-flight
+
+    Requests are labelled with the matched route template (e.g.
+    /api/users/{user_id}/workouts) so label cardinality stays bounded. The
+    template is read from scope["route"], which the router sets while handling
+    the request, so in-flight requests are counted without a route label.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        method = scope["method"]
+        status_holder = [500]
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status_holder[0] = message["status"]
+            await send(message)
+
+        HTTP_IN_FLIGHT.inc()
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            HTTP_IN_FLIGHT.dec()
+            route = getattr(scope.get("route"), "path", "unmatched")
+            HTTP_LATENCY.observe(time.perf_counter() - start, (method, route))
+            HTTP_REQUESTS.inc((method, route, str(status_holder[0])))
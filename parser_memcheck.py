@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+"""
+Peak-memory check of the export parser on a generated export.xml.
+
+Writes a synthetic export of the requested size (Records with metadata,
+Correlations, Workouts with routes, ActivitySummaries, ClinicalRecords),
+plus one wide Correlation holding a tenth of the file in child Records,
+then parses it in a fresh process per parser and reports peak RSS, elements
+yielded and throughput. Exits non-zero if any export_parser backend exceeds
+--max-rss-mb, so it can guard against regressions in CI.
+
+The "legacy" mode is the previous importer loop (elem.clear() only, elements
+left attached to the root) for comparison; it is not checked against the limit.
+
+Example:
+    python3 parser_memcheck.py --size-mb 2048 --max-rss-mb 150
+"""
+import argparse
+import os
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import xml.etree.ElementTree as ET
+
+from export_parser import iter_export, lxml_etree
+
+HEADER = """<?xml version="1.0" encoding="UTF-8"?>
+<!DOCTYPE HealthData [
+<!ELEMENT HealthData (ExportDate,Me,(Record|Correlation|Workout|ActivitySummary|ClinicalRecord)*)>
+]>
+<HealthData locale="en_US">
+ <ExportDate value="2024-06-01 10:00:00 +0000"/>
+ <Me HKCharacteristicTypeIdentifierDateOfBirth="1990-01-01" HKCharacteristicTypeIdentifierBiologicalSex="HKBiologicalSexNotSet"/>
+"""
+
+RECORD = ('<Record type="HKQuantityTypeIdentifierHeartRate" sourceName="Apple Watch" sourceVersion="10.1" '
+          'device="&lt;&lt;HKDevice: 0x1&gt;, name:Apple Watch&gt;" unit="count/min" '
+          'creationDate="{d} +0000" startDate="{d} +0000" endDate="{d} +0000" value="{v}">\n'
+          '  <MetadataEntry key="HKMetadataKeyHeartRateMotionContext" value="{m}"/>\n'
+          ' </Record>\n')
+CORRELATION = ('<Correlation type="HKCorrelationTypeIdentifierBloodPressure" sourceName="Omron" '
+               'creationDate="{d} +0000" startDate="{d} +0000" endDate="{d} +0000">\n'
+               '  <Record type="HKQuantityTypeIdentifierBloodPressureSystolic" sourceName="Omron" unit="mmHg" '
+               'creationDate="{d} +0000" startDate="{d} +0000" endDate="{d} +0000" value="120"/>\n'
+               '  <Record type="HKQuantityTypeIdentifierBloodPressureDiastolic" sourceName="Omron" unit="mmHg" '
+               'creationDate="{d} +0000" startDate="{d} +0000" endDate="{d} +0000" value="80"/>\n'
+               ' </Correlation>\n')
+WORKOUT = ('<Workout workoutActivityType="HKWorkoutActivityTypeRunning" duration="31.5" durationUnit="min" '
+           'totalDistance="5.1" totalDistanceUnit="km" totalEnergyBurned="320" totalEnergyBurnedUnit="kcal" '
+           'sourceName="Apple Watch" creationDate="{d} +0000" startDate="{d} +0000" endDate="{d} +0000">\n'
+           '  <WorkoutEvent type="HKWorkoutEventTypeSegment" date="{d} +0000" duration="5" durationUnit="min"/>\n'
+           '  <WorkoutRoute sourceName="Apple Watch" creationDate="{d} +0000" startDate="{d} +0000" endDate="{d} +0000">\n'
+           '   <FileReference path="/workout-routes/route_{d}.gpx"/>\n'
+           '  </WorkoutRoute>\n'
+           ' </Workout>\n')
+WIDE_RECORD = ('  <Record type="HKQuantityTypeIdentifierHeartRate" sourceName="Apple Watch" unit="count/min" '
+               'creationDate="{d} +0000" startDate="{d} +0000" endDate="{d} +0000" value="{v}">\n'
+               '   <MetadataEntry key="HKMetadataKeyHeartRateMotionContext" value="0"/>\n'
+               '  </Record>\n')
+ACTIVITY = ('<ActivitySummary dateComponents="2024-01-01" activeEnergyBurned="512.3" activeEnergyBurnedGoal="500" '
+            'activeEnergyBurnedUnit="kcal" appleMoveTime="0" appleExerciseTime="34" appleStandHours="11"/>\n')
+CLINICAL = ('<ClinicalRecord type="HKClinicalTypeIdentifierLabResultRecord" identifier="{i}" sourceName="Clinic" '
+            'fhirVersion="4.0.1" receivedDate="{d} +0000" resourceFilePath="/clinical-records/{i}.json"/>\n')
+
+
+def generate(path: str, size_mb: int, seed: int = 0):
+    """Stream a synthetic export of about size_mb megabytes to path"""
+    rng = random.Random(seed)
+    target = size_mb * 1024 * 1024
+    written = 0
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(HEADER)
+        # A skipped top-level element with many children: its finished descendants
+        # must not pile up under it while the parser is inside
+        f.write(' <Correlation type="HKCorrelationTypeIdentifierFood" sourceName="Synthetic">\n')
+        i = 0
+        while written < target // 10:
+            i += 1
+            d = time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(1_600_000_000 + i))
+            row = WIDE_RECORD.format(d=d, v=rng.randint(50, 180))
+            f.write(row)
+            written += len(row)
+        f.write(' </Correlation>\n')
+        i = 0
+        while written < target:
+            parts = []
+            for _ in range(1000):
+                i += 1
+                d = time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(1_600_000_000 + i * 60))
+                roll = rng.random()
+                if roll < 0.9:
+                    parts.append(RECORD.format(d=d, v=rng.randint(50, 180), m=rng.randint(0, 2)))
+                elif roll < 0.94:
+                    parts.append(CORRELATION.format(d=d))
+                elif roll < 0.97:
+                    parts.append(WORKOUT.format(d=d))
+                elif roll < 0.99:
+                    parts.append(ACTIVITY)
+                else:
+                    parts.append(CLINICAL.format(d=d, i=i))
+            chunk = " " + " ".join(parts)
+            f.write(chunk)
+            written += len(chunk)
+        f.write("</HealthData>\n")
+
+
+def _legacy(path: str):
+    for _, elem in ET.iterparse(path, events=("end",)):
+        if elem.tag in ("Record", "Workout", "ActivitySummary"):
+            yield elem
+        elem.clear()
+
+
+def child(mode: str, path: str):
+    started = time.perf_counter()
+    elements = 0
+    metadata = 0
+    iterator = _legacy(path) if mode == "legacy" else iter_export(path, parser=mode)
+    for elem in iterator:
+        elements += 1
+        metadata += sum(1 for c in elem if c.tag == "MetadataEntry")
+    elapsed = time.perf_counter() - started
+    peak_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print(f"{peak_kb} {elements} {metadata} {elapsed:.3f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Peak RSS of the export parser on a generated export")
+    parser.add_argument("--size-mb", type=int, default=2048, help="Size of the generated export.xml")
+    parser.add_argument("--max-rss-mb", type=float, default=150, help="Fail if a parser's peak RSS exceeds this")
+    parser.add_argument("--xml", help="Parse this file instead of generating one")
+    parser.add_argument("--skip-legacy", action="store_true", help="Do not run the old parsing loop")
+    parser.add_argument("--child", nargs=2, metavar=("MODE", "XML"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(*args.child)
+        return 0
+
+    tmpdir = None
+    path = args.xml
+    if path is None:
+        tmpdir = tempfile.TemporaryDirectory()
+        path = os.path.join(tmpdir.name, "export.xml")
+        started = time.perf_counter()
+        generate(path, args.size_mb)
+        print(f"generated {os.path.getsize(path) / 1048576:.0f} MB in {time.perf_counter() - started:.1f}s")
+
+    modes = ([] if args.skip_legacy else ["legacy"]) + ["stdlib"] + (["lxml"] if lxml_etree is not None else [])
+    failed = False
+    try:
+        for mode in modes:
+            out = subprocess.run([sys.executable, __file__, "--child", mode, path],
+                                 capture_output=True, text=True, check=True).stdout.split()
+            peak_mb = int(out[0]) / 1024
+            elements, metadata, elapsed = int(out[1]), int(out[2]), float(out[3])
+            over = mode != "legacy" and peak_mb > args.max_rss_mb
+            failed = failed or over
+            print(f"{mode:<7} peak_rss={peak_mb:8.1f}MB  elements={elements}  metadata={metadata}  "
+                  f"time={elapsed:6.1f}s  {os.path.getsize(path) / 1048576 / elapsed:6.1f}MB/s"
+                  f"{'  OVER LIMIT' if over else ''}")
+    finally:
+        if tmpdir is not None:
+            tmpdir.cleanup()
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,520 @@
+#!/usr/bin/env python3
+"""
+Monthly range partitioning and cold-data archival for health_record and metadata_entry.
+
+Both tables are partitioned by RANGE COLUMNS(start_date) into p_YYYYMM partitions
+plus a p_future catch-all, with identical bounds so a month can be archived as a
+unit. Partitions older than PARTITION_ARCHIVE_MONTHS are exported to zstd-compressed
+Parquet files under ARCHIVE_DIR, recorded in archived_partition and dropped.
+Readers call the archive helpers below to include archived ranges.
+
+Usage:
+    python3 partitions.py migrate     # one-off: convert existing tables
+    python3 partitions.py maintain    # add partitions ahead, archive old ones (cron, daily)
+    python3 partitions.py status
+"""
+import argparse
+import os
+import sys
+import threading
+import time
+from datetime import date, datetime
+from pathlib import Path
+from typing import List, Dict, Any, Optional, Tuple
+
+from database import cursor, fetch_all, fetch_scalar, execute, get_connection
+
+PARTITIONED_TABLES = ("health_record", "metadata_entry")
+# Partitions created beyond the current month
+MONTHS_AHEAD = int(os.getenv("PARTITION_MONTHS_AHEAD", "3"))
+# Months kept in MariaDB before a partition is archived (0 disables archival)
+ARCHIVE_MONTHS = int(os.getenv("PARTITION_ARCHIVE_MONTHS", "24"))
+ARCHIVE_DIR = Path(os.getenv("ARCHIVE_DIR", "archive"))
+# Rows per Parquet row group; files are sorted by (user_id, start_date) so
+# row-group statistics let filtered reads skip most of a file
+ROW_GROUP_SIZE = 65536
+
+# Export queries per table, run against the month's staging tables ({hr}, {me});
+# metadata rows carry their record's user_id so archived files can be filtered
+# without a join
+_EXPORT_SQL = {
+    # Lookup ids are decoded so archived files stand on their own
+    "health_record": """
+        SELECT hr.record_id, hr.user_id, t.name AS type, u.name AS unit, hr.value,
+               s.name AS source_name, NULLIF(s.version, '') AS source_version, d.name AS device,
+               hr.creation_date, hr.start_date, hr.end_date
+        FROM {hr} hr
+        LEFT JOIN record_type t ON t.type_id = hr.type_id
+        LEFT JOIN record_unit u ON u.unit_id = hr.unit_id
+        LEFT JOIN record_source s ON s.source_id = hr.source_id
+        LEFT JOIN record_device d ON d.device_id = hr.device_id
+        ORDER BY hr.user_id, hr.start_date
+    """,
+    "metadata_entry": """
+        SELECT me.metadata_id, me.record_id, hr.user_id, me.meta_key, me.meta_value, me.start_date
+        FROM {me} me
+        JOIN {hr} hr ON hr.record_id = me.record_id AND hr.start_date = me.start_date
+        ORDER BY hr.user_id, me.start_date
+    """,
+}
+
+
+# Rows each export query returns (metadata rows without their record are not exported)
+_COUNT_SQL = {
+    "health_record": "SELECT COUNT(*) FROM {hr}",
+    "metadata_entry": """
+        SELECT COUNT(*) FROM {me} me
+        JOIN {hr} hr ON hr.record_id = me.record_id AND hr.start_date = me.start_date
+    """,
+}
+
+
+def _arrow():
+    """Import pyarrow lazily; only archival and archived reads need it"""
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        raise RuntimeError("pyarrow is required for partition archival (pip install pyarrow)")
+    return pyarrow
+
+
+def _schema(table: str):
+    pa = _arrow()
+    if table == "health_record":
+        return pa.schema([
+            ("record_id", pa.int64()), ("user_id", pa.int32()), ("type", pa.string()),
+            ("unit", pa.string()), ("value", pa.decimal128(10, 4)), ("source_name", pa.string()),
+            ("source_version", pa.string()), ("device", pa.string()), ("creation_date", pa.timestamp("s")),
+            ("start_date", pa.timestamp("s")), ("end_date", pa.timestamp("s")),
+        ])
+    return pa.schema([
+        ("metadata_id", pa.int64()), ("record_id", pa.int64()), ("user_id", pa.int32()),
+        ("meta_key", pa.string()), ("meta_value", pa.string()), ("start_date", pa.timestamp("s")),
+    ])
+
+
+def _month_start(d: date) -> date:
+    return date(d.year, d.month, 1)
+
+
+def _add_months(d: date, months: int) -> date:
+    index = d.year * 12 + d.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def _partition_name(month: date) -> str:
+    return f"p_{month.year:04d}{month.month:02d}"
+
+
+def _partition_month(name: str) -> Optional[date]:
+    if not name.startswith("p_") or not name[2:].isdigit():
+        return None
+    return date(int(name[2:6]), int(name[6:8]), 1)
+
+
+def _stage_name(table: str, partition: str) -> str:
+    """Plain table a partition is swapped into while it is archived"""
+    return f"{table}_{partition}"
+
+
+def list_partitions(table: str) -> List[Dict[str, Any]]:
+    """Partitions of a table in bound order with approximate row counts"""
+    return fetch_all(
+        """
+        SELECT PARTITION_NAME AS name, PARTITION_DESCRIPTION AS bound, TABLE_ROWS AS approx_rows
+        FROM information_schema.PARTITIONS
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND PARTITION_NAME IS NOT NULL
+        ORDER BY PARTITION_ORDINAL_POSITION
+        """,
+        (table,), read=False
+    )
+
+
+def _create_months(table: str, months: List[date]):
+    """Split p_future into the given monthly partitions"""
+    defs = ", ".join(
+        f"PARTITION {_partition_name(m)} VALUES LESS THAN ('{_add_months(m, 1).isoformat()}')" for m in months
+    )
+    with cursor(commit=True, label="partitions.ensure") as cur:
+        cur.execute(
+            f"ALTER TABLE {table} REORGANIZE PARTITION p_future INTO "
+            f"({defs}, PARTITION p_future VALUES LESS THAN (MAXVALUE))"
+        )
+
+
+def ensure_partitions(table: str, months_ahead: int = MONTHS_AHEAD, today: Optional[date] = None) -> List[str]:
+    """Split p_future so monthly partitions exist up to `months_ahead` past this month
+
+    A table with only p_future starts at the month of the oldest health_record,
+    so health_record and metadata_entry always get the same bounds.
+    """
+    today = today or date.today()
+    months = [m for m in (_partition_month(p["name"]) for p in list_partitions(table)) if m]
+    if months:
+        month = _add_months(max(months), 1)
+    else:
+        oldest = fetch_scalar("SELECT MIN(start_date) FROM health_record", (), read=False)
+        month = _month_start(oldest.date() if oldest else today)
+    last = _add_months(_month_start(today), months_ahead)
+
+    new = []
+    while month <= last:
+        new.append(month)
+        month = _add_months(month, 1)
+    if new:
+        _create_months(table, new)
+    return [_partition_name(m) for m in new]
+
+
+def ensure_history(oldest: date) -> Dict[str, List[str]]:
+    """Split the first monthly partition so months back to `oldest` get their own
+
+    On a fresh database partitions start at the month `maintain` first ran,
+    so older imported history would otherwise all sit in the first partition
+    and never be pruned or archived by month. Months up to the newest
+    archived one are left in the first partition, where archive_month still
+    picks them up, so an archive file is never reused. The REORGANIZE copies
+    the first partition, so this runs from `maintain`, not after each import.
+    """
+    month = _month_start(oldest)
+    archived_end = fetch_scalar("SELECT MAX(range_end) FROM archived_partition", (), read=False)
+    if archived_end and month < archived_end:
+        month = _month_start(archived_end)
+    created = {}
+    for table in PARTITIONED_TABLES:
+        parts = list_partitions(table)
+        first = _partition_month(parts[0]["name"]) if parts else None
+        # Unpartitioned, or only p_future (ensure_partitions starts those at the oldest record)
+        if first is None or month >= first:
+            continue
+        months = []
+        m = month
+        while m < first:
+            months.append(m)
+            m = _add_months(m, 1)
+        defs = ", ".join(
+            f"PARTITION {_partition_name(m)} VALUES LESS THAN ('{_add_months(m, 1).isoformat()}')"
+            for m in months + [first]
+        )
+        with cursor(commit=True, label="partitions.history") as cur:
+            cur.execute(f"ALTER TABLE {table} REORGANIZE PARTITION {_partition_name(first)} INTO ({defs})")
+        created[table] = [_partition_name(m) for m in months]
+    return created
+
+
+def _export_partition(table: str, partition: str, path: Path) -> int:
+    """Stream one staged partition into a Parquet file; returns the row count"""
+    pa = _arrow()
+    schema = _schema(table)
+    names = schema.names
+    tmp = path.with_suffix(".parquet.tmp")
+    path.parent.mkdir(parents=True, exist_ok=True)
+
+    rows = 0
+    cnx = get_connection()
+    try:
+        # Unbuffered: rows are fetched from the server as they are written out
+        cur = cnx.cursor()
+        cur.execute(_EXPORT_SQL[table].format(hr=_stage_name("health_record", partition),
+                                              me=_stage_name("metadata_entry", partition)))
+        with pa.parquet.ParquetWriter(str(tmp), schema, compression="zstd") as writer:
+            while True:
+                batch = cur.fetchmany(ROW_GROUP_SIZE)
+                if not batch:
+                    break
+                columns = list(zip(*batch))
+                writer.write_table(pa.table({n: pa.array(columns[i], type=schema.field(n).type)
+                                             for i, n in enumerate(names)}, schema=schema))
+                rows += len(batch)
+        cur.close()
+    finally:
+        cnx.close()
+    os.replace(tmp, path)
+    return rows
+
+
+def _detach_month(partition: str):
+    """Swap the month's partition of both tables into staging tables and drop it
+
+    Both tables are write-locked for the swap, which only moves metadata, so
+    no import can commit rows into the partition between the export and the
+    drop: later rows for the month land in the next partition instead. A
+    staging table left with rows by an interrupted run gets the partition's
+    rows appended rather than swapped.
+    """
+    stages = {t: _stage_name(t, partition) for t in PARTITIONED_TABLES}
+    for table, stage in stages.items():
+        execute(f"CREATE TABLE IF NOT EXISTS {stage} LIKE {table}", ())
+        if list_partitions(stage):
+            execute(f"ALTER TABLE {stage} REMOVE PARTITIONING", ())
+    with cursor(commit=True, label="partitions.detach") as cur:
+        cur.execute("LOCK TABLES " + ", ".join(f"{t} WRITE, {s} WRITE" for t, s in stages.items()))
+        try:
+            for table, stage in stages.items():
+                cur.execute(f"SELECT 1 FROM {stage} LIMIT 1")
+                if cur.fetchone() is None:
+                    cur.execute(f"ALTER TABLE {table} EXCHANGE PARTITION {partition} WITH TABLE {stage}")
+                else:
+                    cur.execute(f"INSERT INTO {stage} SELECT * FROM {table} PARTITION ({partition})")
+                cur.execute(f"ALTER TABLE {table} DROP PARTITION {partition}")
+        finally:
+            cur.execute("UNLOCK TABLES")
+
+
+def _staged_months() -> List[date]:
+    """Months whose staging tables an interrupted archive run left behind"""
+    rows = fetch_all(
+        "SELECT TABLE_NAME AS name FROM information_schema.TABLES "
+        "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME LIKE 'health\\_record\\_p\\_%%'",
+        (), read=False
+    )
+    return sorted(m for m in (_partition_month(r["name"][len("health_record_"):]) for r in rows) if m)
+
+
+def archive_month(month: date) -> Dict[str, int]:
+    """Detach the month's partition of both tables, export it, record it, then drop the staging tables
+
+    Resumes from the staging tables when the partition was already detached.
+    """
+    partition = _partition_name(month)
+    if any(p["name"] == partition for p in list_partitions("health_record")):
+        _detach_month(partition)
+    hr, me = _stage_name("health_record", partition), _stage_name("metadata_entry", partition)
+    range_end = _add_months(month, 1)
+    # The oldest partition also holds anything imported for already-archived months
+    oldest = fetch_scalar(f"SELECT MIN(start_date) FROM {hr}", (), read=False)
+    range_start = min(month, oldest.date()) if oldest else month
+    counts = {}
+    for table in ("metadata_entry", "health_record"):
+        path = ARCHIVE_DIR / table / f"{partition}.parquet"
+        expected = fetch_scalar(_COUNT_SQL[table].format(hr=hr, me=me), (), read=False)
+        if table == "metadata_entry":
+            total = fetch_scalar(f"SELECT COUNT(*) FROM {me}", (), read=False)
+            if total != expected:
+                print(f"metadata_entry {partition}: dropping {total - expected} rows without a health_record")
+        written = _export_partition(table, partition, path)
+        if written != expected:
+            raise RuntimeError(f"{table} {partition}: exported {written} rows, expected {expected}")
+        counts[table] = written
+        execute(
+            """
+            INSERT INTO archived_partition (table_name, partition_name, range_start, range_end, path, row_count)
+            VALUES (%s, %s, %s, %s, %s, %s)
+            ON DUPLICATE KEY UPDATE range_start = LEAST(range_start, VALUES(range_start)),
+                                    path = VALUES(path), row_count = VALUES(row_count), archived_at = NOW()
+            """,
+            (table, partition, range_start, range_end, str(path), written)
+        )
+    for stage in (me, hr):
+        execute(f"DROP TABLE {stage}", ())
+    _archive_cache.clear()
+    return counts
+
+
+def archive_old(months: int = ARCHIVE_MONTHS, today: Optional[date] = None) -> List[str]:
+    """Archive every monthly partition that ends before the cutoff"""
+    if months <= 0:
+        return []
+    cutoff = _add_months(_month_start(today or date.today()), -months)
+    archived = []
+    for month in _staged_months():
+        counts = archive_month(month)
+        print(f"Archived {_partition_name(month)} (resumed): {counts}")
+        archived.append(_partition_name(month))
+    for p in list_partitions("health_record"):
+        month = _partition_month(p["name"])
+        if month is None:
+            continue
+        if _add_months(month, 1) > cutoff:
+            break
+        counts = archive_month(month)
+        print(f"Archived {p['name']}: {counts}")
+        archived.append(p["name"])
+    return archived
+
+
+class _ArchiveCache:
+    """archived_partition rows, refreshed at most once a minute"""
+
+    def __init__(self, ttl: float = 60.0):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._rows: List[Dict[str, Any]] = []
+        self._loaded_at = 0.0
+
+    def rows(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            if time.monotonic() - self._loaded_at > self.ttl:
+                self._rows = fetch_all(
+                    "SELECT table_name, partition_name, range_start, range_end, path FROM archived_partition",
+                    ()
+                )
+                self._loaded_at = time.monotonic()
+            return self._rows
+
+    def clear(self):
+        with self._lock:
+            self._loaded_at = 0.0
+
+
+_archive_cache = _ArchiveCache()
+
+
+def _as_datetime(value) -> datetime:
+    if isinstance(value, datetime):
+        return value.replace(tzinfo=None)
+    if isinstance(value, date):
+        return datetime(value.year, value.month, value.day)
+    return datetime.fromisoformat(str(value))
+
+
+def archived_files(table: str, start, end) -> List[str]:
+    """Archive files of `table` whose range overlaps [start, end)"""
+    try:
+        rows = _archive_cache.rows()
+    except Exception as e:
+        # Table missing on databases that were never migrated
+        print(f"Could not read archived_partition: {e}")
+        return []
+    start, end = _as_datetime(start), _as_datetime(end)
+    return [r["path"] for r in rows
+            if r["table_name"] == table
+            and _as_datetime(r["range_start"]) < end and _as_datetime(r["range_end"]) > start]
+
+
+def read_archived(table: str, user_id: int, start, end, columns: List[str],
+                  filters: Optional[List[Tuple[str, str, Any]]] = None) -> List[Dict[str, Any]]:
+    """Rows of a user's archived data in [start, end), as dicts (empty when nothing is archived)"""
+    paths = archived_files(table, start, end)
+    if not paths:
+        return []
+    pa = _arrow()
+    predicate = [("user_id", "=", user_id),
+                 ("start_date", ">=", _as_datetime(start)),
+                 ("start_date", "<", _as_datetime(end))] + list(filters or [])
+    rows: List[Dict[str, Any]] = []
+    for path in paths:
+        rows.extend(pa.parquet.read_table(path, columns=columns, filters=predicate).to_pylist())
+    return rows
+
+
+def purge_user(user_id: int) -> int:
+    """Rewrite archive files without a deleted user's rows; returns rows removed"""
+    files = fetch_all("SELECT table_name, partition_name, path FROM archived_partition", (), read=False)
+    if not files:
+        return 0
+    pa = _arrow()
+    import pyarrow.compute as pc
+    removed = 0
+    for f in files:
+        path = Path(f["path"])
+        if not path.exists():
+            continue
+        data = pa.parquet.read_table(str(path))
+        keep = data.filter(pc.not_equal(data["user_id"], user_id))
+        if keep.num_rows == data.num_rows:
+            continue
+        tmp = path.with_suffix(".parquet.tmp")
+        pa.parquet.write_table(keep, str(tmp), compression="zstd", row_group_size=ROW_GROUP_SIZE)
+        os.replace(tmp, path)
+        removed += data.num_rows - keep.num_rows
+        execute("UPDATE archived_partition SET row_count = %s WHERE table_name = %s AND partition_name = %s",
+                (keep.num_rows, f["table_name"], f["partition_name"]))
+    return removed
+
+
+def _foreign_keys(table: str) -> List[str]:
+    rows = fetch_all(
+        """
+        SELECT CONSTRAINT_NAME AS name FROM information_schema.REFERENTIAL_CONSTRAINTS
+        WHERE CONSTRAINT_SCHEMA = DATABASE() AND TABLE_NAME = %s
+        """,
+        (table,), read=False
+    )
+    return [r["name"] for r in rows]
+
+
+def migrate(batch_size: int = 50000):
+    """Convert unpartitioned tables from an older schema (idempotent)"""
+    if list_partitions("health_record"):
+        print("health_record is already partitioned")
+        return
+
+    columns = {r["name"] for r in fetch_all(
+        "SELECT COLUMN_NAME AS name FROM information_schema.COLUMNS "
+        "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'metadata_entry'", (), read=False)}
+    if "start_date" not in columns:
+        execute("ALTER TABLE metadata_entry ADD COLUMN start_date DATETIME NULL", ())
+
+    execute("UPDATE health_record SET start_date = COALESCE(creation_date, '1970-01-01') "
+            "WHERE start_date IS NULL", ())
+    # Copy start_date onto metadata rows in primary-key batches
+    last = 0
+    top = fetch_scalar("SELECT MAX(metadata_id) FROM metadata_entry", (), read=False) or 0
+    while last < top:
+        execute(
+            """
+            UPDATE metadata_entry me JOIN health_record hr ON hr.record_id = me.record_id
+            SET me.start_date = hr.start_date
+            WHERE me.metadata_id > %s AND me.metadata_id <= %s
+            """,
+            (last, last + batch_size)
+        )
+        last += batch_size
+    execute("UPDATE metadata_entry SET start_date = '1970-01-01' WHERE start_date IS NULL", ())
+
+    # Partitioned InnoDB tables cannot have foreign keys
+    for table in ("metadata_entry", "health_record"):
+        for fk in _foreign_keys(table):
+            execute(f"ALTER TABLE {table} DROP FOREIGN KEY {fk}", ())
+
+    with cursor(commit=True, label="partitions.migrate") as cur:
+        cur.execute("ALTER TABLE health_record MODIFY start_date DATETIME NOT NULL, "
+                    "DROP PRIMARY KEY, ADD PRIMARY KEY (record_id, start_date)")
+        cur.execute("ALTER TABLE metadata_entry MODIFY start_date DATETIME NOT NULL, "
+                    "DROP PRIMARY KEY, ADD PRIMARY KEY (metadata_id, start_date), "
+                    "ADD INDEX idx_metadata_record (record_id)")
+        for table in PARTITIONED_TABLES:
+            cur.execute(f"ALTER TABLE {table} PARTITION BY RANGE COLUMNS(start_date) "
+                        f"(PARTITION p_future VALUES LESS THAN (MAXVALUE))")
+
+    for table in PARTITIONED_TABLES:
+        ensure_partitions(table)
+    print("Migration complete")
+
+
+def maintain():
+    """Keep both tables' partitions ahead of time, split off imported history, then archive cold months"""
+    for table in PARTITIONED_TABLES:
+        created = ensure_partitions(table)
+        if created:
+            print(f"{table}: added {', '.join(created)}")
+    # Oldest day any import touched (data_change has one row per import)
+    oldest = fetch_scalar("SELECT MIN(first_day) FROM data_change", (), read=False)
+    if oldest:
+        for table, names in ensure_history(oldest).items():
+            print(f"{table}: added {', '.join(names)} for imported history")
+    archive_old()
+
+
+def status():
+    for table in PARTITIONED_TABLES:
+        parts = list_partitions(table)
+        print(f"{table}: {len(parts)} partitions")
+        for p in parts:
+            print(f"  {p['name']:<10} < {p['bound']:<24} ~{p['approx_rows']} rows")
+    for row in fetch_all("SELECT * FROM archived_partition ORDER BY range_end, table_name", (), read=False):
+        print(f"archived {row['table_name']} {row['partition_name']}: {row['row_count']} rows -> {row['path']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Partition maintenance and archival")
+    parser.add_argument("command", choices=("migrate", "maintain", "status"))
+    args = parser.parse_args()
+    {"migrate": migrate, "maintain": maintain, "status": status}[args.command]()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
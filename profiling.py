@@ -0,0 +1,279 @@
+# On-demand stack sampling and per-request cProfile, for admins diagnosing slow endpoints
+import cProfile
+import functools
+import hmac
+import inspect
+import io
+import os
+import pstats
+import sys
+import threading
+import time
+import uuid
+from collections import Counter, OrderedDict
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from fastapi.routing import APIRoute
+
+# Admin token for the profiling endpoints and X-Profile header; unset disables
+# profiling entirely (no middleware, no wrappers)
+PROFILING_TOKEN = os.getenv("PROFILING_TOKEN", "")
+ENABLED = bool(PROFILING_TOKEN)
+MAX_SAMPLE_SECONDS = float(os.getenv("PROFILING_MAX_SECONDS", "60"))
+# Request profiles kept for GET /api/admin/profile/requests/{id}
+KEEP_REQUEST_PROFILES = 20
+# Lines of each request's summary printed to the log
+LOG_SUMMARY_LINES = 15
+
+# Leaf frames of threads parked waiting for work: the event loop in select(),
+# threadpool workers on their queue
+_IDLE_LEAVES = {
+    ("selectors.py", "select"),
+    ("threading.py", "wait"),
+    ("threading.py", "_wait_for_tstate_lock"),
+    ("queue.py", "get"),
+}
+
+
+class ProfilerBusy(Exception):
+    """Another sampling session or profiled request is already running"""
+
+
+def check_token(token: Optional[str]) -> bool:
+    return ENABLED and token is not None and hmac.compare_digest(token, PROFILING_TOKEN)
+
+
+class StackSampler:
+    """Statistical profiler: samples every thread's Python stack at a fixed interval
+
+    Stacks are counted in the collapsed format flamegraph.pl, speedscope and
+    inferno read ("root;caller;callee count"), rooted at the thread name.
+    Nothing is installed in the profiled threads, so the cost is one
+    sys._current_frames() walk per tick on the sampling thread, and only
+    while a session runs.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+
+    def sample(self, seconds: float, interval_ms: float = 10.0,
+               include_idle: bool = False) -> Tuple[str, Dict[str, Any]]:
+        """Sample for `seconds` on the calling thread; returns (collapsed stacks, stats)"""
+        if not self._lock.acquire(blocking=False):
+            raise ProfilerBusy("A sampling session is already running")
+        try:
+            return self._run(min(seconds, MAX_SAMPLE_SECONDS), max(interval_ms, 1.0) / 1000.0, include_idle)
+        finally:
+            self._lock.release()
+
+    def _run(self, seconds: float, interval: float, include_idle: bool) -> Tuple[str, Dict[str, Any]]:
+        me = threading.get_ident()
+        labels: Dict[Any, str] = {}
+        counts: Counter = Counter()
+        names: Dict[int, str] = {}
+        ticks = 0
+        start = time.perf_counter()
+        deadline = start + seconds
+        next_tick = start
+        while True:
+            now = time.perf_counter()
+            if now >= deadline:
+                break
+            if ticks % 100 == 0:
+                names = {t.ident: t.name.replace(";", ":") for t in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                code = frame.f_code
+                if not include_idle and (os.path.basename(code.co_filename), code.co_name) in _IDLE_LEAVES:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    label = labels.get(code)
+                    if label is None:
+                        label = labels[code] = (f"{code.co_name} "
+                                                f"({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    stack.append(label)
+                    frame = frame.f_back
+                stack.append(names.get(ident, f"thread-{ident}"))
+                counts[";".join(reversed(stack))] += 1
+            ticks += 1
+            next_tick += interval
+            time.sleep(max(0.0, next_tick - time.perf_counter()))
+        elapsed = time.perf_counter() - start
+        collapsed = "".join(f"{stack} {count}\n" for stack, count in counts.most_common())
+        return collapsed, {
+            "pid": os.getpid(),
+            "seconds": round(elapsed, 3),
+            "ticks": ticks,
+            "samples": sum(counts.values()),
+            "stacks": len(counts),
+        }
+
+
+class RequestProfile:
+    """cProfile data of one request: the event loop thread plus every wrapped worker-thread call"""
+
+    def __init__(self, method: str, path: str):
+        self.profile_id = uuid.uuid4().hex[:12]
+        self.method = method
+        self.path = path
+        self.started_at = time.time()
+        self.total_ms: Optional[float] = None
+        self._profiles: List[cProfile.Profile] = []
+        self._lock = threading.Lock()
+
+    def add(self, profile: cProfile.Profile):
+        with self._lock:
+            self._profiles.append(profile)
+
+    def summary(self, sort: str = "cumulative", limit: int = 40) -> str:
+        out = io.StringIO()
+        with self._lock:
+            profiles = list(self._profiles)
+        if not profiles:
+            return "No profile data\n"
+        out.write(f"{self.method} {self.path}  {self.total_ms or 0:.1f} ms\n")
+        pstats.Stats(*profiles, stream=out).sort_stats(sort).print_stats(limit)
+        return out.getvalue()
+
+    def info(self) -> Dict[str, Any]:
+        return {"profile_id": self.profile_id, "method": self.method, "path": self.path,
+                "started_at": self.started_at, "total_ms": self.total_ms}
+
+
+_current: ContextVar[Optional[RequestProfile]] = ContextVar("request_profile", default=None)
+# Whether this thread already has a cProfile enabled (only one can be per thread)
+_thread_state = threading.local()
+
+
+def profiled(func: Callable) -> Callable:
+    """Wrap a function that runs on a worker thread so a profiled request also covers it
+
+    cProfile only sees the thread it was enabled on, so each call made for a
+    profiled request enables its own profiler and hands it to the request.
+    Returns `func` unchanged when profiling is off.
+    """
+    if not ENABLED:
+        return func
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        request = _current.get()
+        if request is None or getattr(_thread_state, "active", False):
+            return func(*args, **kwargs)
+        profile = cProfile.Profile()
+        _thread_state.active = True
+        profile.enable()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            profile.disable()
+            _thread_state.active = False
+            request.add(profile)
+    return wrapper
+
+
+def instrument(app) -> int:
+    """Wrap the sync endpoints and dependencies of `app` with `profiled`; returns how many"""
+    if not ENABLED:
+        return 0
+    wrapped: Dict[Callable, Callable] = {}
+
+    def visit(dependant):
+        for sub in dependant.dependencies:
+            visit(sub)
+        call = dependant.call
+        # Only plain functions: FastAPI runs those on the threadpool; async ones run on the profiled loop
+        if not inspect.isfunction(call) or inspect.iscoroutinefunction(call) \
+                or inspect.isgeneratorfunction(call) or inspect.isasyncgenfunction(call):
+            return
+        if call not in wrapped:
+            wrapped[call] = profiled(call)
+        dependant.call = wrapped[call]
+
+    for route in app.routes:
+        if isinstance(route, APIRoute):
+            visit(route.dependant)
+    return len(wrapped)
+
+
+class RequestProfiles:
+    """The most recent request profiles, by id"""
+
+    def __init__(self, keep: int = KEEP_REQUEST_PROFILES):
+        self.keep = keep
+        self._profiles: "OrderedDict[str, RequestProfile]" = OrderedDict()
+        self._lock = threading.Lock()
+        # One profiled request at a time: the event loop thread has a single profiler slot
+        self.running = threading.Lock()
+
+    def add(self, profile: RequestProfile):
+        with self._lock:
+            self._profiles[profile.profile_id] = profile
+            while len(self._profiles) > self.keep:
+                self._profiles.popitem(last=False)
+
+    def get(self, profile_id: str) -> Optional[RequestProfile]:
+        with self._lock:
+            return self._profiles.get(profile_id)
+
+    def list(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            return [p.info() for p in reversed(self._profiles.values())]
+
+
+class ProfileMiddleware:
+    """Pure ASGI middleware profiling requests sent with `X-Profile: 1` and a valid `X-Admin-Token`
+
+    The summary is printed to the log and kept in `request_profiles`; the
+    response carries its id in `X-Profile-Id`. The event loop part of the
+    profile also includes other requests served concurrently.
+    Only added to the app when PROFILING_TOKEN is set.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        headers = dict(scope.get("headers") or ())
+        if not headers.get(b"x-profile") or not check_token(headers.get(b"x-admin-token", b"").decode("latin-1")):
+            await self.app(scope, receive, send)
+            return
+        if not request_profiles.running.acquire(blocking=False):
+            await self.app(scope, receive, self._tag(send, b"busy"))
+            return
+        request = RequestProfile(scope["method"], scope["path"])
+        token = _current.set(request)
+        loop_profile = cProfile.Profile()
+        _thread_state.active = True
+        start = time.perf_counter()
+        loop_profile.enable()
+        try:
+            await self.app(scope, receive, self._tag(send, request.profile_id.encode()))
+        finally:
+            loop_profile.disable()
+            _thread_state.active = False
+            _current.reset(token)
+            request_profiles.running.release()
+            request.total_ms = (time.perf_counter() - start) * 1000
+            request.add(loop_profile)
+            request_profiles.add(request)
+            print(f"Profiled request {request.profile_id}:\n{request.summary(limit=LOG_SUMMARY_LINES)}")
+
+    @staticmethod
+    def _tag(send, value: bytes):
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                message["headers"] = list(message.get("headers", [])) + [(b"x-profile-id", value)]
+            await send(message)
+        return send_wrapper
+
+
+stack_sampler = StackSampler()
+request_profiles = RequestProfiles()
@@ -15,32 +15,96 @@ CREATE TABLE user (
     user_id INT AUTO_INCREMENT PRIMARY KEY,
     username VARCHAR(100) UNIQUE NOT NULL,
     name VARCHAR(100),
-    password VARCHAR(255) NOT NULL
+    password VARCHAR(255) NOT NULL,
+    birth_date DATE  -- from the export's <Me> element, for age cohorts
 );
 
+-- Lookup tables for the repeated strings of health_record (ids interned by transfer.py;
+-- binary collation so names differing only in case get their own ids)
+CREATE TABLE record_type (
+    type_id SMALLINT UNSIGNED AUTO_INCREMENT PRIMARY KEY,
+    name VARCHAR(255) CHARACTER SET utf8mb4 COLLATE utf8mb4_bin NOT NULL,
+    UNIQUE KEY uq_record_type_name (name)
+);
+
+CREATE TABLE record_unit (
+    unit_id SMALLINT UNSIGNED AUTO_INCREMENT PRIMARY KEY,
+    name VARCHAR(50) CHARACTER SET utf8mb4 COLLATE utf8mb4_bin NOT NULL,
+    UNIQUE KEY uq_record_unit_name (name)
+);
+
+-- version is '' when the export has none, so (name, version) stays unique
+CREATE TABLE record_source (
+    source_id INT UNSIGNED AUTO_INCREMENT PRIMARY KEY,
+    name VARCHAR(255) CHARACTER SET utf8mb4 COLLATE utf8mb4_bin NOT NULL,
+    version VARCHAR(50) CHARACTER SET utf8mb4 COLLATE utf8mb4_bin NOT NULL DEFAULT '',
+    UNIQUE KEY uq_record_source (name, version)
+);
+
+-- Device strings are long, so uniqueness is enforced on their MD5
+CREATE TABLE record_device (
+    device_id INT UNSIGNED AUTO_INCREMENT PRIMARY KEY,
+    name TEXT NOT NULL,
+    name_hash BINARY(16) NOT NULL,
+    UNIQUE KEY uq_record_device_hash (name_hash)
+);
+
+-- Fixed ids the health_record trigger compares against
+INSERT INTO record_type (type_id, name) VALUES
+(1, 'HKQuantityTypeIdentifierHeartRateVariabilitySDNN'),
+(2, 'HKQuantityTypeIdentifierHeartRate');
+
 -- Create HEALTH_RECORD table
 CREATE TABLE health_record (
-    record_id BIGINT AUTO_INCREMENT PRIMARY KEY,
+    record_id BIGINT AUTO_INCREMENT,
     user_id INT,
-    type VARCHAR(255),
-    unit VARCHAR(50),
+    type_id SMALLINT UNSIGNED,
+    unit_id SMALLINT UNSIGNED,
     value DECIMAL(10,4),
-    source_name VARCHAR(255),
-    source_version VARCHAR(50),
-    device TEXT,
+    source_id INT UNSIGNED,
+    device_id INT UNSIGNED,
     creation_date DATETIME,
-    start_date DATETIME,
+    start_date DATETIME NOT NULL,
     end_date DATETIME,
-    FOREIGN KEY (user_id) REFERENCES user(user_id)
-);
+    PRIMARY KEY (record_id, start_date)
+)
+-- Monthly partitions are added ahead of time by partitions.py (partitioned
+-- tables cannot have foreign keys, so user_id/record_id are not constrained)
+PARTITION BY RANGE COLUMNS(start_date) (PARTITION p_future VALUES LESS THAN (MAXVALUE));
 
--- Create METADATA_ENTRY table
+-- Create METADATA_ENTRY table (start_date copied from the record so it partitions with it)
 CREATE TABLE metadata_entry (
-    metadata_id BIGINT AUTO_INCREMENT PRIMARY KEY,
+    metadata_id BIGINT AUTO_INCREMENT,
     record_id BIGINT,
     meta_key VARCHAR(255),
     meta_value VARCHAR(255),
-    FOREIGN KEY (record_id) REFERENCES health_record(record_id)
+    start_date DATETIME NOT NULL,
+    PRIMARY KEY (metadata_id, start_date),
+    INDEX idx_metadata_record (record_id)
+)
+PARTITION BY RANGE COLUMNS(start_date) (PARTITION p_future VALUES LESS THAN (MAXVALUE));
+
+-- health_record with its strings decoded, for ad-hoc queries and archival
+CREATE VIEW health_record_named AS
+SELECT hr.record_id, hr.user_id, hr.type_id, t.name AS type, u.name AS unit, hr.value,
+       s.name AS source_name, NULLIF(s.version, '') AS source_version, d.name AS device,
+       hr.creation_date, hr.start_date, hr.end_date
+FROM health_record hr
+LEFT JOIN record_type t ON t.type_id = hr.type_id
+LEFT JOIN record_unit u ON u.unit_id = hr.unit_id
+LEFT JOIN record_source s ON s.source_id = hr.source_id
+LEFT JOIN record_device d ON d.device_id = hr.device_id;
+
+-- Create ARCHIVED_PARTITION table (partitions exported to Parquet by partitions.py)
+CREATE TABLE archived_partition (
+    table_name VARCHAR(64) NOT NULL,
+    partition_name VARCHAR(64) NOT NULL,
+    range_start DATE NOT NULL,
+    range_end DATE NOT NULL,
+    path VARCHAR(512) NOT NULL,
+    row_count BIGINT NOT NULL,
+    archived_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (table_name, partition_name)
 );
 
 -- Create HEALTH_SAMPLE table
@@ -87,6 +151,32 @@ CREATE TABLE workout (
     FOREIGN KEY (user_id) REFERENCES user(user_id)
 );
 
+-- Create WORKOUT_ROUTE table (GPX track summary, parsed by transfer.py)
+CREATE TABLE workout_route (
+    workout_id BIGINT PRIMARY KEY,
+    user_id INT NOT NULL,
+    point_count INT NOT NULL,
+    distance_m DECIMAL(10,1) NOT NULL,
+    min_lat DECIMAL(9,6) NOT NULL,
+    min_lon DECIMAL(9,6) NOT NULL,
+    max_lat DECIMAL(9,6) NOT NULL,
+    max_lon DECIMAL(9,6) NOT NULL,
+    start_time DATETIME,
+    end_time DATETIME,
+    FOREIGN KEY (workout_id) REFERENCES workout(workout_id)
+);
+
+-- Create WORKOUT_ROUTE_LEVEL table (encoded polyline per Douglas-Peucker tolerance; level 0 is the full track)
+CREATE TABLE workout_route_level (
+    workout_id BIGINT NOT NULL,
+    level TINYINT UNSIGNED NOT NULL,
+    tolerance_m DECIMAL(6,1) NOT NULL,
+    point_count INT NOT NULL,
+    polyline MEDIUMTEXT CHARACTER SET ascii COLLATE ascii_bin NOT NULL,
+    PRIMARY KEY (workout_id, level),
+    FOREIGN KEY (workout_id) REFERENCES workout_route(workout_id)
+);
+
 -- Create ACTIVITY_SUMMARY table
 CREATE TABLE activity_summary (
     summary_id BIGINT AUTO_INCREMENT PRIMARY KEY,
@@ -120,11 +210,131 @@ CREATE TABLE chat_messages (
     FOREIGN KEY (chat_id) REFERENCES chats(chat_id) ON DELETE CASCADE
 );
 
+-- Create ANOMALY_STATE table (per-user EWMA baseline of each metric, updated by transfer.py)
+CREATE TABLE anomaly_state (
+    state_id INT AUTO_INCREMENT PRIMARY KEY,
+    user_id INT NOT NULL,
+    metric VARCHAR(32) NOT NULL,
+    n BIGINT NOT NULL,
+    mean DOUBLE NOT NULL,
+    var DOUBLE NOT NULL,
+    last_ts DATETIME NOT NULL,
+    updated_at DATETIME DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+    UNIQUE KEY uq_anomaly_state (user_id, metric),
+    FOREIGN KEY (user_id) REFERENCES user(user_id)
+);
+
+-- Create ANOMALY_EVENT table (one row per user, metric, day and direction)
+CREATE TABLE anomaly_event (
+    event_id BIGINT AUTO_INCREMENT PRIMARY KEY,
+    user_id INT NOT NULL,
+    metric VARCHAR(32) NOT NULL,
+    day DATE NOT NULL,
+    direction ENUM('high', 'low') NOT NULL,
+    first_at DATETIME NOT NULL,
+    value DECIMAL(10,4),
+    baseline DOUBLE NOT NULL,
+    stddev DOUBLE NOT NULL,
+    z_score DOUBLE NOT NULL,
+    readings INT NOT NULL DEFAULT 1,
+    created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+    UNIQUE KEY uq_anomaly_event (user_id, metric, day, direction),
+    INDEX idx_anomaly_event_user_day (user_id, day),
+    FOREIGN KEY (user_id) REFERENCES user(user_id)
+);
+
+-- Create SLEEP_SESSION table (nights rebuilt from sleep-stage records by sleep.py)
+CREATE TABLE sleep_session (
+    session_id BIGINT AUTO_INCREMENT PRIMARY KEY,
+    user_id INT NOT NULL,
+    night DATE NOT NULL,
+    in_bed_start DATETIME NOT NULL,
+    in_bed_end DATETIME NOT NULL,
+    onset DATETIME NOT NULL,
+    wake DATETIME NOT NULL,
+    asleep_min DECIMAL(6,1) NOT NULL,
+    awake_min DECIMAL(6,1) NOT NULL,
+    in_bed_min DECIMAL(6,1) NOT NULL,
+    core_min DECIMAL(6,1) NOT NULL,
+    deep_min DECIMAL(6,1) NOT NULL,
+    rem_min DECIMAL(6,1) NOT NULL,
+    unspecified_min DECIMAL(6,1) NOT NULL,
+    efficiency DECIMAL(4,3),
+    UNIQUE KEY uq_sleep_session (user_id, in_bed_start),
+    INDEX idx_sleep_session_user_night (user_id, night),
+    FOREIGN KEY (user_id) REFERENCES user(user_id)
+);
+
+-- Create COHORT_PERCENTILE table (per age band and metric, rebuilt nightly by cohorts.py)
+CREATE TABLE cohort_percentile (
+    cohort VARCHAR(16) NOT NULL,
+    metric VARCHAR(32) NOT NULL,
+    users INT NOT NULL,
+    p10 DOUBLE NOT NULL,
+    p25 DOUBLE NOT NULL,
+    p50 DOUBLE NOT NULL,
+    p75 DOUBLE NOT NULL,
+    p90 DOUBLE NOT NULL,
+    quantiles TEXT NOT NULL,  -- JSON array of the 0th..100th percentiles
+    computed_at DATETIME NOT NULL,
+    PRIMARY KEY (cohort, metric)
+);
+
+-- Create USER_PERCENTILE table (each user's value and rank within their cohort)
+CREATE TABLE user_percentile (
+    percentile_id BIGINT AUTO_INCREMENT PRIMARY KEY,
+    user_id INT NOT NULL,
+    metric VARCHAR(32) NOT NULL,
+    value DOUBLE NOT NULL,
+    days INT NOT NULL,
+    cohort VARCHAR(16) NOT NULL,
+    percentile DECIMAL(4,1) NOT NULL,
+    computed_at DATETIME NOT NULL,
+    UNIQUE KEY uq_user_percentile (user_id, metric),
+    FOREIGN KEY (user_id) REFERENCES user(user_id)
+);
+
+-- Create DATA_CHANGE table (one row per import; change_id is the user's data version for delta sync)
+CREATE TABLE data_change (
+    change_id BIGINT AUTO_INCREMENT PRIMARY KEY,
+    user_id INT NOT NULL,
+    first_day DATE NOT NULL,
+    last_day DATE NOT NULL,
+    created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+    INDEX idx_data_change_user (user_id, change_id),
+    FOREIGN KEY (user_id) REFERENCES user(user_id)
+);
+
+-- Create USER_DELETION_JOB table (background account deletion progress)
+CREATE TABLE user_deletion_job (
+    job_id VARCHAR(36) PRIMARY KEY,
+    user_id INT NOT NULL,
+    status ENUM('queued', 'running', 'done', 'failed') NOT NULL,
+    phase VARCHAR(50),
+    rows_deleted BIGINT NOT NULL DEFAULT 0,
+    error TEXT,
+    owner VARCHAR(64),
+    created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+    updated_at DATETIME DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+    finished_at DATETIME,
+    INDEX idx_user_deletion_status (status, created_at)
+);
+
 -- Create indexes for performance
 CREATE INDEX idx_hrv_user_date ON hrv(user_id, start_date);
 CREATE INDEX idx_workout_user_date ON workout(user_id, start_date);
 CREATE INDEX idx_activity_user_date ON activity_summary(user_id, date);
 CREATE INDEX idx_health_record_user_date ON health_record(user_id, start_date);
+CREATE INDEX idx_health_record_user_type_date ON health_record(user_id, type_id, start_date);
+-- Keyset scans of one user's rows in primary-key order (user_deletion.py)
+CREATE INDEX idx_health_sample_user ON health_sample(user_id, sample_id);
+CREATE INDEX idx_hrv_user ON hrv(user_id, hrv_id);
+CREATE INDEX idx_activity_user ON activity_summary(user_id, summary_id);
+CREATE INDEX idx_workout_user ON workout(user_id, workout_id);
+CREATE INDEX idx_chats_user ON chats(user_id, updated_at);
+
+-- Full-text index for chat history search (/api/chat/search)
+CREATE FULLTEXT INDEX ft_chat_messages_content ON chat_messages(content);
 
 -- ============================================
 -- 2. INSERT STATEMENTS (Sample Data)
@@ -136,14 +346,18 @@ VALUES
 ('havok', 'Akshay', '88d4266fd4e6338d13b845fcf289579d209c897823b9217da3e161936f031589'),
 ('john_doe', 'John Doe', '5e884898da28047151d0e56f8dc6292773603d0d6aabbdd62a11ef721d1542d8');
 
--- Insert sample health records
-INSERT INTO health_record (user_id, type, unit, value, source_name, device, creation_date, start_date, end_date)
+-- Insert sample health records (type 1 = HRV SDNN, 2 = heart rate)
+INSERT INTO record_unit (unit_id, name) VALUES (1, 'ms'), (2, 'count/min');
+INSERT INTO record_source (source_id, name) VALUES (1, 'Apple Watch');
+INSERT INTO record_device (device_id, name, name_hash) VALUES (1, 'iPhone 13', UNHEX(MD5('iPhone 13')));
+
+INSERT INTO health_record (user_id, type_id, unit_id, value, source_id, device_id, creation_date, start_date, end_date)
 VALUES
-(1, 'HKQuantityTypeIdentifierHeartRateVariabilitySDNN', 'ms', 45.50, 'Apple Watch', 'iPhone 13', 
+(1, 1, 1, 45.50, 1, 1,
  '2024-11-01 10:00:00', '2024-11-01 10:00:00', '2024-11-01 10:01:00'),
-(1, 'HKQuantityTypeIdentifierHeartRate', 'count/min', 72.00, 'Apple Watch', 'iPhone 13',
+(1, 2, 2, 72.00, 1, 1,
  '2024-11-01 10:00:00', '2024-11-01 10:00:00', '2024-11-01 10:01:00'),
-(1, 'HKQuantityTypeIdentifierHeartRate', 'count/min', 68.00, 'Apple Watch', 'iPhone 13',
+(1, 2, 2, 68.00, 1, 1,
  '2024-11-01 11:00:00', '2024-11-01 11:00:00', '2024-11-01 11:01:00');
 
 -- Insert sample workouts
@@ -169,19 +383,21 @@ VALUES
 DELIMITER //
 
 -- Trigger 1: Auto-populate HRV table from health_record
+-- (type ids 1 and 2 are seeded with record_type)
 DROP TRIGGER IF EXISTS after_insert_health_record //
 CREATE TRIGGER after_insert_health_record
 AFTER INSERT ON health_record
 FOR EACH ROW
 BEGIN
   -- Extract HRV (SDNN) measurements
-  IF NEW.type = 'HKQuantityTypeIdentifierHeartRateVariabilitySDNN' THEN
+  IF NEW.type_id = 1 THEN
     INSERT INTO hrv (user_id, value, unit, creation_date, start_date, end_date)
-    VALUES (NEW.user_id, NEW.value, NEW.unit, NEW.creation_date, NEW.start_date, NEW.end_date);
+    VALUES (NEW.user_id, NEW.value, (SELECT name FROM record_unit WHERE unit_id = NEW.unit_id),
+            NEW.creation_date, NEW.start_date, NEW.end_date);
   END IF;
 
   -- Aggregate heart rate into health_sample
-  IF NEW.type = 'HKQuantityTypeIdentifierHeartRate' THEN
+  IF NEW.type_id = 2 THEN
     INSERT INTO health_sample
       (user_id, sample_type, avg_value, min_value, max_value, unit, start_time, end_time)
     VALUES (
@@ -190,7 +406,7 @@ BEGIN
       NEW.value,
       NEW.value,
       NEW.value,
-      NEW.unit,
+      (SELECT name FROM record_unit WHERE unit_id = NEW.unit_id),
       DATE(NEW.start_date),
       DATE(NEW.end_date)
     )
@@ -202,31 +418,35 @@ BEGIN
 END //
 
 -- Trigger 2: Append motion context to health records
+-- (the suffixed device string is interned like any other device)
 DROP TRIGGER IF EXISTS after_insert_metadata //
 CREATE TRIGGER after_insert_metadata
 AFTER INSERT ON metadata_entry
 FOR EACH ROW
 BEGIN
+  DECLARE v_device TEXT;
+
   IF NEW.meta_key = 'HKMetadataKeyHeartRateMotionContext' THEN
-    UPDATE health_record
-    SET device = CONCAT(COALESCE(device, ''), ' | MotionContext=', COALESCE(NEW.meta_value, ''))
-    WHERE record_id = NEW.record_id;
+    SELECT CONCAT(COALESCE(d.name, ''), ' | MotionContext=', COALESCE(NEW.meta_value, ''))
+      INTO v_device
+    FROM health_record hr
+    LEFT JOIN record_device d ON d.device_id = hr.device_id
+    WHERE hr.record_id = NEW.record_id AND hr.start_date = NEW.start_date;
+
+    IF v_device IS NOT NULL THEN
+      INSERT INTO record_device (name, name_hash) VALUES (v_device, UNHEX(MD5(v_device)))
+        ON DUPLICATE KEY UPDATE device_id = LAST_INSERT_ID(device_id);
+      UPDATE health_record
+      SET device_id = LAST_INSERT_ID()
+      WHERE record_id = NEW.record_id AND start_date = NEW.start_date;
+    END IF;
   END IF;
 END //
 
--- Trigger 3: Cascade delete user data
+-- Trigger 3 (removed): user data is deleted in batches by user_deletion.py before
+-- the user row, so a cascading BEFORE DELETE trigger would only repeat that work
+-- in one long transaction
 DROP TRIGGER IF EXISTS before_delete_user //
-CREATE TRIGGER before_delete_user
-BEFORE DELETE ON user
-FOR EACH ROW
-BEGIN
-  DELETE FROM activity_summary WHERE user_id = OLD.user_id;
-  DELETE FROM workout WHERE user_id = OLD.user_id;
-  DELETE FROM health_sample WHERE user_id = OLD.user_id;
-  DELETE FROM hrv WHERE user_id = OLD.user_id;
-  DELETE FROM health_record WHERE user_id = OLD.user_id;
-  DELETE FROM chats WHERE user_id = OLD.user_id;
-END //
 
 -- Trigger 4: Auto-name chats from first message
 DROP TRIGGER IF EXISTS after_insert_first_message //
@@ -357,11 +577,13 @@ BEGIN
     SUM(CASE WHEN me.meta_value = '1' THEN 1 ELSE 0 END)
     INTO v_mc0, v_mc1
   FROM metadata_entry me
-  JOIN health_record hr ON hr.record_id = me.record_id
+  JOIN health_record hr ON hr.record_id = me.record_id AND hr.start_date = me.start_date
   WHERE hr.user_id = p_user_id
     AND me.meta_key = 'HKMetadataKeyHeartRateMotionContext'
     AND hr.start_date >= p_day
-    AND hr.start_date < (p_day + INTERVAL 1 DAY);
+    AND hr.start_date < (p_day + INTERVAL 1 DAY)
+    AND me.start_date >= p_day
+    AND me.start_date < (p_day + INTERVAL 1 DAY);
 
   RETURN CONCAT(
     '{',
@@ -702,7 +924,7 @@ WHERE chat_counts.message_count > (
 -- Join 1: INNER JOIN - Get user health records with metadata
 SELECT u.username, hr.type, hr.value, hr.unit, me.meta_key, me.meta_value
 FROM user u
-INNER JOIN health_record hr ON u.user_id = hr.user_id
+INNER JOIN health_record_named hr ON u.user_id = hr.user_id
 INNER JOIN metadata_entry me ON hr.record_id = me.record_id
 WHERE u.user_id = 1
 ORDER BY hr.start_date DESC
@@ -754,12 +976,12 @@ SELECT u.username,
        hs.min_value AS sample_min,
        hs.max_value AS sample_max
 FROM user u
-INNER JOIN health_record hr ON u.user_id = hr.user_id
+INNER JOIN health_record_named hr ON u.user_id = hr.user_id
 LEFT JOIN metadata_entry me ON hr.record_id = me.record_id
 LEFT JOIN health_sample hs ON u.user_id = hs.user_id 
     AND DATE(hr.start_date) = hs.start_time
 WHERE u.user_id = 1
-  AND hr.type = 'HKQuantityTypeIdentifierHeartRate'
+  AND hr.type_id = 2  -- HKQuantityTypeIdentifierHeartRate
 ORDER BY hr.start_date DESC
 LIMIT 20;
 
@@ -0,0 +1,257 @@
+# In-process columnar cache of per-user daily series for chart endpoints
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import date, datetime, timedelta, timezone
+from typing import Dict, Any, List, Optional, Tuple
+
+import numpy as np
+
+import delta_sync
+from database import fetch_all
+
+EPOCH = date(1970, 1, 1)
+
+# Total bytes of cached arrays across users (0 disables the cache)
+MAX_BYTES = int(float(os.getenv("SERIES_CACHE_MAX_MB", "64")) * 1024 * 1024)
+# Safety net for writes that do not record a data version
+TTL_S = float(os.getenv("SERIES_CACHE_TTL_S", "300"))
+# How long a user's data version (delta_sync) is trusted before it is read again
+VERSION_CHECK_S = float(os.getenv("SERIES_CACHE_VERSION_CHECK_S", "1"))
+
+
+def _utc_naive(dt: datetime) -> datetime:
+    if dt.tzinfo is not None:
+        dt = dt.astimezone(timezone.utc).replace(tzinfo=None)
+    return dt
+
+
+def _ceil_day(dt: datetime) -> date:
+    """First day whose midnight is >= dt"""
+    d = dt.date()
+    return d if dt == datetime(d.year, d.month, d.day) else d + timedelta(days=1)
+
+
+class SeriesDef:
+    """How one daily series is loaded and windowed
+
+    `window(start, end)` maps a request's datetime range to the [lo, hi) range
+    of days the endpoint's SQL would return.
+    """
+
+    def __init__(self, sql: str, day_field: str, columns: List[str], label: Optional[str], window,
+                 int_columns: Tuple[str, ...] = ()):
+        self.sql = sql
+        self.day_field = day_field
+        self.columns = columns
+        self.label = label
+        self.window = window
+        self.int_columns = int_columns
+
+
+SERIES: Dict[str, SeriesDef] = {
+    # Day granularity: a partial first/last day is averaged over the whole day
+    "hrv": SeriesDef(
+        """
+        SELECT DATE(start_date) AS day, AVG(value) AS avg_sdnn_ms
+        FROM hrv WHERE user_id=%s
+        GROUP BY DATE(start_date) ORDER BY day
+        """,
+        "day", ["avg_sdnn_ms"], None,
+        lambda s, e: (s.date(), _ceil_day(e)),
+    ),
+    # health_sample rows start at midnight, so start_time >= s keeps days from ceil(s)
+    "heart_rate": SeriesDef(
+        """
+        SELECT DATE(start_time) AS day, unit,
+               AVG(avg_value) AS avg_bpm, MIN(min_value) AS min_bpm, MAX(max_value) AS max_bpm
+        FROM health_sample WHERE user_id=%s AND sample_type='heart_rate'
+        GROUP BY DATE(start_time), unit ORDER BY day, unit
+        """,
+        "day", ["avg_bpm", "min_bpm", "max_bpm"], "unit",
+        lambda s, e: (_ceil_day(s), _ceil_day(e)),
+    ),
+    "activity": SeriesDef(
+        """
+        SELECT date AS day, active_energy_burned, move_time, exercise_time, stand_hours
+        FROM activity_summary WHERE user_id=%s ORDER BY date
+        """,
+        "date", ["active_energy_burned", "move_time", "exercise_time", "stand_hours"], None,
+        lambda s, e: (s.date(), e.date()),
+        int_columns=("move_time", "exercise_time", "stand_hours"),
+    ),
+}
+
+
+class Series:
+    """Rows of one user's series as typed arrays, sorted by epoch day"""
+
+    __slots__ = ("days", "values", "label_codes", "labels", "nbytes", "loaded_at", "version")
+
+    def __init__(self, days: np.ndarray, values: Dict[str, np.ndarray],
+                 label_codes: Optional[np.ndarray] = None, labels: Optional[List[str]] = None):
+        self.days = days
+        self.values = values
+        self.label_codes = label_codes
+        self.labels = labels or []
+        self.nbytes = days.nbytes + sum(v.nbytes for v in values.values()) + \
+            (label_codes.nbytes if label_codes is not None else 0)
+        self.loaded_at = time.monotonic()
+        self.version: Optional[int] = None
+
+    def slice(self, lo: date, hi: date) -> slice:
+        """Rows with lo <= day < hi (binary search on the sorted day column)"""
+        a = np.searchsorted(self.days, (lo - EPOCH).days, side="left")
+        b = np.searchsorted(self.days, (hi - EPOCH).days, side="left")
+        return slice(int(a), int(max(a, b)))
+
+
+def load_series(user_id: int, name: str) -> Series:
+    spec = SERIES[name]
+    rows = fetch_all(spec.sql, (user_id,), label=f"series_cache.{name}")
+    n = len(rows)
+    days = np.fromiter(((r["day"] - EPOCH).days for r in rows), dtype=np.int32, count=n)
+    values = {
+        # float64 holds float(Decimal) exactly, so values serialize as the SQL path's do
+        col: np.fromiter((np.nan if r[col] is None else float(r[col]) for r in rows), dtype=np.float64, count=n)
+        for col in spec.columns
+    }
+    codes, labels = None, None
+    if spec.label:
+        labels = sorted({r[spec.label] for r in rows if r[spec.label] is not None})
+        index = {label: i for i, label in enumerate(labels)}
+        codes = np.fromiter((index.get(r[spec.label], -1) for r in rows), dtype=np.int8, count=n)
+    return Series(days, values, codes, labels)
+
+
+def _json_number(v: float) -> str:
+    return "null" if v != v else repr(v)
+
+
+def _json_int(v: float) -> str:
+    return "null" if v != v else str(int(v))
+
+
+def to_json(spec: SeriesDef, series: Series, rows: slice) -> bytes:
+    """Serialize a slice straight from the arrays (no per-row dicts or model validation)"""
+    day_strs = series.days[rows].astype("datetime64[D]").astype(str).tolist()
+    tokens: List[Tuple[str, List[str]]] = [(spec.day_field, ['"%s"' % d for d in day_strs])]
+    for col in spec.columns:
+        values = series.values[col][rows].tolist()
+        fmt = _json_int if col in spec.int_columns else _json_number
+        tokens.append((col, [fmt(v) for v in values]))
+    if spec.label:
+        names = [json.dumps(label) for label in series.labels]
+        tokens.append((spec.label, ["null" if c < 0 else names[c] for c in series.label_codes[rows].tolist()]))
+    keys = ['"%s":' % name for name, _ in tokens]
+    columns = [col for _, col in tokens]
+    body = ",".join("{" + ",".join(k + v for k, v in zip(keys, row)) + "}" for row in zip(*columns))
+    return ("[" + body + "]").encode()
+
+
+class SeriesCache:
+    """LRU (by total array bytes) of per-user series, loaded lazily on first read
+
+    Each entry is tagged with the user's data version (the data_change row
+    every import records), so an upload handled by another worker process
+    invalidates this one's entries on their next read. `invalidate` covers
+    the local process immediately.
+    """
+
+    def __init__(self, max_bytes: int = MAX_BYTES, ttl: float = TTL_S):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[Tuple[int, str], Series]" = OrderedDict()
+        self._bytes = 0
+        # Bumped by invalidate() so a load that raced an upload is not cached
+        self._generation: Dict[int, int] = {}
+        # user_id -> (data version, monotonic time it was read)
+        self._versions: Dict[int, Tuple[int, float]] = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    def _data_version(self, user_id: int) -> int:
+        now = time.monotonic()
+        with self._lock:
+            known = self._versions.get(user_id)
+        if known is not None and now - known[1] < VERSION_CHECK_S:
+            return known[0]
+        version = delta_sync.current_version(user_id)
+        with self._lock:
+            self._versions[user_id] = (version, now)
+            if len(self._versions) > 10000:
+                self._versions = {u: v for u, v in self._versions.items() if now - v[1] < VERSION_CHECK_S}
+        return version
+
+    def get(self, user_id: int, name: str) -> Series:
+        key = (user_id, name)
+        version = self._data_version(user_id)
+        with self._lock:
+            series = self._entries.get(key)
+            if series is not None and series.version == version and \
+                    time.monotonic() - series.loaded_at < self.ttl:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return series
+            self.misses += 1
+            generation = self._generation.get(user_id, 0)
+        series = load_series(user_id, name)
+        series.version = version
+        with self._lock:
+            if self._generation.get(user_id, 0) != generation:
+                return series
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= old.nbytes
+            if series.nbytes <= self.max_bytes:
+                self._entries[key] = series
+                self._bytes += series.nbytes
+                while self._bytes > self.max_bytes:
+                    _, evicted = self._entries.popitem(last=False)
+                    self._bytes -= evicted.nbytes
+                    self.evictions += 1
+        return series
+
+    def read_json(self, user_id: int, name: str, start: datetime, end: datetime,
+                  limit: Optional[int] = None, offset: int = 0) -> bytes:
+        """JSON array of the rows the endpoint would return for [start, end)"""
+        spec = SERIES[name]
+        series = self.get(user_id, name)
+        lo, hi = spec.window(_utc_naive(start), _utc_naive(end))
+        rows = series.slice(lo, hi)
+        if offset or limit is not None:
+            first = rows.start + offset
+            last = rows.stop if limit is None else min(rows.stop, first + limit)
+            rows = slice(min(first, rows.stop), max(min(first, rows.stop), last))
+        return to_json(spec, series, rows)
+
+    def invalidate(self, user_id: int):
+        """Drop every cached series of a user (after an upload or deletion)"""
+        with self._lock:
+            self._generation[user_id] = self._generation.get(user_id, 0) + 1
+            self._versions.pop(user_id, None)
+            for key in [k for k in self._entries if k[0] == user_id]:
+                self._bytes -= self._entries.pop(key).nbytes
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "users": len({k[0] for k in self._entries}),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+
+series_cache = SeriesCache()
@@ -0,0 +1,237 @@
+#!/usr/bin/env python3
+"""
+Sleep sessions reconstructed from HKCategoryTypeIdentifierSleepAnalysis records.
+
+A user's sleep-stage intervals are streamed in start order and merged with a
+single sweep-line pass. Where sources overlap (Watch stages, iPhone in-bed
+time, duplicate imports) the most specific stage wins. The merged timeline
+is split into sessions at gaps longer than SLEEP_SESSION_GAP_H, and each
+session's stage durations, onset, wake and efficiency go into sleep_session.
+Times are stored in UTC and a session's night is the UTC date of waking, so
+for users far from UTC it can differ from the local wake date by a day.
+
+refresh() only recomputes from the start of the user's latest stored session,
+so after an import just the new (or still growing) nights are processed.
+
+Usage:
+    python3 sleep.py refresh --user-id 1
+    python3 sleep.py refresh --all
+"""
+import argparse
+import heapq
+import os
+import sys
+from datetime import datetime, timedelta
+from typing import Dict, Any, Iterable, Iterator, List, Optional, Tuple
+
+from database import cursor, fetch_all, fetch_scalar, get_connection
+from sleep_stages import ASLEEP, RANK, SLEEP_TYPE, STAGES
+
+# Gap between merged intervals that starts a new session
+SESSION_GAP = timedelta(hours=float(os.getenv("SLEEP_SESSION_GAP_H", "2")))
+# Sessions with less sleep than this (stray in-bed or awake samples) are dropped
+MIN_ASLEEP_MIN = 15
+
+Interval = Tuple[datetime, datetime, int]
+
+_INSERT_SQL = """
+    INSERT INTO sleep_session
+      (user_id, night, in_bed_start, in_bed_end, onset, wake, asleep_min, awake_min,
+       in_bed_min, core_min, deep_min, rem_min, unspecified_min, efficiency)
+    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+"""
+
+
+def merge_intervals(intervals: Iterable[Interval]) -> Iterator[Interval]:
+    """Sweep-line merge of intervals sorted by start into non-overlapping stage segments
+
+    Ends are kept in a heap, so the pass is O(n log k) for at most k intervals
+    overlapping at once, and consecutive segments of the same stage are coalesced.
+    """
+    active = [0] * len(STAGES)
+    ends: List[Tuple[datetime, int]] = []
+    pos: Optional[datetime] = None
+    pending: Optional[List] = None
+
+    def advance(to: datetime) -> Optional[Interval]:
+        """Close the segment [pos, to); returns a finished coalesced segment, if any"""
+        nonlocal pos, pending
+        done = None
+        if pos is not None and to > pos and any(active):
+            stage = max((c for c in range(len(STAGES)) if active[c]), key=RANK.__getitem__)
+            if pending is not None and pending[1] == pos and pending[2] == stage:
+                pending[1] = to
+            else:
+                if pending is not None:
+                    done = tuple(pending)
+                pending = [pos, to, stage]
+        pos = to
+        return done
+
+    for start, end, stage in intervals:
+        if end <= start:
+            continue
+        while ends and ends[0][0] <= start:
+            t, c = heapq.heappop(ends)
+            done = advance(t)
+            active[c] -= 1
+            if done:
+                yield done
+        done = advance(start)
+        if done:
+            yield done
+        active[stage] += 1
+        heapq.heappush(ends, (end, stage))
+    while ends:
+        t, c = heapq.heappop(ends)
+        done = advance(t)
+        active[c] -= 1
+        if done:
+            yield done
+    if pending is not None:
+        yield tuple(pending)
+
+
+def _summarize(segments: List[Interval]) -> Optional[Dict[str, Any]]:
+    minutes = [0.0] * len(STAGES)
+    for start, end, stage in segments:
+        minutes[stage] += (end - start).total_seconds() / 60
+    asleep = sum(minutes[c] for c in ASLEEP)
+    if asleep < MIN_ASLEEP_MIN:
+        return None
+    asleep_segments = [s for s in segments if s[2] in ASLEEP]
+    in_bed_start, in_bed_end = segments[0][0], segments[-1][1]
+    span = (in_bed_end - in_bed_start).total_seconds() / 60
+    wake = asleep_segments[-1][1]
+    return {
+        "night": wake.date(),
+        "in_bed_start": in_bed_start,
+        "in_bed_end": in_bed_end,
+        "onset": asleep_segments[0][0],
+        "wake": wake,
+        "asleep_min": round(asleep, 1),
+        "awake_min": round(minutes[2], 1),
+        "in_bed_min": round(span, 1),
+        "core_min": round(minutes[3], 1),
+        "deep_min": round(minutes[4], 1),
+        "rem_min": round(minutes[5], 1),
+        "unspecified_min": round(minutes[1], 1),
+        "efficiency": round(asleep / span, 3) if span else None,
+    }
+
+
+def build_sessions(segments: Iterable[Interval], gap: timedelta = SESSION_GAP) -> Iterator[Dict[str, Any]]:
+    """Group merged segments into sessions split at gaps longer than `gap`"""
+    current: List[Interval] = []
+    for segment in segments:
+        if current and segment[0] - current[-1][1] > gap:
+            session = _summarize(current)
+            if session:
+                yield session
+            current = []
+        current.append(segment)
+    if current:
+        session = _summarize(current)
+        if session:
+            yield session
+
+
+def _stream_intervals(user_id: int, type_id: int, since: Optional[datetime]) -> Iterator[Interval]:
+    """The user's coded sleep records from `since`, fetched from the primary in batches"""
+    cnx = get_connection()
+    try:
+        # Unbuffered, so a long history is never held in memory at once
+        cur = cnx.cursor()
+        cur.execute(
+            """
+            SELECT start_date, end_date, value FROM health_record
+            WHERE user_id = %s AND type_id = %s AND start_date >= %s AND value IS NOT NULL
+            ORDER BY start_date
+            """,
+            (user_id, type_id, since or datetime(1970, 1, 1))
+        )
+        while True:
+            rows = cur.fetchmany(5000)
+            if not rows:
+                break
+            for start, end, value in rows:
+                stage = int(value)
+                if 0 <= stage < len(STAGES) and end is not None:
+                    yield start, end, stage
+        cur.close()
+    finally:
+        cnx.close()
+
+
+def refresh(user_id: int) -> int:
+    """Recompute sessions from the user's latest stored one onwards; returns sessions written"""
+    type_id = fetch_scalar("SELECT type_id FROM record_type WHERE name = %s", (SLEEP_TYPE,), read=False)
+    if type_id is None:
+        return 0
+    # The latest session may have been cut short by the previous export
+    since = fetch_scalar("SELECT MAX(in_bed_start) FROM sleep_session WHERE user_id = %s", (user_id,), read=False)
+    sessions = list(build_sessions(merge_intervals(_stream_intervals(user_id, type_id, since))))
+    with cursor(commit=True, label="sleep.refresh") as cur:
+        if since is not None:
+            cur.execute("DELETE FROM sleep_session WHERE user_id = %s AND in_bed_start >= %s", (user_id, since))
+        if sessions:
+            cur.executemany(_INSERT_SQL, [
+                (user_id, s["night"], s["in_bed_start"], s["in_bed_end"], s["onset"], s["wake"],
+                 s["asleep_min"], s["awake_min"], s["in_bed_min"], s["core_min"], s["deep_min"],
+                 s["rem_min"], s["unspecified_min"], s["efficiency"])
+                for s in sessions
+            ])
+    return len(sessions)
+
+
+def summary(user_id: int, days: int = 14) -> Dict[str, Any]:
+    """Averages over the last `days` nights with data, plus the nights themselves (UTC wake dates)"""
+    rows = fetch_all(
+        """
+        SELECT night, TIME(onset) AS onset_utc, TIME(wake) AS wake_utc, asleep_min, awake_min,
+               deep_min, rem_min, core_min, efficiency
+        FROM sleep_session
+        WHERE user_id = %s AND night >= (SELECT MAX(night) FROM sleep_session WHERE user_id = %s) - INTERVAL %s DAY
+        ORDER BY night
+        """,
+        (user_id, user_id, days)
+    )
+    if not rows:
+        return {"type": "sleep_summary", "nights": 0}
+
+    def avg(key: str) -> Optional[float]:
+        values = [float(r[key]) for r in rows if r[key] is not None]
+        return round(sum(values) / len(values), 2) if values else None
+
+    return {
+        "type": "sleep_summary",
+        "nights": len(rows),
+        "period": f"{rows[0]['night']} to {rows[-1]['night']}",
+        "avg_asleep_hours": round(avg("asleep_min") / 60, 2),
+        "avg_efficiency": avg("efficiency"),
+        "avg_deep_min": avg("deep_min"),
+        "avg_rem_min": avg("rem_min"),
+        "avg_core_min": avg("core_min"),
+        "avg_awake_min": avg("awake_min"),
+        "sessions": [{**r, "onset_utc": str(r["onset_utc"]), "wake_utc": str(r["wake_utc"])} for r in rows],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Rebuild sleep sessions from imported sleep records")
+    parser.add_argument("command", choices=("refresh",))
+    group = parser.add_mutually_exclusive_group(required=True)
+    group.add_argument("--user-id", type=int)
+    group.add_argument("--all", action="store_true", help="Every user with sleep records")
+    args = parser.parse_args()
+
+    user_ids = [args.user_id] if args.user_id else [
+        r["user_id"] for r in fetch_all("SELECT user_id FROM user ORDER BY user_id", (), read=False)
+    ]
+    for user_id in user_ids:
+        print(f"user {user_id}: {refresh(user_id)} session(s) written")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
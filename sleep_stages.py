@@ -0,0 +1,17 @@
+# HealthKit sleep-stage codes, without sleep.py's database imports so transfer.py can use them
+SLEEP_TYPE = "HKCategoryTypeIdentifierSleepAnalysis"
+
+# HKCategoryValueSleepAnalysis raw values; transfer.py stores them in health_record.value
+STAGE_CODES = {
+    "HKCategoryValueSleepAnalysisInBed": 0,
+    "HKCategoryValueSleepAnalysisAsleep": 1,  # before iOS 16
+    "HKCategoryValueSleepAnalysisAsleepUnspecified": 1,
+    "HKCategoryValueSleepAnalysisAwake": 2,
+    "HKCategoryValueSleepAnalysisAsleepCore": 3,
+    "HKCategoryValueSleepAnalysisAsleepDeep": 4,
+    "HKCategoryValueSleepAnalysisAsleepREM": 5,
+}
+STAGES = ("in_bed", "unspecified", "awake", "core", "deep", "rem")
+ASLEEP = (1, 3, 4, 5)
+# Overlapping stages resolve to the highest rank (staged Watch data over coarse sources)
+RANK = (0, 2, 3, 4, 6, 5)
@@ -0,0 +1,178 @@
+# Fingerprinted, precompressed static assets and HTML pages
+import hashlib
+import mimetypes
+import os
+import re
+import threading
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from starlette.requests import Request
+from starlette.responses import Response
+
+from compression import brotli, compress, negotiate, COMPRESSIBLE_TYPES
+
+BASE_DIR = Path(__file__).resolve().parent
+
+# Public name under /static/ -> source file
+ASSETS: Dict[str, str] = {
+    "style.css": "css/style.css",
+    "auth.js": "js/auth.js",
+    "register.js": "js/register.js",
+    "upload.js": "js/upload.js",
+    "series_store.js": "js/series_store.js",
+    "dashboard.js": "js/dashboard.js",
+    "chat.js": "js/chat.js",
+    "logo.png": "light.png",
+    "favicon.ico": "favicon.ico",
+}
+
+PAGES: Dict[str, str] = {
+    "login.html": "html/login.html",
+    "register.html": "html/register.html",
+    "upload.html": "html/upload.html",
+    "dashboard.html": "html/dashboard.html",
+    "chat.html": "html/chat.html",
+}
+
+# Hashed names never change content, so browsers may keep them for a year
+IMMUTABLE = "public, max-age=31536000, immutable"
+# Pages and unhashed names are revalidated with If-None-Match on every use
+REVALIDATE = "no-cache"
+FAVICON = "public, max-age=86400"
+
+# Re-read files whose mtime changed (for development with --reload)
+AUTO_RELOAD = os.getenv("STATIC_AUTO_RELOAD", "0") == "1"
+
+_STATIC_REF = re.compile(r"/static/([\w.-]+)")
+
+mimetypes.add_type("application/javascript", ".js")
+mimetypes.add_type("image/x-icon", ".ico")
+
+
+class Asset:
+    """One file held in memory with its precompressed variants"""
+
+    __slots__ = ("name", "hashed_name", "content_type", "digest", "bodies")
+
+    def __init__(self, name: str, body: bytes, content_type: str):
+        self.name = name
+        self.content_type = content_type
+        self.digest = hashlib.sha256(body).hexdigest()[:12]
+        stem, dot, ext = name.rpartition(".")
+        self.hashed_name = f"{stem}.{self.digest}.{ext}" if dot else f"{name}.{self.digest}"
+        # None is the identity encoding; a variant is only kept if it is smaller
+        self.bodies: Dict[Optional[str], bytes] = {None: body}
+        if content_type.startswith(COMPRESSIBLE_TYPES):
+            for encoding in ("gzip", "br") if brotli is not None else ("gzip",):
+                packed = compress(body, encoding, best=True)
+                if len(packed) < len(body):
+                    self.bodies[encoding] = packed
+
+    def etag(self, encoding: Optional[str]) -> str:
+        return f'"{self.digest}-{encoding}"' if encoding else f'"{self.digest}"'
+
+
+def _content_type(name: str) -> str:
+    return mimetypes.guess_type(name)[0] or "application/octet-stream"
+
+
+def _encoding_for(request: Request, asset: Asset) -> Optional[str]:
+    encoding = negotiate(request.headers.get("accept-encoding", ""))
+    return encoding if encoding in asset.bodies else None
+
+
+def _not_modified(request: Request, asset: Asset) -> bool:
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    for tag in header.split(","):
+        tag = tag.strip()
+        if tag == "*":
+            return True
+        if tag.startswith("W/"):
+            tag = tag[2:]
+        # Any encoding of the same content is a match
+        if tag.strip('"').split("-")[0] == asset.digest:
+            return True
+    return False
+
+
+class StaticAssets:
+    """Builds every asset once per process and serves it from memory
+
+    Assets get content-hashed names (style.<hash>.css) and the HTML pages are
+    rewritten to reference them, so assets can be cached as immutable and a
+    repeat page view only revalidates the page itself (a bodiless 304).
+    """
+
+    def __init__(self, base_dir: Path = BASE_DIR, auto_reload: bool = AUTO_RELOAD):
+        self.base_dir = base_dir
+        self.auto_reload = auto_reload
+        self._lock = threading.Lock()
+        self._assets: Dict[str, Tuple[Asset, bool]] = {}
+        self._pages: Dict[str, Asset] = {}
+        self._mtimes: Dict[str, float] = {}
+
+    def _sources(self) -> List[str]:
+        return list(ASSETS.values()) + list(PAGES.values())
+
+    def _current_mtimes(self) -> Dict[str, float]:
+        return {src: (self.base_dir / src).stat().st_mtime for src in self._sources()}
+
+    def build(self) -> int:
+        """(Re)read, fingerprint and compress all assets; returns the number of files"""
+        assets: Dict[str, Tuple[Asset, bool]] = {}
+        for name, src in ASSETS.items():
+            asset = Asset(name, (self.base_dir / src).read_bytes(), _content_type(name))
+            assets[asset.hashed_name] = (asset, True)
+            assets[name] = (asset, False)
+        hashed = {name: a.hashed_name for name, (a, immutable) in assets.items() if not immutable}
+
+        def rewrite(match: "re.Match") -> str:
+            return "/static/" + hashed.get(match.group(1), match.group(1))
+
+        pages = {}
+        for name, src in PAGES.items():
+            html = (self.base_dir / src).read_text(encoding="utf-8")
+            pages[name] = Asset(name, _STATIC_REF.sub(rewrite, html).encode("utf-8"), "text/html; charset=utf-8")
+
+        mtimes = self._current_mtimes()
+        with self._lock:
+            self._assets, self._pages, self._mtimes = assets, pages, mtimes
+        return len(ASSETS) + len(PAGES)
+
+    def _ensure_built(self):
+        if not self._pages or (self.auto_reload and self._current_mtimes() != self._mtimes):
+            self.build()
+
+    def _respond(self, request: Request, asset: Asset, cache_control: str) -> Response:
+        encoding = _encoding_for(request, asset)
+        headers = {"ETag": asset.etag(encoding), "Cache-Control": cache_control}
+        if len(asset.bodies) > 1:
+            headers["Vary"] = "Accept-Encoding"
+        if _not_modified(request, asset):
+            return Response(status_code=304, headers=headers)
+        if encoding:
+            headers["Content-Encoding"] = encoding
+        return Response(asset.bodies[encoding], media_type=asset.content_type, headers=headers)
+
+    def asset(self, request: Request, name: str) -> Optional[Response]:
+        """Response for /static/<name>, or None if there is no such asset"""
+        self._ensure_built()
+        entry = self._assets.get(name)
+        if entry is None:
+            return None
+        asset, immutable = entry
+        return self._respond(request, asset, IMMUTABLE if immutable else REVALIDATE)
+
+    def favicon(self, request: Request) -> Response:
+        self._ensure_built()
+        return self._respond(request, self._assets["favicon.ico"][0], FAVICON)
+
+    def page(self, request: Request, name: str) -> Response:
+        self._ensure_built()
+        return self._respond(request, self._pages[name], REVALIDATE)
+
+
+static_assets = StaticAssets()
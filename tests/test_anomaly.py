@@ -0,0 +1,87 @@
+from datetime import datetime, timedelta
+
+from anomaly import Z_THRESHOLD, AnomalyDetector
+
+HRV = "HKQuantityTypeIdentifierHeartRateVariabilitySDNN"
+T0 = datetime(2026, 1, 1, 8, 0)
+
+
+class FakeCursor:
+    """Records writes; returns `state` rows for the detector's load query"""
+
+    def __init__(self, state=()):
+        self.state = list(state)
+        self.writes = []
+
+    def execute(self, sql, params):
+        pass
+
+    def fetchall(self):
+        return self.state
+
+    def executemany(self, sql, rows):
+        self.writes.append((sql, list(rows)))
+
+
+def ts(hours: float) -> str:
+    return (T0 + timedelta(hours=hours)).strftime("%Y-%m-%d %H:%M:%S")
+
+
+def readings(n: int, start: float = 0, value: float = 50.0):
+    # Small alternating jitter keeps the variance non-zero
+    return [(ts(start + 6 * i), value + (1 if i % 2 else -1)) for i in range(n)]
+
+
+def run(pairs, state=()):
+    cur = FakeCursor(state)
+    detector = AnomalyDetector(cur, 1)
+    for t, v in pairs:
+        detector.observe(HRV, t, v)
+    detector.flush(cur)
+    return detector, cur
+
+
+def test_readings_are_folded_in_time_order():
+    # One source's readings, then an older second source: the order export.xml uses
+    watch, other = readings(40, start=200), readings(40)
+    grouped, _ = run(watch + other)
+    in_order, _ = run(other + watch)
+    a, b = grouped.states["hrv"], in_order.states["hrv"]
+    assert (a.n, a.mean, a.var, a.last_ts) == (b.n, b.mean, b.var, b.last_ts)
+    assert grouped.detected == 0
+
+
+def test_spike_is_flagged_against_the_trailing_baseline():
+    history = readings(40)
+    detector, cur = run(history + [(ts(1000), 120.0)])
+    assert detector.detected == 1
+    events = [rows for sql, rows in cur.writes if "anomaly_event" in sql][0]
+    user_id, metric, day, direction, first_at, value, baseline, sd, z = events[0]
+    assert (metric, direction, first_at) == ("hrv", "high", ts(1000))
+    assert z >= Z_THRESHOLD and abs(baseline - 50.0) < 1.0
+
+
+def test_nothing_is_written_before_flush():
+    cur = FakeCursor()
+    detector = AnomalyDetector(cur, 1)
+    for t, v in readings(30):
+        detector.observe(HRV, t, v)
+    assert cur.writes == [] and "hrv" not in detector.states
+
+
+def test_readings_at_or_before_the_saved_watermark_are_skipped():
+    saved = [("hrv", 30, 50.0, 1.0, T0 + timedelta(hours=100))]
+    detector, cur = run(readings(40), state=saved)
+    state = detector.states["hrv"]
+    # Readings every 6 hours from 0 to 234: the 23 after hour 100 are new
+    assert state.n == 30 + 23
+    assert state.last_ts == ts(234)
+    assert any("anomaly_state" in sql for sql, _ in cur.writes)
+
+
+def test_other_record_types_are_ignored():
+    detector, cur = run([])
+    detector.observe("HKQuantityTypeIdentifierStepCount", ts(0), 100)
+    detector.observe(HRV, None, 50)
+    detector.observe(HRV, ts(0), None)
+    assert detector.pending == {}
@@ -0,0 +1,51 @@
+import random
+
+from cohorts import TDigest, percentile_of
+
+
+def test_tdigest_quantiles_close_to_exact():
+    rng = random.Random(7)
+    values = [rng.gauss(50, 10) for _ in range(20000)]
+    digest = TDigest()
+    for v in values:
+        digest.add(v)
+    values.sort()
+    for q in (0.01, 0.1, 0.5, 0.9, 0.99):
+        exact = values[int(q * (len(values) - 1))]
+        assert abs(digest.quantile(q) - exact) < 0.5
+    assert digest.quantile(0.0) == values[0]
+    assert digest.quantile(1.0) == values[-1]
+    assert len(digest.means) <= digest.compression
+
+
+def test_tdigest_merge_matches_single_digest():
+    rng = random.Random(3)
+    values = [rng.uniform(0, 100) for _ in range(10000)]
+    whole, merged = TDigest(), TDigest()
+    parts = [TDigest() for _ in range(4)]
+    for i, v in enumerate(values):
+        whole.add(v)
+        parts[i % 4].add(v)
+    for part in parts:
+        merged.merge(part)
+    assert merged.count == whole.count == len(values)
+    for q in (0.05, 0.5, 0.95):
+        assert abs(merged.quantile(q) - whole.quantile(q)) < 1.0
+
+
+def test_tdigest_empty_and_single():
+    digest = TDigest()
+    assert digest.quantile(0.5) is None
+    digest.add(42.0)
+    assert digest.quantile(0.5) == 42.0
+
+
+def test_percentile_of():
+    table = [float(i) for i in range(101)]
+    assert percentile_of(table, -1) == 0.0
+    assert percentile_of(table, 0) == 0.0
+    assert percentile_of(table, 25.5) == 25.5
+    assert percentile_of(table, 1000) == 100.0
+    # A value on a flat stretch ranks at its first percentile
+    assert percentile_of([0.0, 5.0, 5.0, 10.0], 5.0) == 1.0
+    assert percentile_of([0.0, 5.0, 5.0, 10.0], 7.5) == 2.5
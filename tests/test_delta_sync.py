@@ -0,0 +1,27 @@
+from datetime import date
+
+from delta_sync import plan
+
+
+def d(day: int) -> date:
+    return date(2026, 1, day)
+
+
+def test_first_sync_sends_the_whole_range():
+    assert plan((d(1), d(31)), None, [(d(5), d(6))]) == [(d(1), d(31))]
+
+
+def test_only_missing_days_are_sent():
+    # Cached the first half; the wanted range extends past it
+    assert plan((d(10), d(31)), (d(1), d(20)), []) == [(d(20), d(31))]
+    # Wanted range already cached in full
+    assert plan((d(5), d(10)), (d(1), d(20)), []) == []
+
+
+def test_changes_inside_held_days_are_resent():
+    assert plan((d(5), d(10)), (d(1), d(20)), [(d(15), d(17))]) == [(d(15), d(17))]
+
+
+def test_changes_are_clipped_and_merged_with_missing_days():
+    changes = [(date(2025, 12, 1), d(3)), (d(18), d(25)), (d(22), d(28))]
+    assert plan((d(10), d(25)), (d(1), d(20)), changes) == [(d(1), d(3)), (d(18), d(25))]
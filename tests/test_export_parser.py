@@ -0,0 +1,52 @@
+import xml.etree.ElementTree as ET
+
+import export_parser
+from export_parser import iter_export
+
+EXPORT = """<?xml version="1.0" encoding="UTF-8"?>
+<HealthData locale="en_US">
+ <ExportDate value="2024-06-01 10:00:00 +0000"/>
+ <Record type="HKQuantityTypeIdentifierHeartRate" value="61">
+  <MetadataEntry key="HKMetadataKeyHeartRateMotionContext" value="1"/>
+ </Record>
+ <Correlation type="HKCorrelationTypeIdentifierFood">
+""" + "".join(
+    f'  <Record type="HKQuantityTypeIdentifierDietaryWater" value="{i}"><MetadataEntry key="k" value="v"/></Record>\n'
+    for i in range(500)
+) + """ </Correlation>
+ <Workout workoutActivityType="HKWorkoutActivityTypeRunning"/>
+</HealthData>
+"""
+
+
+def write_export(tmp_path):
+    path = tmp_path / "export.xml"
+    path.write_text(EXPORT)
+    return str(path)
+
+
+def test_yields_only_top_level_imported_elements(tmp_path):
+    seen = [(e.tag, e.get("value"), len(e)) for e in iter_export(write_export(tmp_path), parser="stdlib")]
+    assert seen == [("Record", "61", 1), ("Workout", None, 0)]
+
+
+def test_skipped_subtree_does_not_keep_finished_children(tmp_path, monkeypatch):
+    skipped = []
+    preceding = []
+    iterparse = ET.iterparse
+
+    def spy(*args, **kwargs):
+        for event, elem in iterparse(*args, **kwargs):
+            if event == "start" and elem.tag == "Correlation":
+                skipped.append(elem)
+            if skipped and event == "end" and elem.tag == "Record":
+                preceding.append(list(skipped[0]).index(elem))
+            yield event, elem
+
+    monkeypatch.setattr(export_parser.ET, "iterparse", spy)
+    list(iter_export(write_export(tmp_path), parser="stdlib"))
+    # Each nested Record is detached once it ends, so whenever the next one ends
+    # no finished sibling is still attached before it
+    assert len(preceding) == 500
+    assert max(preceding) == 0
+    assert len(skipped[0]) == 0
@@ -0,0 +1,39 @@
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+import database
+from metrics import REGISTRY, MetricsMiddleware
+
+
+def test_db_metrics_escape_labels_and_declare_families(monkeypatch):
+    stats = database.QueryStats()
+    stats.record('user "export"\\n', "SELECT 1", 2.5, 3)
+    monkeypatch.setattr(database, "query_stats", stats)
+    lines = database._collect_db_metrics()
+
+    assert 'db_query_calls_total{site="user \\"export\\"\\\\n"} 1' in lines
+    declared = [line.split()[2] for line in lines if line.startswith("# TYPE")]
+    samples = [line for line in lines if not line.startswith("#")]
+    for line in samples:
+        assert any(line.startswith(name + "{") or line.startswith(name + "_") for name in declared)
+    # Every family's samples follow its own header
+    families = [line.split()[2] for line in lines if line.startswith("# HELP")]
+    assert families == declared and len(set(families)) == len(families)
+
+
+def test_middleware_labels_requests_with_route_template():
+    app = FastAPI()
+
+    @app.get("/api/users/{user_id}/things")
+    def things(user_id: int):
+        return {}
+
+    app.add_middleware(MetricsMiddleware)
+    client = TestClient(app)
+    client.get("/api/users/7/things")
+    client.get("/api/nowhere")
+
+    text = REGISTRY.render()
+    assert 'http_requests_total{method="GET",route="/api/users/{user_id}/things",status="200"}' in text
+    assert 'http_requests_total{method="GET",route="unmatched",status="404"}' in text
+    assert "/api/users/7/things" not in text
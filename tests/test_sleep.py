@@ -0,0 +1,59 @@
+from datetime import datetime, timedelta
+
+from sleep import build_sessions, merge_intervals
+
+T0 = datetime(2026, 3, 1, 22, 0)
+IN_BED, UNSPECIFIED, AWAKE, CORE, DEEP, REM = range(6)
+
+
+def at(minutes: float) -> datetime:
+    return T0 + timedelta(minutes=minutes)
+
+
+def test_most_specific_stage_wins_overlaps():
+    intervals = [
+        (at(0), at(480), IN_BED),        # iPhone in-bed time
+        (at(10), at(100), UNSPECIFIED),  # coarse source
+        (at(20), at(60), CORE),          # Watch stages
+        (at(60), at(90), DEEP),
+        (at(90), at(120), REM),
+    ]
+    assert list(merge_intervals(intervals)) == [
+        (at(0), at(10), IN_BED),
+        (at(10), at(20), UNSPECIFIED),
+        (at(20), at(60), CORE),
+        (at(60), at(90), DEEP),
+        (at(90), at(120), REM),
+        (at(120), at(480), IN_BED),
+    ]
+
+
+def test_duplicates_and_adjacent_same_stage_coalesce():
+    intervals = [
+        (at(0), at(30), CORE),
+        (at(0), at(30), CORE),  # the same record imported twice
+        (at(30), at(60), CORE),
+        (at(50), at(50), DEEP),  # zero length, ignored
+    ]
+    assert list(merge_intervals(intervals)) == [(at(0), at(60), CORE)]
+
+
+def test_gaps_are_not_filled():
+    intervals = [(at(0), at(30), CORE), (at(40), at(70), AWAKE)]
+    assert list(merge_intervals(intervals)) == [(at(0), at(30), CORE), (at(40), at(70), AWAKE)]
+
+
+def test_sessions_split_at_long_gaps():
+    segments = [
+        (at(0), at(240), CORE),
+        (at(240), at(250), AWAKE),
+        (at(250), at(420), DEEP),
+        (at(900), at(960), CORE),  # afternoon nap after a long gap
+        (at(1500), at(1505), IN_BED),  # too little sleep: dropped
+    ]
+    sessions = list(build_sessions(segments, gap=timedelta(hours=2)))
+    assert [s["asleep_min"] for s in sessions] == [410.0, 60.0]
+    night = sessions[0]
+    assert night["night"] == at(420).date()
+    assert night["awake_min"] == 10.0
+    assert night["efficiency"] == round(410 / 420, 3)
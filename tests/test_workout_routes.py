@@ -0,0 +1,40 @@
+import math
+
+from workout_routes import decode_polyline, distance_m, encode_polyline, simplify
+
+
+def test_encode_polyline_reference_example():
+    # The worked example from the polyline format documentation
+    points = [(38.5, -120.2), (40.7, -120.95), (43.252, -126.453)]
+    encoded = encode_polyline(points)
+    assert encoded == "_p~iF~ps|U_ulLnnqC_mqNvxq`@"
+    assert decode_polyline(encoded) == points
+
+
+def test_polyline_round_trip_within_precision():
+    points = [(51.5 + i * 1e-4, -0.12 - i * 3e-5) for i in range(200)]
+    decoded = decode_polyline(encode_polyline(points))
+    assert len(decoded) == len(points)
+    assert all(abs(a - c) <= 0.5e-5 and abs(b - d) <= 0.5e-5 for (a, b), (c, d) in zip(points, decoded))
+    assert encode_polyline([]) == ""
+
+
+def test_simplify_drops_collinear_points():
+    line = [(45.0, 7.0 + i * 1e-4) for i in range(50)]
+    assert simplify(line, 1.0) == [line[0], line[-1]]
+
+
+def test_simplify_keeps_points_beyond_tolerance():
+    # An out-and-back leg whose corner is about 111 m off the start-end line
+    track = [(45.0, 7.0), (45.0005, 7.0), (45.001, 7.0), (45.0005, 7.0005), (45.0, 7.001)]
+    assert simplify(track, 5.0) == [(45.0, 7.0), (45.001, 7.0), (45.0, 7.001)]
+    assert simplify(track, 500.0) == [(45.0, 7.0), (45.0, 7.001)]
+    assert simplify(track, 0) == track
+
+
+def test_simplified_track_stays_within_tolerance():
+    track = [(46.0 + i * 1e-4, 8.0 + 2e-4 * math.sin(i / 5)) for i in range(300)]
+    kept = simplify(track, 10.0)
+    assert kept[0] == track[0] and kept[-1] == track[-1]
+    assert len(kept) < len(track)
+    assert abs(distance_m(kept) - distance_m(track)) / distance_m(track) < 0.05
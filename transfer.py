@@ -1,12 +1,18 @@
 #!/usr/bin/env python3
 import argparse
+import os
 import sys
+import time
 from decimal import Decimal
 from datetime import datetime, timezone
-import xml.etree.ElementTree as ET
 import mysql.connector
 from mysql.connector import errorcode
 
+from anomaly import AnomalyDetector
+from export_parser import iter_export
+from sleep_stages import STAGE_CODES
+from workout_routes import RouteIngestor
+
 def parse_dt(dt_str):
     """
     Parse 'YYYY-MM-DD HH:MM:SS ±HHMM' into UTC naive 'YYYY-MM-DD HH:MM:SS'.
@@ -35,32 +41,93 @@ def to_decimal(val):
     except Exception:
         return None
 
-def ensure_indexes(cnx):
+def ensure_schema(cnx):
+    """Indexes and columns the importer relies on, for databases created from an older queries.sql"""
     cur = cnx.cursor()
+    cur.execute("ALTER TABLE user ADD COLUMN IF NOT EXISTS birth_date DATE")
     # Unique index to support the ON DUPLICATE KEY UPDATE used by your trigger
     cur.execute("""
         CREATE UNIQUE INDEX IF NOT EXISTS uq_health_sample
         ON health_sample (user_id, sample_type, start_time, end_time)
     """)
+    # Per-type range scans (sleep.py reads one user's sleep records in time order)
+    cur.execute("""
+        CREATE INDEX IF NOT EXISTS idx_health_record_user_type_date
+        ON health_record (user_id, type_id, start_date)
+    """)
     cur.close()
     cnx.commit()
 
-def insert_health_record(cur, user_id, attrib):
+class Interner:
+    """In-memory name -> id maps for the health_record lookup tables
+
+    Loaded once per import. A value seen for the first time is inserted with
+    ON DUPLICATE KEY UPDATE id = LAST_INSERT_ID(id), so lastrowid is the id
+    whether this import or a concurrent one created the row.
+    """
+
+    def __init__(self, cur):
+        self.cur = cur
+        self.types = self._load("SELECT name, type_id FROM record_type")
+        self.units = self._load("SELECT name, unit_id FROM record_unit")
+        self.devices = self._load("SELECT name, device_id FROM record_device")
+        cur.execute("SELECT name, version, source_id FROM record_source")
+        self.sources = {(name, version): source_id for name, version, source_id in cur.fetchall()}
+
+    def _load(self, sql):
+        self.cur.execute(sql)
+        return dict(self.cur.fetchall())
+
+    def _intern(self, cache, key, sql, params):
+        value_id = cache.get(key)
+        if value_id is None:
+            self.cur.execute(sql, params)
+            value_id = cache[key] = self.cur.lastrowid
+        return value_id
+
+    def type_id(self, name):
+        if name is None:
+            return None
+        return self._intern(self.types, name, "INSERT INTO record_type (name) VALUES (%s) "
+                            "ON DUPLICATE KEY UPDATE type_id = LAST_INSERT_ID(type_id)", (name,))
+
+    def unit_id(self, name):
+        if name is None:
+            return None
+        return self._intern(self.units, name, "INSERT INTO record_unit (name) VALUES (%s) "
+                            "ON DUPLICATE KEY UPDATE unit_id = LAST_INSERT_ID(unit_id)", (name,))
+
+    def source_id(self, name, version):
+        if name is None:
+            return None
+        key = (name, version or '')
+        return self._intern(self.sources, key, "INSERT INTO record_source (name, version) VALUES (%s, %s) "
+                            "ON DUPLICATE KEY UPDATE source_id = LAST_INSERT_ID(source_id)", key)
+
+    def device_id(self, name):
+        if name is None:
+            return None
+        return self._intern(self.devices, name, "INSERT INTO record_device (name, name_hash) VALUES (%s, UNHEX(MD5(%s))) "
+                            "ON DUPLICATE KEY UPDATE device_id = LAST_INSERT_ID(device_id)", (name, name))
+
+def insert_health_record(cur, interner, user_id, attrib):
     sql = """
     INSERT INTO health_record
-      (user_id, type, unit, value, source_name, source_version, device, creation_date, start_date, end_date)
+      (user_id, type_id, unit_id, value, source_id, device_id, creation_date, start_date, end_date)
     VALUES
-      (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+      (%s, %s, %s, %s, %s, %s, %s, %s, %s)
     """
     value = to_decimal(attrib.get('value'))
+    if value is None:
+        # Sleep stages are category strings; keep their HealthKit code instead of NULL
+        value = STAGE_CODES.get(attrib.get('value'))
     data = (
         user_id,
-        attrib.get('type'),
-        attrib.get('unit'),
+        interner.type_id(attrib.get('type')),
+        interner.unit_id(attrib.get('unit')),
         value,
-        attrib.get('sourceName'),
-        attrib.get('sourceVersion'),
-        attrib.get('device'),
+        interner.source_id(attrib.get('sourceName'), attrib.get('sourceVersion')),
+        interner.device_id(attrib.get('device')),
         parse_dt(attrib.get('creationDate')),
         parse_dt(attrib.get('startDate')),
         parse_dt(attrib.get('endDate')),
@@ -69,10 +136,18 @@ def insert_health_record(cur, user_id, attrib):
     return cur.lastrowid
 
 def insert_metadata_entries(cur, record_id, elem):
-    meta_sql = "INSERT INTO metadata_entry (record_id, meta_key, meta_value) VALUES (%s, %s, %s)"
+    # start_date is copied from the record so both rows land in the same monthly partition
+    meta_sql = "INSERT INTO metadata_entry (record_id, meta_key, meta_value, start_date) VALUES (%s, %s, %s, %s)"
+    start_date = parse_dt(elem.get('startDate'))
     for child in list(elem):
         if child.tag == 'MetadataEntry':
-            cur.execute(meta_sql, (record_id, child.get('key'), child.get('value')))
+            cur.execute(meta_sql, (record_id, child.get('key'), child.get('value'), start_date))
+
+def update_profile(cur, user_id, attrib):
+    """Birth date from the <Me> element (used for age cohorts); left unchanged if absent"""
+    birth_date = attrib.get('HKCharacteristicTypeIdentifierDateOfBirth')
+    if birth_date:
+        cur.execute("UPDATE user SET birth_date = %s WHERE user_id = %s", (parse_date_only(birth_date), user_id))
 
 def insert_workout(cur, user_id, attrib):
     sql = """
@@ -97,6 +172,16 @@ def insert_workout(cur, user_id, attrib):
         attrib.get('sourceName'),
     )
     cur.execute(sql, data)
+    return cur.lastrowid
+
+def route_reference(elem):
+    """Path of the workout's route GPX file inside the export, if it has one"""
+    for child in elem:
+        if child.tag == 'WorkoutRoute':
+            for ref in child:
+                if ref.tag == 'FileReference':
+                    return ref.get('path')
+    return None
 
 def insert_activity_summary(cur, user_id, attrib):
     sql = """
@@ -115,7 +200,11 @@ def insert_activity_summary(cur, user_id, attrib):
     )
     cur.execute(sql, data)
 
-def stream_import(xml_path, db_cfg, user_id, commit_every=500):
+def report_progress(records, started):
+    """Emit a machine-readable progress line (parsed by the API for import metrics)"""
+    print(f"PROGRESS {records} {time.monotonic() - started:.3f}", flush=True)
+
+def stream_import(xml_path, db_cfg, user_id, commit_every=500, parser=None, routes_dir=None):
     try:
         cnx = mysql.connector.connect(**db_cfg)
     except mysql.connector.Error as err:
@@ -127,40 +216,74 @@ def stream_import(xml_path, db_cfg, user_id, commit_every=500):
             print(str(err), file=sys.stderr)
         sys.exit(1)
 
+    routes = None
     try:
-        ensure_indexes(cnx)
+        ensure_schema(cnx)
         cur = cnx.cursor()
+        interner = Interner(cur)
+        detector = AnomalyDetector(cur, user_id)
+        # Route paths are relative to the export folder (workout-routes/*.gpx)
+        routes = RouteIngestor(user_id, routes_dir or os.path.dirname(os.path.abspath(xml_path)))
         batch = 0
+        total = 0
+        started = time.monotonic()
+        # First and last day with imported data, reported for delta sync
+        first_day = last_day = None
 
-        # Use iterparse to stream large XML files
-        context = ET.iterparse(xml_path, events=("end",))
-        for event, elem in context:
+        # Top-level Me/Record/Workout/ActivitySummary elements, each freed after use.
+        # Records nested in a Correlation repeat top-level ones and are skipped.
+        for elem in iter_export(xml_path, parser=parser):
             tag = elem.tag
+            day = None
 
             if tag == 'Record':
-                record_id = insert_health_record(cur, user_id, elem.attrib)
+                record_id = insert_health_record(cur, interner, user_id, elem.attrib)
                 insert_metadata_entries(cur, record_id, elem)
+                start = parse_dt(elem.get('startDate'))
+                detector.observe(elem.get('type'), start, to_decimal(elem.get('value')))
+                day = (start or '')[:10]
                 batch += 1
 
             elif tag == 'Workout':
-                insert_workout(cur, user_id, elem.attrib)
+                workout_id = insert_workout(cur, user_id, elem.attrib)
+                routes.submit(workout_id, route_reference(elem))
+                routes.drain(cur)
+                day = (parse_dt(elem.get('startDate')) or '')[:10]
                 batch += 1
 
             elif tag == 'ActivitySummary':
                 insert_activity_summary(cur, user_id, elem.attrib)
+                day = elem.get('dateComponents')
                 batch += 1
 
+            elif tag == 'Me':
+                update_profile(cur, user_id, elem.attrib)
+
+            if day:
+                first_day = min(first_day or day, day)
+                last_day = max(last_day or day, day)
             if batch >= commit_every:
                 cnx.commit()
+                total += batch
                 batch = 0
+                report_progress(total, started)
 
-            # Free memory
-            elem.clear()
-
-        if batch > 0:
-            cnx.commit()
+        # Anomaly state is only written with the last batch, so a failed import keeps its watermark
+        detector.flush(cur)
+        routes.drain(cur, wait=True)
+        cnx.commit()
+        total += batch
+        report_progress(total, started)
+        if detector.detected:
+            print(f"Detected {detector.detected} HRV/resting HR anomalies")
+        if routes.imported or routes.failed:
+            print(f"Imported {routes.imported} workout routes ({routes.failed} unreadable)")
+        if first_day:
+            print(f"CHANGED {first_day} {last_day}")
         cur.close()
     finally:
+        if routes is not None:
+            routes.close()
         cnx.close()
 
 def main():
@@ -173,6 +296,10 @@ def main():
     parser.add_argument("--db-user", required=True, help="Database user")
     parser.add_argument("--db-pass", required=True, help="Database password")
     parser.add_argument("--commit-every", type=int, default=500, help="Commit interval for batch inserts")
+    parser.add_argument("--parser", choices=("stdlib", "lxml"), default=None,
+                        help="XML parser (default: EXPORT_PARSER or stdlib)")
+    parser.add_argument("--routes-dir", default=None,
+                        help="Folder containing workout-routes/ (default: the folder of export.xml)")
     args = parser.parse_args()
 
     db_cfg = {
@@ -182,7 +309,7 @@ def main():
         "user": args.db_user,
         "password": args.db_pass,
     }
-    stream_import(args.xml, db_cfg, args.user_id, args.commit_every)
+    stream_import(args.xml, db_cfg, args.user_id, args.commit_every, args.parser, args.routes_dir)
     print("Import completed successfully.")
 
 if __name__ == "__main__":
@@ -0,0 +1,253 @@
+# Background user deletion in bounded primary-key batches
+import os
+import queue
+import socket
+import threading
+import time
+import uuid
+from typing import Dict, Any, List, Optional, Tuple
+
+import mysql.connector
+
+import partitions
+from database import cursor, fetch_all, fetch_one, execute
+
+# Rows removed per transaction, and pause between batches so imports and
+# reads for other users get a share of the primary
+BATCH_SIZE = int(os.getenv("USER_DELETE_BATCH_SIZE", "5000"))
+BATCH_PAUSE_S = float(os.getenv("USER_DELETE_BATCH_PAUSE_MS", "50")) / 1000.0
+# Passes over all tables before giving up on rows that keep appearing
+MAX_PASSES = 3
+# A running job not updated for this long belongs to a dead process and may be taken over
+STALE_JOB_S = int(os.getenv("USER_DELETE_STALE_S", "900"))
+
+# (phase, table, primary key, keyset columns) in foreign-key order. The keyset
+# columns end with the primary key and follow an index led by user_id, so each
+# batch is a short range scan in index order. health_record is handled together
+# with its metadata_entry rows, workout with its route rows.
+PHASES: List[Tuple[str, str, str, Tuple[str, ...]]] = [
+    ("chat_messages", "chat_messages", "message_id", ("message_id",)),
+    ("chats", "chats", "chat_id", ("chat_id",)),
+    # idx_health_record_user_date; its entries carry the (record_id, start_date) key
+    ("health_record", "health_record", "record_id", ("start_date", "record_id")),
+    ("health_sample", "health_sample", "sample_id", ("sample_id",)),
+    ("hrv", "hrv", "hrv_id", ("hrv_id",)),
+    ("activity_summary", "activity_summary", "summary_id", ("summary_id",)),
+    ("workout", "workout", "workout_id", ("workout_id",)),
+    ("anomaly_event", "anomaly_event", "event_id", ("day", "event_id")),
+    ("anomaly_state", "anomaly_state", "state_id", ("metric", "state_id")),
+    ("sleep_session", "sleep_session", "session_id", ("night", "session_id")),
+    ("user_percentile", "user_percentile", "percentile_id", ("metric", "percentile_id")),
+    ("data_change", "data_change", "change_id", ("change_id",)),
+]
+# Phases of the partitioned tables, which have no foreign key to user
+PARTITIONED_PHASES = [p for p in PHASES if p[0] == "health_record"]
+
+# (user_id, pk) indexes for the keyset scans, for databases created before them
+_MIGRATIONS = (
+    "ALTER TABLE user_deletion_job ADD COLUMN IF NOT EXISTS owner VARCHAR(64)",
+    "CREATE INDEX IF NOT EXISTS idx_health_sample_user ON health_sample (user_id, sample_id)",
+    "CREATE INDEX IF NOT EXISTS idx_hrv_user ON hrv (user_id, hrv_id)",
+    "CREATE INDEX IF NOT EXISTS idx_activity_user ON activity_summary (user_id, summary_id)",
+    "CREATE INDEX IF NOT EXISTS idx_workout_user ON workout (user_id, workout_id)",
+)
+
+# Phases whose rows are found through another table
+_BATCH_SQL = {
+    "chat_messages": """
+        SELECT cm.message_id FROM chat_messages cm JOIN chats c ON cm.chat_id = c.chat_id
+        WHERE c.user_id = %s {after} ORDER BY cm.message_id LIMIT %s
+    """,
+}
+
+
+def _after(order: Tuple[str, ...]) -> str:
+    """Keyset condition `order > (%s, ...)`, spelled out so it is a range on the index"""
+    terms = []
+    for i, col in enumerate(order):
+        terms.append("(" + " AND ".join([f"{c} = %s" for c in order[:i]] + [f"{col} > %s"]) + ")")
+    return "(" + " OR ".join(terms) + ")"
+
+
+def _after_params(last: Tuple[Any, ...]) -> Tuple[Any, ...]:
+    return tuple(v for i in range(len(last)) for v in last[:i + 1])
+
+
+def _batch_sql(phase: str, table: str, order: Tuple[str, ...], after: bool) -> str:
+    if phase in _BATCH_SQL:
+        return _BATCH_SQL[phase].format(after=f"AND cm.{order[0]} > %s" if after else "")
+    cols = ", ".join(order)
+    where = f"user_id = %s AND {_after(order)}" if after else "user_id = %s"
+    return f"SELECT {cols} FROM {table} WHERE {where} ORDER BY {cols} LIMIT %s"
+
+
+class DeletionJobs:
+    """Runs user deletions one at a time on a background thread
+
+    Each job is a row in user_deletion_job, so progress can be polled and
+    unfinished jobs are picked up again after a restart. Every worker process
+    queues the unfinished jobs, but a job only runs in the one that claims it. The user's password
+    is cleared first, which stops logins (and therefore new uploads) while
+    the data is removed batch by batch, each batch in its own short transaction.
+    """
+
+    def __init__(self, batch_size: int = BATCH_SIZE, pause_s: float = BATCH_PAUSE_S):
+        self.batch_size = batch_size
+        self.pause_s = pause_s
+        self._queue: "queue.Queue[str]" = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"[:64]
+
+    def _ensure_worker(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="user-deletion", daemon=True)
+                self._thread.start()
+
+    def submit(self, user_id: int) -> Dict[str, Any]:
+        """Lock the account and queue its deletion; returns the job status"""
+        existing = fetch_one(
+            "SELECT job_id FROM user_deletion_job WHERE user_id = %s AND status IN ('queued', 'running')",
+            (user_id,), read=False
+        )
+        if existing:
+            return self.status(existing["job_id"])
+
+        job_id = str(uuid.uuid4())
+        with cursor(commit=True) as cur:
+            cur.execute("UPDATE user SET password = '' WHERE user_id = %s", (user_id,))
+            cur.execute(
+                "INSERT INTO user_deletion_job (job_id, user_id, status, phase) VALUES (%s, %s, 'queued', %s)",
+                (job_id, user_id, PHASES[0][0])
+            )
+        self._queue.put(job_id)
+        self._ensure_worker()
+        return self.status(job_id)
+
+    def resume_pending(self) -> int:
+        """Re-queue jobs left unfinished by a previous process"""
+        for sql in _MIGRATIONS:
+            execute(sql, ())
+        rows = fetch_all(
+            "SELECT job_id FROM user_deletion_job WHERE status IN ('queued', 'running') ORDER BY created_at",
+            (), read=False
+        )
+        for row in rows:
+            self._queue.put(row["job_id"])
+        if rows:
+            self._ensure_worker()
+        return len(rows)
+
+    def status(self, job_id: str) -> Optional[Dict[str, Any]]:
+        return fetch_one(
+            "SELECT job_id, status, phase, rows_deleted, error, created_at, updated_at, finished_at "
+            "FROM user_deletion_job WHERE job_id = %s",
+            (job_id,), read=False
+        )
+
+    def _claim(self, job_id: str) -> bool:
+        """Atomically take a queued job, or a running one whose process stopped updating it"""
+        result = execute(
+            "UPDATE user_deletion_job SET status = 'running', owner = %s WHERE job_id = %s "
+            "AND (status = 'queued' OR (status = 'running' AND updated_at < NOW() - INTERVAL %s SECOND))",
+            (self.owner, job_id, STALE_JOB_S)
+        )
+        return result["rowcount"] == 1
+
+    def _update(self, job_id: str, **fields):
+        sets = ", ".join(f"{k} = %s" for k in fields)
+        execute(f"UPDATE user_deletion_job SET {sets} WHERE job_id = %s", tuple(fields.values()) + (job_id,))
+
+    def _run(self):
+        while True:
+            job_id = self._queue.get()
+            try:
+                self._process(job_id)
+            except Exception as e:
+                print(f"User deletion job {job_id} failed: {e}")
+                try:
+                    self._update(job_id, status="failed", error=str(e)[:1000])
+                except Exception as update_error:
+                    print(f"Could not record failure of deletion job {job_id}: {update_error}")
+
+    def _delete_batch(self, phase: str, table: str, pk: str, rows: List[Dict[str, Any]]) -> int:
+        keys = tuple(row[pk] for row in rows)
+        marks = ", ".join(["%s"] * len(keys))
+        with cursor(commit=True, label=f"user_deletion.{phase}") as cur:
+            deleted = 0
+            if phase == "health_record":
+                # Full primary key: the batch's start_date range prunes to the partitions it spans
+                span = (rows[0]["start_date"], rows[-1]["start_date"])
+                for child in ("metadata_entry", "health_record"):
+                    cur.execute(f"DELETE FROM {child} WHERE record_id IN ({marks}) AND start_date BETWEEN %s AND %s",
+                                keys + span)
+                    deleted += cur.rowcount
+                return deleted
+            if phase == "workout":
+                for child in ("workout_route_level", "workout_route"):
+                    cur.execute(f"DELETE FROM {child} WHERE workout_id IN ({marks})", keys)
+                    deleted += cur.rowcount
+            cur.execute(f"DELETE FROM {table} WHERE {pk} IN ({marks})", keys)
+            return deleted + cur.rowcount
+
+    def _sweep(self, job_id: str, user_id: int, phases, total: int) -> int:
+        """Delete the user's rows of `phases` batch by batch; returns the updated running total"""
+        for phase, table, pk, order in phases:
+            self._update(job_id, phase=phase)
+            last = None
+            while True:
+                sql = _batch_sql(phase, table, order, last is not None)
+                params = (user_id,) + (_after_params(last) if last is not None else ()) + (self.batch_size,)
+                rows = fetch_all(sql, params, label=f"user_deletion.{phase}.keys", read=False)
+                if not rows:
+                    break
+                total += self._delete_batch(phase, table, pk, rows)
+                last = tuple(rows[-1][c] for c in order)
+                self._update(job_id, rows_deleted=total)
+                if self.pause_s:
+                    time.sleep(self.pause_s)
+        return total
+
+    def _has_partitioned_rows(self, user_id: int) -> bool:
+        # metadata_entry rows are committed with their health_record row, so checking the records covers both
+        return fetch_one("SELECT 1 AS found FROM health_record WHERE user_id = %s LIMIT 1",
+                         (user_id,), read=False) is not None
+
+    def _process(self, job_id: str):
+        # Another worker process already runs it (or it finished)
+        if not self._claim(job_id):
+            return
+        job = fetch_one(
+            "SELECT user_id, rows_deleted FROM user_deletion_job WHERE job_id = %s", (job_id,), read=False
+        )
+        user_id, total = job["user_id"], job["rows_deleted"] or 0
+
+        for _ in range(MAX_PASSES):
+            total = self._sweep(job_id, user_id, PHASES, total)
+            # Rows were added while we were deleting (e.g. an import that was
+            # already running); sweep the tables again. Foreign keys catch that
+            # for every table but the partitioned ones, which are checked here.
+            if self._has_partitioned_rows(user_id):
+                continue
+            try:
+                execute("DELETE FROM user WHERE user_id = %s", (user_id,))
+                break
+            except mysql.connector.IntegrityError:
+                continue
+        else:
+            raise RuntimeError(f"User {user_id} still has data after {MAX_PASSES} passes")
+        # An import batch committed between the check and the delete has nothing to fail on
+        total = self._sweep(job_id, user_id, PARTITIONED_PHASES, total)
+
+        # Months already archived to Parquet by partitions.py
+        self._update(job_id, phase="archive")
+        total += partitions.purge_user(user_id)
+
+        execute(
+            "UPDATE user_deletion_job SET status = 'done', phase = 'user', rows_deleted = %s, finished_at = NOW() "
+            "WHERE job_id = %s", (total, job_id)
+        )
+
+
+deletion_jobs = DeletionJobs()
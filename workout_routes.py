@@ -0,0 +1,250 @@
+# Workout route GPX parsing and polyline simplification, run by transfer.py on a process pool
+import math
+import os
+import xml.etree.ElementTree as ET
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+# Douglas-Peucker tolerances in metres, one stored level each; level 0 is the full track
+LEVEL_TOLERANCES_M = (0.0, 2.0, 5.0, 15.0, 50.0)
+# GPX parsing processes; 0 parses in the importer process
+WORKERS = int(os.getenv("ROUTE_WORKERS", str(max(1, (os.cpu_count() or 2) // 2))))
+# Routes parsed ahead of the inserts, per worker, before the importer waits
+MAX_PENDING_PER_WORKER = 4
+
+EARTH_RADIUS_M = 6371008.8
+POLYLINE_PRECISION = 5
+
+Point = Tuple[float, float]
+
+_ROUTE_SQL = """
+    INSERT INTO workout_route
+      (workout_id, user_id, point_count, distance_m, min_lat, min_lon, max_lat, max_lon, start_time, end_time)
+    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+"""
+
+_LEVEL_SQL = """
+    INSERT INTO workout_route_level (workout_id, level, tolerance_m, point_count, polyline)
+    VALUES (%s, %s, %s, %s, %s)
+"""
+
+
+def parse_gpx(path: str) -> Tuple[List[Point], Optional[str], Optional[str]]:
+    """(lat, lon) track points of a GPX file plus the first and last point times
+
+    Points are read with iterparse and each finished point is dropped from its
+    segment, so a long track never holds more than its coordinate list.
+    """
+    points: List[Point] = []
+    first_time = last_time = None
+    segment = None
+    for event, elem in ET.iterparse(path, events=("start", "end")):
+        tag = elem.tag.rpartition("}")[2]
+        if event == "start":
+            if tag == "trkseg":
+                segment = elem
+            continue
+        if tag != "trkpt":
+            continue
+        lat, lon = elem.get("lat"), elem.get("lon")
+        if lat is not None and lon is not None:
+            points.append((float(lat), float(lon)))
+            for child in elem:
+                if child.tag.rpartition("}")[2] == "time":
+                    last_time = child.text
+                    first_time = first_time or last_time
+        if segment is not None:
+            segment.clear()
+    return points, first_time, last_time
+
+
+def distance_m(points: List[Point]) -> float:
+    """Haversine length of a track"""
+    total = 0.0
+    for (lat1, lon1), (lat2, lon2) in zip(points, points[1:]):
+        p1, p2 = math.radians(lat1), math.radians(lat2)
+        a = math.sin((p2 - p1) / 2) ** 2 + math.cos(p1) * math.cos(p2) * math.sin(math.radians(lon2 - lon1) / 2) ** 2
+        total += 2 * EARTH_RADIUS_M * math.asin(math.sqrt(min(1.0, a)))
+    return total
+
+
+def simplify(points: List[Point], tolerance_m: float) -> List[Point]:
+    """Douglas-Peucker simplification keeping every point further than tolerance_m from the line
+
+    Coordinates are projected to local metres (equirectangular, fine at route
+    scale) and the subdivision uses an explicit stack instead of recursion.
+    """
+    n = len(points)
+    if tolerance_m <= 0 or n < 3:
+        return list(points)
+    lat0 = math.radians(points[0][0])
+    kx = EARTH_RADIUS_M * math.cos(lat0) * math.pi / 180
+    ky = EARTH_RADIUS_M * math.pi / 180
+    xy = [(lon * kx, lat * ky) for lat, lon in points]
+    keep = bytearray(n)
+    keep[0] = keep[n - 1] = 1
+    tolerance_sq = tolerance_m * tolerance_m
+    stack = [(0, n - 1)]
+    while stack:
+        first, last = stack.pop()
+        ax, ay = xy[first]
+        dx, dy = xy[last][0] - ax, xy[last][1] - ay
+        seg_sq = dx * dx + dy * dy
+        worst, worst_sq = -1, tolerance_sq
+        for i in range(first + 1, last):
+            px, py = xy[i][0] - ax, xy[i][1] - ay
+            t = (px * dx + py * dy) / seg_sq if seg_sq else 0.0
+            if t < 0:
+                t = 0.0
+            elif t > 1:
+                t = 1.0
+            ex, ey = px - t * dx, py - t * dy
+            d_sq = ex * ex + ey * ey
+            if d_sq > worst_sq:
+                worst, worst_sq = i, d_sq
+        if worst > 0:
+            keep[worst] = 1
+            stack.append((first, worst))
+            stack.append((worst, last))
+    return [p for p, k in zip(points, keep) if k]
+
+
+def _encode_value(value: int, out: List[str]):
+    value = ~(value << 1) if value < 0 else value << 1
+    while value >= 0x20:
+        out.append(chr((0x20 | (value & 0x1f)) + 63))
+        value >>= 5
+    out.append(chr(value + 63))
+
+
+def encode_polyline(points: List[Point], precision: int = POLYLINE_PRECISION) -> str:
+    """Encoded polyline (the Google Maps format, about 1 m at precision 5)"""
+    factor = 10 ** precision
+    out: List[str] = []
+    prev_lat = prev_lon = 0
+    for lat, lon in points:
+        ilat, ilon = round(lat * factor), round(lon * factor)
+        _encode_value(ilat - prev_lat, out)
+        _encode_value(ilon - prev_lon, out)
+        prev_lat, prev_lon = ilat, ilon
+    return "".join(out)
+
+
+def decode_polyline(encoded: str, precision: int = POLYLINE_PRECISION) -> List[Point]:
+    factor = 10 ** precision
+    points: List[Point] = []
+    index = 0
+    coords = [0, 0]
+    while index < len(encoded):
+        for k in range(2):
+            result = shift = 0
+            while True:
+                b = ord(encoded[index]) - 63
+                index += 1
+                result |= (b & 0x1f) << shift
+                shift += 5
+                if b < 0x20:
+                    break
+            coords[k] += ~(result >> 1) if result & 1 else result >> 1
+        lat, lon = coords
+        points.append((lat / factor, lon / factor))
+    return points
+
+
+def build_route(path: str) -> Optional[Dict[str, Any]]:
+    """Parse one GPX file into its summary and encoded simplification levels (the pool task)"""
+    points, first_time, last_time = parse_gpx(path)
+    if len(points) < 2:
+        return None
+    lats = [p[0] for p in points]
+    lons = [p[1] for p in points]
+    levels = []
+    previous = None
+    for tolerance in LEVEL_TOLERANCES_M:
+        simplified = simplify(points, tolerance)
+        # A coarser tolerance that removes nothing would duplicate the level before it
+        if previous is not None and len(simplified) == previous:
+            continue
+        previous = len(simplified)
+        levels.append((len(levels), tolerance, len(simplified), encode_polyline(simplified)))
+    return {
+        "point_count": len(points),
+        "distance_m": round(distance_m(points), 1),
+        "bbox": (min(lats), min(lons), max(lats), max(lons)),
+        "start_time": first_time,
+        "end_time": last_time,
+        "levels": levels,
+    }
+
+
+def _gpx_time(value: Optional[str]) -> Optional[str]:
+    """GPX 'YYYY-MM-DDTHH:MM:SS[.fff]Z' as a UTC 'YYYY-MM-DD HH:MM:SS' string"""
+    if not value or len(value) < 19:
+        return None
+    return value[:10] + " " + value[11:19]
+
+
+class RouteIngestor:
+    """Parses a workout's route files on a process pool and inserts the results
+
+    `submit` queues a GPX file for a just-inserted workout; `drain` writes
+    finished routes in the caller's transaction and, when too many are
+    pending (or `wait` is set), blocks on the oldest so memory stays bounded.
+    """
+
+    def __init__(self, user_id: int, root: str, workers: int = WORKERS):
+        self.user_id = user_id
+        self.root = os.path.realpath(root)
+        self.pool = ProcessPoolExecutor(max_workers=workers) if workers > 0 else None
+        self.max_pending = max(1, workers) * MAX_PENDING_PER_WORKER
+        self.pending: Deque[Tuple[int, Future]] = deque()
+        self.imported = 0
+        self.failed = 0
+
+    def resolve(self, reference: Optional[str]) -> Optional[str]:
+        """Absolute path of a FileReference inside the export, or None if missing or outside it"""
+        if not reference:
+            return None
+        path = os.path.realpath(os.path.join(self.root, reference.lstrip("/")))
+        if not path.startswith(self.root + os.sep) or not os.path.isfile(path):
+            return None
+        return path
+
+    def submit(self, workout_id: int, reference: Optional[str]) -> bool:
+        path = self.resolve(reference)
+        if path is None:
+            return False
+        if self.pool is None:
+            future: Future = Future()
+            try:
+                future.set_result(build_route(path))
+            except Exception as e:
+                future.set_exception(e)
+        else:
+            future = self.pool.submit(build_route, path)
+        self.pending.append((workout_id, future))
+        return True
+
+    def drain(self, cur, wait: bool = False):
+        while self.pending:
+            workout_id, future = self.pending[0]
+            if not (wait or future.done() or len(self.pending) > self.max_pending):
+                break
+            self.pending.popleft()
+            try:
+                route = future.result()
+            except Exception as e:
+                print(f"Could not parse route of workout {workout_id}: {e}")
+                self.failed += 1
+                continue
+            if route is None:
+                continue
+            cur.execute(_ROUTE_SQL, (workout_id, self.user_id, route["point_count"], route["distance_m"],
+                                     *route["bbox"], _gpx_time(route["start_time"]), _gpx_time(route["end_time"])))
+            cur.executemany(_LEVEL_SQL, [(workout_id, *level) for level in route["levels"]])
+            self.imported += 1
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.shutdown(cancel_futures=True)